@@ -0,0 +1,88 @@
+"""This module contains a benchmark of the matching operations and of the
+color space conversions for development, it compares their run times on the
+same images and reports the accuracy of the lookup table conversions"""
+# pylint: disable=missing-function-docstring (C0116)
+import functools
+import timeit
+from typing import Dict
+
+import numpy as np
+
+from matching import Operation
+from matching.operations import FeatureDistributionMatching, MeanStdMatching
+from utils.cs_conversion import ColorSpaceConverter
+from utils.cs_conversion.cs_lut import LutConverter
+from utils.cs_conversion.cs_rgb_to_hsv import RgbToHsvConverter
+from utils.cs_conversion.cs_rgb_to_lab import RgbToLabConverter
+
+# shapes of the benchmarked source images (H, W, C)
+SHAPES = ((480, 640, 3), (1080, 1920, 3), (2160, 3840, 3))
+
+REPEATS = 5
+
+# grid sizes of the benchmarked lookup tables
+LUT_GRID_SIZES = (33, 65)
+
+
+def operations() -> Dict[str, Operation]:
+    channel_ranges = RgbToLabConverter().target_channel_ranges()
+    channels = tuple(range(len(channel_ranges)))
+    return {'fdm': FeatureDistributionMatching(channels, channel_ranges),
+            'msm': MeanStdMatching(channels, channel_ranges)}
+
+
+def converters() -> Dict[str, ColorSpaceConverter]:
+    return {'lab': RgbToLabConverter(), 'hsv': RgbToHsvConverter()}
+
+
+def benchmark_operations() -> None:
+    rng = np.random.default_rng(1337)
+    converter = RgbToLabConverter()
+    for shape in SHAPES:
+        source = converter.convert(rng.random(shape, dtype=np.float32))
+        reference = converter.convert(rng.beta(2., 5., shape).astype(
+            np.float32))
+        out = np.empty(source.shape, dtype=np.float32)
+
+        print(f'---> BENCHMARK: {shape[1]}x{shape[0]}')
+        times: Dict[str, float] = {}
+        for name, operation in operations().items():
+            times[name] = min(timeit.repeat(
+                functools.partial(operation, source, reference, out=out),
+                number=1, repeat=REPEATS))
+            print(f'{name}: {times[name] * 1e3:.1f} ms')
+        print(f'speedup: {times["fdm"] / times["msm"]:.2f}x\n')
+
+
+def benchmark_converters() -> None:
+    rng = np.random.default_rng(1337)
+    image = rng.integers(0, 256, SHAPES[1], dtype=np.uint8)
+    image_float = image.astype(np.float32) / 255.
+
+    print(f'---> CONVERSION: {SHAPES[1][1]}x{SHAPES[1][0]}')
+    for name, converter in converters().items():
+        time = min(timeit.repeat(
+            functools.partial(converter.convert, image_float),
+            number=1, repeat=REPEATS))
+        print(f'{name} opencv: {time * 1e3:.1f} ms')
+        for grid_size in LUT_GRID_SIZES:
+            lut_converter = LutConverter(converter, grid_size, inverse=True)
+            accuracy = lut_converter.accuracy(image)
+            time = min(timeit.repeat(
+                functools.partial(lut_converter.convert, image),
+                number=1, repeat=REPEATS))
+            print(f'{name} grid {grid_size}: {time * 1e3:.1f} ms, '
+                  f'error max {accuracy.max_error:.4f} '
+                  f'mean {accuracy.mean_error:.4f}, '
+                  f'error back max {accuracy.max_error_back:.4f} '
+                  f'mean {accuracy.mean_error_back:.4f}')
+        print()
+
+
+def main() -> None:
+    benchmark_operations()
+    benchmark_converters()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,7 @@
 # pylint: disable=missing-module-docstring (C0114)
 # flake8: noqa
-from .constants import (DIM_1, DIM_2, DIM_3, FDM, GRAY, HM, HM_PLOT_FILE, HSV,
-                        IMAGE_CHANNELS, LAB, MATCH_FULL, MATCH_ZERO, RGB)
+from .constants import (CACHE_SIZE_MB, DIM_1, DIM_2, DIM_3, DIM_4, FDM,
+                        FDM_REFERENCE, GRAY, HM, HM_PLOT_FILE, HM_REFERENCE,
+                        HSV, IMAGE_CHANNELS, LAB, MATCH_FULL, MATCH_ZERO, MSM,
+                        OPPONENT, REDUCTIONS, REFERENCE_BINS, RGB, XYZ, YCBCR)
 from .params import Params
@@ -3,7 +3,10 @@
 GRAY = 'gray'
 HSV = 'hsv'
 LAB = 'lab'
+OPPONENT = 'opponent'
 RGB = 'rgb'
+XYZ = 'xyz'
+YCBCR = 'ycbcr'
 
 # image channels
 IMAGE_CHANNELS = '0,1,2'
@@ -11,6 +14,11 @@ IMAGE_CHANNELS = '0,1,2'
 # image matching operations
 FDM = 'fdm'
 HM = 'hm'
+MSM = 'msm'
+
+# reference statistics tools
+FDM_REFERENCE = 'fdm-reference'
+HM_REFERENCE = 'hm-reference'
 
 # match proportion range
 MATCH_ZERO = 0.0
@@ -19,5 +27,15 @@ MATCH_FULL = 1.0
 DIM_1 = 1
 DIM_2 = 2
 DIM_3 = 3
+DIM_4 = 4
 
 HM_PLOT_FILE = 'hm_plot.png'
+
+# default size limit of the reference statistics cache in megabytes
+CACHE_SIZE_MB = 256
+
+# default number of bins of the histograms of a dataset
+REFERENCE_BINS = 1024
+
+# factors by which images can be decoded at reduced resolution
+REDUCTIONS = (1, 2, 4, 8)
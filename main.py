@@ -4,10 +4,15 @@ from typing import Any, Callable
 
 import click
 
-from core import (FDM, GRAY, HM, HSV, IMAGE_CHANNELS, LAB, MATCH_FULL,
-                  MATCH_ZERO, RGB, Params)
+from core import (CACHE_SIZE_MB, FDM, FDM_REFERENCE, GRAY, HM, HM_REFERENCE,
+                  HSV, IMAGE_CHANNELS, LAB, MATCH_FULL, MATCH_ZERO, MSM,
+                  OPPONENT, REDUCTIONS, REFERENCE_BINS, RGB, XYZ, YCBCR,
+                  Params)
 from utils import application
 
+# color spaces of all commands
+COLOR_SPACES = [GRAY, HSV, LAB, OPPONENT, RGB, XYZ, YCBCR]
+
 
 def command_wrapper(func: Callable[..., Any]) -> Callable[..., Any]:
     """
@@ -18,8 +23,7 @@ def command_wrapper(func: Callable[..., Any]) -> Callable[..., Any]:
 
     @wraps(func)
     @click.option('--color-space', '-s', 'color_space', default=RGB,
-                  type=click.Choice([GRAY, HSV, LAB, RGB],
-                                    case_sensitive=False),
+                  type=click.Choice(COLOR_SPACES, case_sensitive=False),
                   help='color space')
     @click.option('--channels', '-c', 'channels', default=IMAGE_CHANNELS,
                   type=click.Choice(
@@ -30,6 +34,29 @@ def command_wrapper(func: Callable[..., Any]) -> Callable[..., Any]:
                   help='creates the visualization for an applied operation')
     @click.option('--verify-input', '-v', 'verify_input', default=False,
                   type=bool, help='input data verification')
+    @click.option('--cache-dir', 'cache_dir', default=None,
+                  type=click.Path(file_okay=False),
+                  help='directory of a persistent cache of the reference '
+                       'statistics, which are reused while the reference '
+                       'file, the color space and the statistics parameters '
+                       'are unchanged (default is no cache)')
+    @click.option('--cache-size', 'cache_size', default=CACHE_SIZE_MB,
+                  type=click.IntRange(min=0),
+                  help=f'size limit of the cache in megabytes, the least '
+                       f'recently used statistics are evicted '
+                       f'(default is {CACHE_SIZE_MB})')
+    @click.option('--reduction', '-r', 'reduction', default='1',
+                  type=click.Choice([str(r) for r in REDUCTIONS]),
+                  help='factor by which the reference is decoded at reduced '
+                       'resolution for its statistics, JPEG images are '
+                       'decoded reduced, others are downscaled '
+                       '(default is 1, full resolution)')
+    @click.option('--reduce-source', 'reduce_source', is_flag=True,
+                  default=False,
+                  help='computes the source statistics from a decode '
+                       'reduced by the reduction as well, the mapping is '
+                       'applied to the source in full resolution; requires '
+                       'an operation that matches by means of statistics')
     @click.argument('source_path', type=click.Path(exists=True))
     @click.argument('reference_path', type=click.Path(exists=True))
     @click.argument('result_path', type=click.Path(exists=False))
@@ -59,17 +86,87 @@ def command_fdm() -> None:
 
 @main.command(name=HM, help='Histogram Matching')
 @click.option('--match-proportion', '-m', 'match_proportion',
-              default=MATCH_FULL,
+              default=(MATCH_FULL,), multiple=True,
               type=click.FloatRange(MATCH_ZERO, MATCH_FULL),
               help=f'interpolation strength between source and reference '
                    f'histograms, {MATCH_FULL} (default) is full matching, '
-                   f'{MATCH_ZERO} is no matching')
+                   f'{MATCH_ZERO} is no matching; if given several times, '
+                   f'the histograms are matched once and one result per '
+                   f'proportion is written with the proportion appended '
+                   f'to the result file name')
+@click.option('--bins', '-b', 'bins', default=None,
+              type=click.IntRange(min=1),
+              help='number of histogram bins per channel, enables the '
+                   'approximate binned matching of float channels '
+                   '(default is exact matching)')
+@click.option('--quantiles', '-q', 'quantiles', default=None,
+              type=click.IntRange(min=2),
+              help='number of uniformly spaced quantiles of the dense '
+                   'inverse CDF table of the reference (default is direct '
+                   'interpolation of the reference CDF)')
 @click.pass_context
 @command_wrapper
 def command_hm() -> None:
     """ Histogram Matching command function """
 
 
+@main.command(name=MSM, help='Mean and Standard Deviation Matching')
+@click.pass_context
+@command_wrapper
+def command_msm() -> None:
+    """ Mean and Standard Deviation Matching command function """
+
+
+@main.command(name=HM_REFERENCE,
+              help='Histograms of a dataset of reference images, which can '
+                   'be given to Histogram Matching in place of a reference '
+                   'image')
+@click.option('--color-space', '-s', 'color_space', default=RGB,
+              type=click.Choice(COLOR_SPACES, case_sensitive=False),
+              help='color space')
+@click.option('--bins', '-b', 'bins', default=REFERENCE_BINS,
+              type=click.IntRange(min=1),
+              help=f'number of histogram bins per channel '
+                   f'(default is {REFERENCE_BINS})')
+@click.option('--workers', '-w', 'workers', default=1,
+              type=click.IntRange(min=1),
+              help='number of worker processes, each accumulates the '
+                   'histograms of a chunk of the images')
+@click.option('--reduction', '-r', 'reduction', default='1',
+              type=click.Choice([str(r) for r in REDUCTIONS]),
+              help='factor by which the images are decoded at reduced '
+                   'resolution (default is 1, full resolution)')
+@click.argument('reference_dir', type=click.Path(exists=True,
+                                                 file_okay=False))
+@click.argument('result_path', type=click.Path(exists=False))
+def command_hm_reference(**kwargs: Any) -> None:
+    """ Reference histograms command function """
+    application.write_reference_histograms(Params(kwargs))
+
+
+@main.command(name=FDM_REFERENCE,
+              help='Mean and covariance of a dataset of reference images, '
+                   'which can be given to Feature Distribution Matching in '
+                   'place of a reference image')
+@click.option('--color-space', '-s', 'color_space', default=RGB,
+              type=click.Choice(COLOR_SPACES, case_sensitive=False),
+              help='color space')
+@click.option('--workers', '-w', 'workers', default=1,
+              type=click.IntRange(min=1),
+              help='number of worker processes, each accumulates the '
+                   'moments of a chunk of the images')
+@click.option('--reduction', '-r', 'reduction', default='1',
+              type=click.Choice([str(r) for r in REDUCTIONS]),
+              help='factor by which the images are decoded at reduced '
+                   'resolution (default is 1, full resolution)')
+@click.argument('reference_dir', type=click.Path(exists=True,
+                                                 file_okay=False))
+@click.argument('result_path', type=click.Path(exists=False))
+def command_fdm_reference(**kwargs: Any) -> None:
+    """ Reference moments command function """
+    application.write_reference_moments(Params(kwargs))
+
+
 def run(ctx: click.core.Context) -> None:
     """ Calls the main program with the parameters available in the context """
     application.run(ctx.command.name, Params(ctx.obj))
@@ -1,10 +1,10 @@
 """This module defines Operation interface"""
 import abc
-from typing import Tuple
+from typing import Any, Iterable, Optional, Tuple
 
 import numpy as np
 
-from core import DIM_3
+from core import DIM_3, DIM_4
 
 ChannelsType = Tuple[int, ...]
 
@@ -16,6 +16,9 @@ class Operation(abc.ABC):
 
     # pylint: disable=too-few-public-methods (R0903)
 
+    # data types accepted by the input verification
+    _input_types: Tuple[type, ...] = _FLOAT_TYPES
+
     def __init__(self, channels: ChannelsType, check_input: bool = False):
         self.channels = channels
         self.check_input = check_input
@@ -62,26 +65,136 @@ class Operation(abc.ABC):
                 f'have to be the same, but source has '
                 f'{source.shape[-1]} and reference has '
                 f'{reference.shape[-1]}')
-        if source.dtype not in _FLOAT_TYPES:
-            raise TypeError(f'Source has to be of float type,'
-                            f'but it is {source.dtype}')
-        if reference.dtype not in _FLOAT_TYPES:
-            raise TypeError(f'Reference has to be of float type, '
-                            f'but it is {reference.dtype}')
+        if source.dtype not in self._input_types:
+            raise TypeError(f'Source has to be of one of the types '
+                            f'{self._input_types}, but it is {source.dtype}')
+        if reference.dtype not in self._input_types:
+            raise TypeError(f'Reference has to be of one of the types '
+                            f'{self._input_types}, but it is '
+                            f'{reference.dtype}')
 
         for idx, channel in enumerate(self._channels):
             if abs(channel) >= source.shape[-1]:
                 raise IndexError(
                     f'{idx} channel is out of range')
 
-    def __call__(self, source: np.ndarray,
-                 reference: np.ndarray) -> np.ndarray:
-        """ Calls operation implementation """
+    @staticmethod
+    def _first_images(source: np.ndarray, reference: np.ndarray
+                      ) -> Tuple[np.ndarray, np.ndarray]:
+        """ Verifies the stack shapes of operations that match a stack of N
+        sources (N, H, W, C) to a single reference or to a stack of 1 or N
+        references, and returns the images by which the stacks are verified,
+        which are their first elements """
+        if source.ndim == DIM_4:
+            if reference.ndim not in (DIM_3, DIM_4):
+                raise ValueError(
+                    f'Reference of a source stack has to be 3 or 4 '
+                    f'dimensional, but it is {reference.ndim} dimensional')
+            if reference.ndim == DIM_4 and \
+                    len(reference) not in (1, len(source)):
+                raise ValueError(
+                    f'Reference stack has to contain 1 or {len(source)} '
+                    f'images, but it contains {len(reference)}')
+
+            source = source[0]
+            if reference.ndim == DIM_4:
+                reference = reference[0]
+        return source, reference
+
+    @staticmethod
+    def _verify_output(source: np.ndarray, out: np.ndarray) -> None:
+        if not isinstance(out, np.ndarray):
+            raise TypeError(f'Output has to be of type {repr(np.ndarray)}')
+        if out.shape != source.shape:
+            raise ValueError(
+                f'Output has to be of the source shape {source.shape}, '
+                f'but it is of shape {out.shape}')
+        if out.dtype != np.float32:
+            raise TypeError(f'Output has to be of type {np.float32}, '
+                            f'but it is {out.dtype}')
+        if not out.flags.c_contiguous:
+            raise ValueError('Output has to be C-contiguous')
+
+    def __call__(self, source: np.ndarray, reference: np.ndarray,
+                 out: Optional[np.ndarray] = None) -> np.ndarray:
+        """ Calls operation implementation, the result is written to out if
+        it is given, out may be the source itself """
         if self.check_input:
             self._verify_input(source, reference)
-        return self._apply(source, reference)
+        if out is None:
+            return self._apply(source, reference)
+        self._verify_output(source, out)
+        return self._apply_out(source, reference, out)
 
     @abc.abstractmethod
     def _apply(self, source: np.ndarray,
                reference: np.ndarray) -> np.ndarray:
         """ Operation implementation """
+
+    def _apply_out(self, source: np.ndarray, reference: np.ndarray,
+                   out: np.ndarray) -> np.ndarray:
+        """ Operation implementation writing to a given output buffer,
+        operations that can avoid an intermediate result override it """
+        out[...] = self._apply(source, reference)
+        return out
+
+    def fit(self, reference: np.ndarray) -> Any:
+        """ Computes the statistics of a reference image (H, W, C), or of
+        all images of a reference stack (N, H, W, C) together, to which
+        transform matches sources. They are compact and picklable, so they
+        can be computed once and shipped to worker processes """
+        if reference.ndim not in (DIM_3, DIM_4):
+            raise ValueError(
+                f'Reference has to be 3 or 4 dimensional, but it is '
+                f'{reference.ndim} dimensional')
+        images = reference if reference.ndim == DIM_4 else [reference]
+        return self.tile_statistics(images)
+
+    def transform(self, source: np.ndarray, reference_statistics: Any,
+                  out: Optional[np.ndarray] = None,
+                  source_statistics: Any = None) -> np.ndarray:
+        """ Matches a source image, or each image of a source stack, to the
+        statistics of a reference computed by fit, the result is written to
+        out if it is given, out may be the source itself. Source statistics,
+        e.g. those of fit of a reduced decode of the source, are taken in
+        place of those of each source image if they are given """
+        if self.check_input:
+            # the statistics are verified by the mapping
+            self._verify_input(source, source)
+        if out is None:
+            out = np.empty(source.shape, dtype=np.float32)
+        else:
+            self._verify_output(source, out)
+
+        images = source if source.ndim == DIM_4 else [source]
+        results = out if out.ndim == DIM_4 else [out]
+        for image, result in zip(images, results):
+            statistics = self.tile_statistics([image]) \
+                if source_statistics is None else source_statistics
+            mapping = self.tile_mapping(statistics, reference_statistics)
+            result[...] = self.map_tile(image, mapping)
+        return out
+
+    def tile_statistics(self, tiles: Iterable[np.ndarray]) -> Any:
+        """ Accumulates the statistics of an image streamed as tiles, the
+        first pass of tiled matching """
+        raise NotImplementedError(
+            f'{type(self).__name__} does not support tiled matching')
+
+    def merge_statistics(self, first: Any, second: Any) -> Any:
+        """ Merges the statistics of two tiles or images into those of
+        both """
+        raise NotImplementedError(
+            f'{type(self).__name__} does not support tiled matching')
+
+    def tile_mapping(self, source_statistics: Any,
+                     reference_statistics: Any) -> Any:
+        """ Computes the mapping of the source tiles from the statistics of
+        the source and the reference """
+        raise NotImplementedError(
+            f'{type(self).__name__} does not support tiled matching')
+
+    def map_tile(self, tile: np.ndarray, mapping: Any) -> np.ndarray:
+        """ Maps a source tile, the second pass of tiled matching """
+        raise NotImplementedError(
+            f'{type(self).__name__} does not support tiled matching')
@@ -1,17 +1,30 @@
 """This module defines Context for launching matching operations"""
+from typing import Any, Iterator, Optional, Tuple
+
 import numpy as np
 
+from core import DIM_3, DIM_4
 from utils.cs_conversion import ColorSpaceConverter
+from utils.cs_conversion.cs_identity import RGB_MAX, RGB_MIN
+from utils.cs_conversion.cs_linear import LinearConverter
 
 from . import Operation
+from .operations import (FeatureDistributionMatching, HistogramMatching,
+                         MeanStdMatching)
+from .operations.feature_distribution_matching import Moments
+from .tiling import (DEFAULT_MEMORY_BUDGET, TileShape, tile_shape_for_budget,
+                     tiles)
 
 
 class OperationContext:
     """ This class executes a given matching operation with a given
-    color space converter """
+    color space converter. A reference can be bound once and the context
+    then be called with sources only """
 
     def __init__(self, converter: ColorSpaceConverter,
                  operation: Operation) -> None:
+        self._bound_reference: Optional[np.ndarray] = None
+        self._bound_statistics: Any = None
         self.converter = converter
         self.operation = operation
 
@@ -24,6 +37,7 @@ class OperationContext:
     def converter(self, converter: ColorSpaceConverter) -> None:
         if isinstance(converter, ColorSpaceConverter):
             self._converter = converter
+            self.unbind()
         else:
             raise TypeError(
                 f'converter has to be of {repr(ColorSpaceConverter)} type')
@@ -37,15 +51,246 @@ class OperationContext:
     def operation(self, operation: Operation) -> None:
         if isinstance(operation, Operation):
             self._operation = operation
+            self.unbind()
         else:
             raise TypeError(
                 f'converter has to be of {repr(Operation)} type')
 
+    @property
+    def bound(self) -> bool:
+        """ Returns whether a reference is bound """
+        return self._bound_reference is not None or \
+            self._bound_statistics is not None
+
+    def bind(self, reference: np.ndarray) -> None:
+        """ Converts a reference once for all following calls without a
+        reference, a single reference image is reduced to its statistics
+        if the operation supports them, see fit. Setting the converter or
+        the operation unbinds it, changing the parameters of the operation
+        does not """
+        self.unbind()
+        if self._folds_conversion() and reference.ndim == DIM_3:
+            # the moments of the reference are converted by the mapping
+            self._bound_statistics = self.operation.fit(reference)
+            return
+
+        converted = self._convert(reference)
+        if converted.ndim == DIM_3 and has_statistics(self.operation):
+            self._bound_statistics = self.operation.fit(converted)
+            return
+        self._bound_reference = converted
+
+    def unbind(self) -> None:
+        """ Forgets the bound reference """
+        self._bound_reference = None
+        self._bound_statistics = None
+
     def __call__(self, source: np.ndarray,
-                 reference: np.ndarray) -> np.ndarray:
-        """ Operation process flow """
-        source = self.converter.convert(source)
-        reference = self.converter.convert(reference)
+                 reference: Optional[np.ndarray] = None) -> np.ndarray:
+        """ Operation process flow, the bound reference is taken if no
+        reference is given """
+        if reference is None:
+            return self._match_bound(source)
+        if self._folds_conversion() and reference.ndim == DIM_3:
+            return self._match_linear(source, self.operation.fit(reference))
+        stack = source.ndim == DIM_4
+        source = self._convert(source)
+        reference = self._convert(reference)
         result = self.operation(source, reference)
-        result = self.converter.convert_back(result)
+        result = self._convert_back(result, stack)
         return result
+
+    def _folds_conversion(self) -> bool:
+        """ Returns whether the operation is FDM in a linear color space,
+        whose conversions are folded into the affine mapping. The moments of
+        MSM lack the covariances the conversion needs """
+        return isinstance(self.converter, LinearConverter) and \
+            isinstance(self.operation, FeatureDistributionMatching) and \
+            not isinstance(self.operation, MeanStdMatching)
+
+    def _match_linear(self, source: np.ndarray, reference_statistics: Any,
+                      source_statistics: Any = None) -> np.ndarray:
+        """ Operation process flow of FDM in a linear color space with the
+        moments of the reference before the conversion, the result is
+        clipped to the rgb cube instead of to the box of channel ranges of
+        the linear color space """
+        converter, operation = self._linear_pair()
+        result = operation.match_converted(source, reference_statistics,
+                                           converter.matrix,
+                                           source_statistics)
+        return np.clip(result, RGB_MIN, RGB_MAX, out=result)
+
+    def _match_tiled_linear(self, source: np.ndarray, reference: np.ndarray,
+                            out: np.ndarray, s_tile_shape: TileShape,
+                            r_tile_shape: TileShape) -> np.ndarray:
+        """ Tiled operation process flow of FDM in a linear color space, the
+        moments of the tiles are taken before the conversion and the tiles
+        are mapped once and clipped to the rgb cube like in _match_linear """
+        converter, operation = self._linear_pair()
+        mapping = operation.converted_mapping(
+            operation.tile_statistics(self._tiles(source, s_tile_shape)),
+            operation.tile_statistics(self._tiles(reference, r_tile_shape)),
+            converter.matrix)
+
+        for rows, cols in tiles(source.shape, s_tile_shape):
+            result = operation.map_converted(
+                np.ascontiguousarray(source[rows, cols]), mapping)
+            out[rows, cols] = np.clip(result, RGB_MIN, RGB_MAX, out=result)
+        return out
+
+    def _linear_pair(self) -> Tuple[LinearConverter,
+                                    FeatureDistributionMatching]:
+        """ Returns the linear converter and the FDM operation whose
+        conversions are folded """
+        converter, operation = self.converter, self.operation
+        if not isinstance(converter, LinearConverter) or \
+                not isinstance(operation, FeatureDistributionMatching):
+            raise TypeError('folded conversions require Feature '
+                            'Distribution Matching in a linear color space')
+        return converter, operation
+
+    def _unconverted(self, moments: Moments) -> Moments:
+        """ Returns the moments of the pixels of a linear color space before
+        their conversion """
+        converter = self.converter
+        if not isinstance(converter, LinearConverter):
+            raise TypeError(f'converter has to be of {repr(LinearConverter)} '
+                            f'type')
+        inverse = converter.inverse
+        return Moments(moments.count, moments.mean @ inverse,
+                       inverse.T @ moments.scatter @ inverse)
+
+    def _match_bound(self, source: np.ndarray) -> np.ndarray:
+        """ Operation process flow with the bound reference """
+        if self._bound_statistics is not None and self._folds_conversion():
+            return self._match_linear(source, self._bound_statistics)
+        if self._bound_statistics is not None:
+            return self.match_statistics(source, self._bound_statistics)
+        if self._bound_reference is None:
+            raise ValueError('there is no reference, it has to be given or '
+                             'bound')
+        result = self.operation(self._convert(source),
+                                self._bound_reference)
+        return self._convert_back(result, source.ndim == DIM_4)
+
+    def fit(self, reference: np.ndarray) -> Any:
+        """ Converts a reference image, or a stack of references, and
+        computes their statistics, which can be given to match_statistics
+        in place of the reference """
+        return self.operation.fit(self._convert(reference))
+
+    def statistics(self, image: np.ndarray) -> Any:
+        """ Converts an image, or a stack of images, and accumulates their
+        statistics, e.g. the histograms of HM. Unlike those of fit they are
+        not prepared for a reference, so they can be merged, stored or
+        taken as those of a source """
+        return self._statistics(self._convert(image))
+
+    def _statistics(self, image: np.ndarray) -> Any:
+        """ Accumulates the statistics of an image, or of a stack of
+        images together """
+        return self.operation.tile_statistics(
+            image if image.ndim == DIM_4 else [image])
+
+    def match_statistics(self, source: np.ndarray,
+                         reference_statistics: Any,
+                         statistics_source: Optional[np.ndarray] = None
+                         ) -> np.ndarray:
+        """ Operation process flow with the statistics of the reference in
+        place of a reference image, e.g. those of fit or of a dataset. The
+        source statistics are computed from the statistics source if it is
+        given, e.g. a reduced decode of the source, and the mapping is
+        applied to the source at full resolution """
+        if self._folds_conversion():
+            # the moments of fit are those of the converted images, the
+            # folded mapping takes those before the conversion, so the
+            # result equals that of a reference image
+            return self._match_linear(
+                source, self._unconverted(reference_statistics),
+                None if statistics_source is None
+                else self._statistics(statistics_source))
+
+        stack = source.ndim == DIM_4
+        source_statistics = None
+        if statistics_source is not None:
+            source_statistics = self.statistics(statistics_source)
+        source = self._convert(source)
+        result = self.operation.transform(source, reference_statistics,
+                                          source_statistics=source_statistics)
+        return self._convert_back(result, stack)
+
+    def match_tiled(self, source: np.ndarray, reference: np.ndarray,
+                    out: np.ndarray,
+                    memory_budget: int = DEFAULT_MEMORY_BUDGET,
+                    tile_shape: Optional[TileShape] = None) -> np.ndarray:
+        """ Operation process flow for images that do not fit into memory,
+        e.g. memory-mapped ones. The first pass streams the tiles of the
+        source and the reference to accumulate their statistics, e.g. the
+        histograms of HM or the mean and covariance of FDM, the second pass
+        streams the source tiles through the resulting mapping and writes
+        them to out, which may be memory-mapped as well. The working memory
+        is bounded by the memory budget in bytes """
+        if out.shape != source.shape:
+            raise ValueError(
+                f'Output has to be of the source shape {source.shape}, '
+                f'but it is of shape {out.shape}')
+        s_tile_shape = tile_shape_for_budget(source.shape, memory_budget,
+                                             tile_shape)
+        r_tile_shape = tile_shape_for_budget(reference.shape, memory_budget,
+                                             tile_shape)
+        if self._folds_conversion():
+            return self._match_tiled_linear(source, reference, out,
+                                            s_tile_shape, r_tile_shape)
+
+        s_statistics = self.operation.tile_statistics(
+            self._converted_tiles(source, s_tile_shape))
+        r_statistics = self.operation.tile_statistics(
+            self._converted_tiles(reference, r_tile_shape))
+        mapping = self.operation.tile_mapping(s_statistics, r_statistics)
+
+        for rows, cols in tiles(source.shape, s_tile_shape):
+            tile = self._converted_tile(source, rows, cols)
+            out[rows, cols] = self.converter.convert_back(
+                self.operation.map_tile(tile, mapping))
+        return out
+
+    def _convert(self, image: np.ndarray) -> np.ndarray:
+        """ Converts an image, or a stack of images in one call """
+        if image.ndim == DIM_4:
+            return self.converter.convert_batch(image)
+        return self.converter.convert(image)
+
+    def _convert_back(self, image: np.ndarray, stack: bool) -> np.ndarray:
+        """ Converts an image, or a stack of images in one call, back """
+        if stack:
+            return self.converter.convert_back_batch(image, dst=image)
+        return self.converter.convert_back(image)
+
+    def _converted_tiles(self, image: np.ndarray,
+                         tile_shape: TileShape) -> Iterator[np.ndarray]:
+        """ Reads the tiles of an image and converts them """
+        for tile in self._tiles(image, tile_shape):
+            yield self.converter.convert(tile)
+
+    @staticmethod
+    def _tiles(image: np.ndarray,
+               tile_shape: TileShape) -> Iterator[np.ndarray]:
+        """ Reads the tiles of an image into memory """
+        for rows, cols in tiles(image.shape, tile_shape):
+            yield np.ascontiguousarray(image[rows, cols])
+
+    def _converted_tile(self, image: np.ndarray, rows: slice,
+                        cols: slice) -> np.ndarray:
+        """ Reads a tile of an image and converts it """
+        return self.converter.convert(np.ascontiguousarray(image[rows, cols]))
+
+
+def has_statistics(operation: Operation) -> bool:
+    """
+    This function checks whether an operation matches float images by means
+    of reference statistics, exact Histogram Matching needs the reference
+    image itself unless it compiles its inverse CDFs into tables
+    """
+    if isinstance(operation, HistogramMatching):
+        return operation.bins is not None or operation.quantiles is not None
+    return isinstance(operation, FeatureDistributionMatching)
@@ -1,10 +1,11 @@
 """This module contains a function that creates the operation context"""
-from core import FDM, HM, Params
+from core import FDM, HM, MSM, Params
 from utils.cs_conversion.cs_converter_builder import build_cs_converter
 
 from . import Operation
 from .operation_context import OperationContext
-from .operations import FeatureDistributionMatching, HistogramMatching
+from .operations import (FeatureDistributionMatching, HistogramMatching,
+                         MeanStdMatching)
 
 
 def build_operation_context(matching_type: str,
@@ -19,12 +20,19 @@ def build_operation_context(matching_type: str,
         operation: Operation = \
             HistogramMatching(channels,
                               check_input=params.verify_input,
-                              match_prop=params.match_proportion)
+                              match_prop=params.match_proportion[0],
+                              channel_ranges=channel_ranges,
+                              bins=params.bins,
+                              quantiles=params.quantiles)
     elif matching_type == FDM:
         operation = \
             FeatureDistributionMatching(channels,
                                         check_input=params.verify_input,
                                         channel_ranges=channel_ranges)
+    elif matching_type == MSM:
+        operation = MeanStdMatching(channels,
+                                    check_input=params.verify_input,
+                                    channel_ranges=channel_ranges)
     else:
         raise ValueError(f'there is no matching operation for {matching_type}')
 
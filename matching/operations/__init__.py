@@ -2,3 +2,6 @@
 # flake8: noqa
 from .feature_distribution_matching import FeatureDistributionMatching
 from .histogram_matching import HistogramMatching
+from .mean_std_matching import MeanStdMatching
+from .online_feature_distribution_matching import \
+    OnlineFeatureDistributionMatching
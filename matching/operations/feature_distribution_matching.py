@@ -1,14 +1,64 @@
 """This module implements Feature Distribution Matching operation"""
-from typing import Tuple
+from typing import Callable, Iterable, List, NamedTuple, Optional, Tuple
 
 import numpy as np
 
+from core import DIM_4
 from matching import ChannelsType, Operation
 from utils.cs_conversion import ChannelRange
 
+# moments of all channels of an image: the number of pixels, the channel
+# means (C,) and the scatter matrix (C, C), which is the sum of the outer
+# products of the deviations from the means, the moments of a stack of N
+# images have means (N, C) and scatter matrices (N, C, C)
+Moments = NamedTuple('Moments', [('count', int), ('mean', np.ndarray),
+                                 ('scatter', np.ndarray)])
+
+# number of pixels whose moments are computed or which are mapped at once,
+# it bounds the temporary memory, a chunk of a stack holds that many pixels
+# of all its images together
+_CHUNK_SIZE = 1 << 16
+
+# affine mapping of the matched channels of the tiles of a source,
+# matched = pixels @ matrix + bias, a stack of mappings has matrices
+# (N, C, C) and biases (N, C)
+AffineMapping = NamedTuple('AffineMapping', [('matrix', np.ndarray),
+                                             ('bias', np.ndarray)])
+
+
+def _chunk_rows(pixels: np.ndarray) -> int:
+    """ Returns the number of pixel rows of the chunks of pixels (P, C) or
+    of a stack of pixels (N, P, C), the chunks of a stack hold the same
+    number of pixels in total """
+    n_images = int(np.prod(pixels.shape[:-2]))
+    return max(1, _CHUNK_SIZE // n_images)
+
 
 class FeatureDistributionMatching(Operation):
-    """Feature Distribution Matching operation class"""
+    """Feature Distribution Matching operation class
+
+    The moments of the source and the reference are accumulated chunk by
+    chunk, and the source is mapped chunk by chunk with the affine
+    transformation computed from them, directly into the result buffer. The
+    result is either returned in a new float32 buffer or written to a
+    caller-supplied one, which may be the source itself, so the peak memory
+    is the input plus at most one output buffer.
+
+    A stack of N sources (N, H, W, C) is matched to a single reference or to
+    a stack of 1 or N references in one vectorized pass: the N covariance
+    matrices, their singular value decompositions and the N affine
+    transformations are computed with stacked linear algebra, and the chunks
+    of all sources are mapped at once.
+
+    Images that do not fit into memory, e.g. memory-mapped ones, are matched
+    out of core by OperationContext.match_tiled with the tile protocol of
+    Operation: tile_statistics accumulates the mean and the scatter matrix
+    of the tiles of an image chunk by chunk, merge_statistics merges those
+    of tiles or images, tile_mapping computes the affine transformation
+    from the moments of the source and the reference, and map_tile streams
+    each source tile through it, so the working memory is bounded by the
+    tile size.
+    """
 
     # pylint: disable=too-few-public-methods (R0903)
 
@@ -36,58 +86,292 @@ class FeatureDistributionMatching(Operation):
                     f'Channel range has to be of {repr(ChannelRange)}')
         self._channel_ranges = channel_ranges
 
+    def tile_statistics(self, tiles: Iterable[np.ndarray]) -> Moments:
+        """ Accumulates the moments of all channels of an image streamed as
+        tiles (..., C) """
+        moments: Optional[Moments] = None
+        for tile in tiles:
+            tile_moments = self._pixel_moments(
+                self._get_feature_matrix(tile))
+            moments = tile_moments if moments is None else \
+                self.merge_statistics(moments, tile_moments)
+
+        if moments is None:
+            raise ValueError('there are no tiles to accumulate')
+        return moments
+
+    def merge_statistics(self, first: Moments, second: Moments) -> Moments:
+        """ Merges the moments of two tiles or images """
+        return self._merge_moments(first, second)
+
+    def tile_mapping(self, source_statistics: Moments,
+                     reference_statistics: Moments) -> AffineMapping:
+        """ Computes the affine mapping of the matched channels of the
+        source tiles, which whitens them with the source covariance and
+        colors them with the reference covariance """
+        n_channels = len(source_statistics.mean)
+        if len(reference_statistics.mean) != n_channels:
+            raise ValueError(
+                f'The number of channels in source and reference '
+                f'have to be the same, but source has {n_channels} and '
+                f'reference has {len(reference_statistics.mean)}')
+
+        return self._affine_mapping(source_statistics,
+                                    reference_statistics,
+                                    self._selected(n_channels))
+
+    def map_tile(self, tile: np.ndarray,
+                 mapping: AffineMapping) -> np.ndarray:
+        """ Maps a source tile (..., C) to a new float32 tile """
+        result = np.empty(tile.shape, dtype=np.float32)
+        self._map_pixels(self._get_feature_matrix(tile),
+                         self._get_feature_matrix(result), mapping,
+                         self._selected(tile.shape[-1]))
+        return result
+
+    def match_converted(self, source: np.ndarray,
+                        reference_statistics: Moments,
+                        matrix: np.ndarray,
+                        source_statistics: Optional[Moments] = None
+                        ) -> np.ndarray:
+        """ Matches a source image, or each image of a source stack, to the
+        moments of a reference in the color space of their linear
+        conversion pixels @ matrix and converts the result back, the
+        moments are those before the conversion. The conversions are folded
+        into one affine mapping per image, so the source is transformed
+        once and the converted images are never materialized, but the
+        result is not clipped to the channel ranges. Source moments are
+        taken in place of those of each source image if they are given """
+        if self.check_input:
+            # the moments are verified by the mapping
+            self._verify_input(source, source)
+        result = np.empty(source.shape, dtype=np.float32)
+        images = source if source.ndim == DIM_4 else [source]
+        results = result if result.ndim == DIM_4 else [result]
+        for image, image_result in zip(images, results):
+            statistics = self.tile_statistics([image]) \
+                if source_statistics is None else source_statistics
+            mapping = self.converted_mapping(statistics,
+                                             reference_statistics, matrix)
+            image_result[...] = self.map_converted(image, mapping)
+        return result
+
+    def converted_mapping(self, source_statistics: Moments,
+                          reference_statistics: Moments,
+                          matrix: np.ndarray) -> AffineMapping:
+        """ Computes the affine mapping of all channels of the source tiles
+        that composes their linear conversion pixels @ matrix to another
+        color space, the matching in that color space and the conversion
+        back, from the moments of the source and the reference before the
+        conversion """
+        mapping = self.tile_mapping(
+            self._converted_moments(source_statistics, matrix),
+            self._converted_moments(reference_statistics, matrix))
+
+        # the channels that are not matched are mapped to themselves
+        n_channels = len(matrix)
+        channels = self._selected(n_channels)
+        converted_matrix = np.identity(n_channels)
+        converted_matrix[np.ix_(channels, channels)] = mapping.matrix
+        converted_bias = np.zeros(n_channels)
+        converted_bias[channels] = mapping.bias
+
+        inverse = np.linalg.inv(matrix)
+        return AffineMapping(matrix @ converted_matrix @ inverse,
+                             converted_bias @ inverse)
+
+    def map_converted(self, tile: np.ndarray,
+                      mapping: AffineMapping) -> np.ndarray:
+        """ Maps all channels of a source tile (..., C) with a mapping of
+        converted_mapping to a new float32 tile. The channel ranges belong
+        to the converted color space, which is never materialized, so the
+        result is not clipped """
+        pixels = self._get_feature_matrix(tile)
+        result = np.empty(tile.shape, dtype=np.float32)
+        result_pixels = self._get_feature_matrix(result)
+        for start in range(0, len(pixels), _CHUNK_SIZE):
+            rows = slice(start, start + _CHUNK_SIZE)
+            result_pixels[rows] = pixels[rows] @ mapping.matrix + \
+                mapping.bias
+        return result
+
+    @staticmethod
+    def _converted_moments(moments: Moments, matrix: np.ndarray) -> Moments:
+        """ Returns the moments of pixels after their linear conversion
+        pixels @ matrix """
+        return Moments(moments.count, moments.mean @ matrix,
+                       matrix.T @ moments.scatter @ matrix)
+
+    def _selected(self, n_channels: int) -> List[int]:
+        """ Returns the non-negative indices of the matched channels """
+        return [channel % n_channels for channel in self.channels]
+
+    @staticmethod
+    def _moments(image: np.ndarray) -> Moments:
+        """ Computes the moments of all channels of an image """
+        return FeatureDistributionMatching._pixel_moments(
+            FeatureDistributionMatching._get_feature_matrix(image))
+
+    @staticmethod
+    def _pixel_moments(pixels: np.ndarray) -> Moments:
+        """ Computes the moments of pixels (P, C), or of each image of a
+        stack of pixels (N, P, C), in a single pass over chunks of pixels,
+        the moments of the chunks are merged, so the temporary memory is
+        bounded by the chunk size """
+        return FeatureDistributionMatching._chunk_moments(
+            pixels, FeatureDistributionMatching._scatter)
+
+    @staticmethod
+    def _chunk_moments(pixels: np.ndarray,
+                       scatter: Callable[[np.ndarray], np.ndarray]
+                       ) -> Moments:
+        """ Accumulates the moments of pixels (P, C), or of a stack of
+        pixels (N, P, C), chunk by chunk, scatter computes the scatter
+        matrices of a centered chunk given channel by channel (..., C, P) """
+        batch_shape, n_channels = pixels.shape[:-2], pixels.shape[-1]
+        moments = Moments(0, np.zeros(batch_shape + (n_channels,)),
+                          np.zeros(batch_shape + (n_channels, n_channels)))
+
+        step = _chunk_rows(pixels)
+        for start in range(0, pixels.shape[-2], step):
+            # the chunk is copied in float64 with a row per channel, so that
+            # the reductions run over contiguous memory, and centered in
+            # place
+            chunk = np.ascontiguousarray(
+                np.swapaxes(pixels[..., start:start + step, :], -1, -2),
+                dtype=float)
+            mean = np.mean(chunk, axis=-1)
+            chunk -= mean[..., np.newaxis]
+            moments = FeatureDistributionMatching._merge_moments(
+                moments, Moments(chunk.shape[-1], mean, scatter(chunk)))
+        return moments
+
+    @staticmethod
+    def _scatter(channels: np.ndarray) -> np.ndarray:
+        """ Computes the scatter matrix (C, C) of centered pixels given
+        channel by channel (C, P), or those of a stack (N, C, P), from the
+        dot products of the channels, which are much faster than a matrix
+        product of this narrow shape """
+        n_channels = channels.shape[-2]
+        scatter = np.empty(channels.shape[:-2] + (n_channels, n_channels))
+        for first in range(n_channels):
+            for second in range(first, n_channels):
+                scatter[..., first, second] = np.einsum(
+                    '...p,...p->...', channels[..., first, :],
+                    channels[..., second, :])
+                scatter[..., second, first] = scatter[..., first, second]
+        return scatter
+
+    @staticmethod
+    def _merge_moments(first: Moments, second: Moments) -> Moments:
+        """ Merges two moments, or the moments of two stacks image by image,
+        by the pairwise update of Chan et al., which is numerically
+        stable """
+        if first.mean.shape != second.mean.shape:
+            raise ValueError(
+                f'Moments of shapes {first.mean.shape} and '
+                f'{second.mean.shape} cannot be merged')
+        if not second.count:
+            return first
+        if not first.count:
+            return second
+
+        count = first.count + second.count
+        delta = second.mean - first.mean
+        mean = first.mean + delta * (second.count / count)
+        scatter = first.scatter + second.scatter + \
+            delta[..., :, np.newaxis] * delta[..., np.newaxis, :] * (
+                first.count * second.count / count)
+        return Moments(count, mean, scatter)
+
+    @staticmethod
+    def _covariance(moments: Moments, channels: List[int]) -> np.ndarray:
+        """ Returns the covariance matrix of the given channels, or those of
+        each image of a stack """
+        covariance: np.ndarray = \
+            moments.scatter[..., channels, :][..., channels] / moments.count
+        return covariance
+
     def _apply(self, source: np.ndarray,
                reference: np.ndarray) -> np.ndarray:
+        out = np.empty(source.shape, dtype=np.float32)
+        return self._apply_out(source, reference, out)
 
-        matching_result = self._matching(source[:, :, self.channels],
-                                         reference[:, :, self.channels])
+    def _apply_out(self, source: np.ndarray, reference: np.ndarray,
+                   out: np.ndarray) -> np.ndarray:
+        """ Matches the source, or each source of a stack, chunk by chunk,
+        the temporary memory is bounded by the chunk size, so the peak
+        memory is the input plus the output buffer, or the input alone if
+        the output is the source """
+        channels = self._selected(source.shape[-1])
+        source_pixels = self._get_pixel_stack(source)
+        out_pixels = self._get_pixel_stack(out)
+        source_moments = self._pixel_moments(source_pixels)
+        reference_moments = self._pixel_moments(
+            self._get_pixel_stack(reference))
 
-        result = np.copy(source)
-        # Replace selected channels with matching result
-        result[:, :, self.channels] = matching_result
+        mapping = self._affine_mapping(source_moments, reference_moments,
+                                       channels)
+        self._map_pixels(source_pixels, out_pixels, mapping, channels)
+        return out
 
-        # Replace selected channels
-        for channel in self.channels:
-            result[:, :, channel] = np.clip(result[:, :, channel],
-                                            self.channel_ranges[
-                                                channel].min,
-                                            self.channel_ranges[
-                                                channel].max)
+    def _map_pixels(self, pixels: np.ndarray, out_pixels: np.ndarray,
+                    mapping: AffineMapping, channels: List[int]) -> None:
+        """ Maps the given channels of pixels (P, C), or of a stack of
+        pixels (N, P, C) with a stack of mappings, chunk by chunk and clips
+        them to their channel ranges in place. The other channels are
+        mapped onto themselves, so all channels are mapped at once in the
+        type of the pixels. out_pixels may be the pixels themselves """
+        mapping, minima, maxima = self._chunk_mapping(pixels, mapping,
+                                                      channels)
+        step = _chunk_rows(pixels)
+        for start in range(0, pixels.shape[-2], step):
+            rows = slice(start, start + step)
+            matched = self._transform_chunk(pixels[..., rows, :],
+                                            mapping.matrix)
+            n_rows = matched.shape[-2]
+            matched += mapping.bias[..., :n_rows, :]
+            np.maximum(matched, minima[..., :n_rows, :], out=matched)
+            np.minimum(matched, maxima[..., :n_rows, :], out=matched)
+            out_pixels[..., rows, :] = matched
 
-        return result.astype(np.float32)
+    def _chunk_mapping(self, pixels: np.ndarray, mapping: AffineMapping,
+                       channels: List[int]
+                       ) -> Tuple[AffineMapping, np.ndarray, np.ndarray]:
+        """ Extends a mapping of the given channels of pixels (..., P, C) to
+        all channels, which are mapped onto themselves and not clipped, and
+        repeats its bias and the channel ranges to the shape of a chunk of
+        pixels, because broadcasts along the short channel axis are slow """
+        n_channels = pixels.shape[-1]
+        dtype = np.result_type(pixels.dtype, np.float32)
+        batch_shape = mapping.bias.shape[:-1]
+        matrix = np.zeros(batch_shape + (n_channels, n_channels), dtype=dtype)
+        matrix[...] = np.identity(n_channels)
+        matrix[(...,) + np.ix_(channels, channels)] = mapping.matrix
+        bias = np.zeros(batch_shape + (n_channels,), dtype=dtype)
+        bias[..., channels] = mapping.bias
+        minima = np.full(n_channels, -np.inf, dtype=dtype)
+        maxima = np.full(n_channels, np.inf, dtype=dtype)
+        minima[channels] = [self.channel_ranges[channel].min
+                            for channel in channels]
+        maxima[channels] = [self.channel_ranges[channel].max
+                            for channel in channels]
 
-    @staticmethod
-    def _matching(source: np.ndarray,
-                  reference: np.ndarray) -> np.ndarray:
-        """ Run all transformation steps """
-        # 1.) reshape to feature matrix (H*W,C)
-        feature_mat_src = FeatureDistributionMatching._get_feature_matrix(
-            source)
-        feature_mat_ref = FeatureDistributionMatching._get_feature_matrix(
-            reference)
-
-        # 2.) center (subtract mean)
-        feature_mat_src, _ = FeatureDistributionMatching._center_image(
-            feature_mat_src)
-        feature_mat_ref, reference_mean = \
-            FeatureDistributionMatching._center_image(feature_mat_ref)
-
-        # 3.) whitening: cov(feature_mat_src) = I
-        feature_mat_src_white = FeatureDistributionMatching._whitening(
-            feature_mat_src)
-
-        # 4.) transform covariance: cov(feature_mat_ref) = covariance_ref
-        feature_mat_src_transformed = \
-            FeatureDistributionMatching._covariance_transformation(
-                feature_mat_src_white, feature_mat_ref)
-
-        # 5.) Add reference mean
-        feature_mat_src_transformed += reference_mean
-
-        # 6.) Reshape
-        result = feature_mat_src_transformed.reshape(source.shape)
+        chunk_shape = (min(_chunk_rows(pixels), pixels.shape[-2]),
+                       n_channels)
+        bias, minima, maxima = [
+            np.ascontiguousarray(np.broadcast_to(
+                vector[..., np.newaxis, :], vector.shape[:-1] + chunk_shape))
+            for vector in (bias, minima, maxima)]
+        return AffineMapping(matrix, bias), minima, maxima
 
-        return result
+    @staticmethod
+    def _transform_chunk(pixels: np.ndarray,
+                         matrix: np.ndarray) -> np.ndarray:
+        """ Transforms a chunk of pixels (..., P, C) linearly to a new chunk
+        of the type of the matrix """
+        transformed: np.ndarray = pixels @ matrix
+        return transformed
 
     @staticmethod
     def _get_feature_matrix(image: np.ndarray) -> np.ndarray:
@@ -100,53 +384,86 @@ class FeatureDistributionMatching(Operation):
         return feature_matrix
 
     @staticmethod
-    def _center_image(image: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
-        """ Centers the image by removing mean
-        :returns centered image and original mean
+    def _get_pixel_stack(image: np.ndarray) -> np.ndarray:
+        """ Reshapes an image (H, W, C) to a feature matrix (H * W, C) and a
+        stack of images (N, H, W, C) to a stack of feature matrices
+        (N, H * W, C) """
+        if image.ndim != DIM_4:
+            return FeatureDistributionMatching._get_feature_matrix(image)
+        pixel_stack = np.reshape(image, (len(image), -1, image.shape[-1]))
+        return pixel_stack
+
+    @staticmethod
+    def _affine_mapping(source_moments: Moments,
+                        reference_moments: Moments,
+                        channels: List[int]) -> AffineMapping:
+        """ Computes the affine mapping of the given channels that gives the
+        source pixels the mean and the covariance of the reference, or the
+        stack of mappings of stacks of moments, which are broadcast against
+        each other """
+        matrix = FeatureDistributionMatching._transform(
+            FeatureDistributionMatching._covariance(source_moments, channels),
+            FeatureDistributionMatching._covariance(reference_moments,
+                                                    channels))
+        bias = reference_moments.mean[..., channels] - np.einsum(
+            '...c,...cd->...d', source_moments.mean[..., channels], matrix)
+        return AffineMapping(matrix, bias)
+
+    @staticmethod
+    def _transform(source_cov: np.ndarray,
+                   reference_cov: np.ndarray) -> np.ndarray:
+        """
+        Computes the matrix M (C, C) that whitens centered source pixels x
+        and colors them with the reference covariance in one step, so that
+        cov(x @ M) equals the reference covariance. Stacks of covariance
+        matrices (N, C, C) are decomposed at once and give a stack of
+        matrices.
+        :param source_cov: C x C source covariance matrix
+        :param reference_cov: C x C reference covariance matrix
+        :return: C x C transformation matrix
         """
-        image = np.copy(image)
-        image_mean = np.mean(image, axis=0)
-        image -= image_mean
-        return image, image_mean
+        matrix: np.ndarray = \
+            FeatureDistributionMatching._whitening(source_cov) @ \
+            FeatureDistributionMatching._coloring(reference_cov)
+        return matrix
 
     @staticmethod
-    def _whitening(feature_mat: np.ndarray) -> np.ndarray:
+    def _whitening(covariance: np.ndarray) -> np.ndarray:
         """
-        Transform the feature matrix so that cov(feature_map) = Identity or
-        if the feature matrix is one dimensional so that var(feature_map) = 1.
-        :param feature_mat: N x C matrix with N samples and C features
-        :return feature_mat_white: A corresponding feature vector with an
-        identity covariance matrix or variance of 1.
+        Computes the matrix W (C, C) so that cov(x @ W) = Identity for
+        centered pixels x of the given covariance, from its singular value
+        decomposition. The singular vectors are paired with those of
+        _coloring by the order of the singular values, so equal covariances
+        give the identity. Directions without variance, e.g. those of a
+        constant channel or of a gray image stored as rgb, are mapped to
+        zero instead of being scaled up from rounding errors, variances
+        below the float64 resolution of the largest one count as zero, like
+        the singular values of np.linalg.matrix_rank.
+        :param covariance: C x C covariance matrix
+        :return: C x C whitening matrix
         """
-        if feature_mat.shape[1] == 1:
-            variance = np.var(feature_mat)
-            feature_mat_white = feature_mat / np.sqrt(variance)
-        else:
-            data_cov = np.cov(feature_mat, rowvar=False)
-            u_mat, s_vec, _ = np.linalg.svd(data_cov)
-            sqrt_s = np.diag(np.sqrt(s_vec))
-            feature_mat_white = (feature_mat @ u_mat) @ np.linalg.inv(sqrt_s)
-        return feature_mat_white
+        u_mat, s_vec, _ = np.linalg.svd(covariance)
+        tolerance = np.max(s_vec, axis=-1, keepdims=True) * s_vec.shape[-1] * \
+            np.finfo(float).eps
+        scales = np.zeros_like(s_vec)
+        np.divide(1., np.sqrt(s_vec), out=scales, where=s_vec > tolerance)
+        whitening: np.ndarray = u_mat * scales[..., np.newaxis, :]
+        return whitening
 
     @staticmethod
-    def _covariance_transformation(feature_mat_white: np.ndarray,
-                                   feature_mat_ref: np.ndarray) -> np.ndarray:
+    def _coloring(covariance: np.ndarray) -> np.ndarray:
         """
-        Transform the white (cov=Identity) feature matrix so that
-        cov(feature_mat_transformed) = cov(feature_mat_ref). In the 2d case
-        this becomes:
-        var(feature_mat_transformed) = var(feature_mat_ref)
-        :param feature_mat_white: input with identity covariance matrix
-        :param feature_mat_ref: reference feature matrix
-        :return: feature_mat_transformed with cov == cov(feature_mat_ref)
+        Computes the matrix K (C, C) so that cov(x @ K) equals the given
+        covariance for white pixels x, from its singular value
+        decomposition.
+        :param covariance: C x C covariance matrix
+        :return: C x C coloring matrix
         """
-        if feature_mat_white.shape[1] == 1:
-            variance_ref = np.var(feature_mat_ref)
-            feature_mat_transformed = feature_mat_white * np.sqrt(variance_ref)
-        else:
-            covariance_ref = np.cov(feature_mat_ref, rowvar=False)
-            u_mat, s_vec, _ = np.linalg.svd(covariance_ref)
-            sqrt_s = np.diag(np.sqrt(s_vec))
-
-            feature_mat_transformed = (feature_mat_white @ sqrt_s) @ u_mat.T
-        return feature_mat_transformed
+        u_mat, s_vec, _ = np.linalg.svd(covariance)
+        coloring: np.ndarray = np.sqrt(s_vec)[..., np.newaxis] * \
+            np.swapaxes(u_mat, -1, -2)
+        return coloring
+
+    def _verify_input(self, source: np.ndarray,
+                      reference: np.ndarray) -> None:
+        super()._verify_input(*self._first_images(source, reference))
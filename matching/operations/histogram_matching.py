@@ -1,19 +1,126 @@
 """This module implements Histogram Matching operation"""
+import copy
 import sys
+from typing import (Any, Callable, Dict, Iterable, Iterator, List, NamedTuple,
+                    Optional, Sequence, Tuple, Union)
 
 import numpy as np
 
-from core import MATCH_FULL, MATCH_ZERO
+from core import DIM_3, DIM_4, MATCH_FULL, MATCH_ZERO
 from matching import ChannelsType, Operation
+from utils.cs_conversion import ChannelRange
+
+# integer types matched with a lookup table instead of sorting the pixels
+_LUT_TYPES = (np.uint8, np.uint16)
+
+# minimal number of samples of a dense inverse CDF table
+_MIN_QUANTILES = 2
+
+# number of pixels processed at once, it bounds the temporary memory
+_CHUNK_SIZE = 1 << 16
+
+# histograms (C, K) of all channels of an image, either the counts of the
+# integer values or fixed-bin histograms over the channel ranges
+Histograms = NamedTuple('Histograms', [('counts', np.ndarray),
+                                       ('binned', bool)])
+
+# reference statistics compiled into dense inverse CDF tables (C, quantiles)
+# of all channels, see HistogramMatching.fit
+InverseCdfs = NamedTuple('InverseCdfs', [('tables', np.ndarray)])
+
+# inverse CDF of a reference channel, either the quantiles of the reference
+# values and the values or, if the quantiles are None, a dense table sampled
+# at uniformly spaced quantiles
+InverseCdf = Tuple[Optional[np.ndarray], np.ndarray]
+
+# mapping of the tiles of a source, the matched integer values (C, K) or the
+# matched bin edges (C, bins + 1) of the matched channels with their slopes
+HistogramMapping = NamedTuple('HistogramMapping',
+                              [('tables', np.ndarray),
+                               ('slopes', Optional[np.ndarray])])
+
+
+def _verify_match_prop(match_prop: float) -> float:
+    """ Verifies that a matching proportion is in the valid range """
+    if not MATCH_ZERO <= match_prop <= MATCH_FULL:
+        raise ValueError(f'matching proportion has to be '
+                         f'in range [{MATCH_ZERO}, {MATCH_FULL}], '
+                         f'the given value is {match_prop}')
+    return match_prop
+
+
+def _resize_counts(counts: np.ndarray, size: int) -> np.ndarray:
+    """ Pads integer histograms (C, K) with zeros to the given size """
+    resized: np.ndarray = np.pad(counts,
+                                 ((0, 0), (0, size - counts.shape[-1])))
+    return resized
+
+
+def _verify_count(name: str, value: Optional[int], minimum: int) -> None:
+    """ Verifies an optional integer parameter with a lower bound """
+    if value is not None:
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise TypeError(f'{name} has to be of type {repr(int)}')
+        if value < minimum:
+            raise ValueError(f'{name} has to be at least {minimum}, '
+                             f'the given value is {value}')
 
 
 class HistogramMatching(Operation):
-    """Histogram Matching operation class"""
+    """Histogram Matching operation class
+
+    By default the matching is exact. If a number of bins is given, float
+    channels are matched approximately: each channel is histogrammed into
+    bins over its channel range and pixels are mapped through the linearly
+    interpolated inverse CDF of the reference, so the memory needed for the
+    statistics does not depend on the image size. A matched pixel deviates
+    from the exact result by at most one bin width, (max - min) / bins,
+    plus the distance between the matched values of the two edges of its
+    source bin. Pixels outside the channel range are clipped to it.
+
+    If a number of quantiles is given, the inverse CDF of the reference is
+    compiled into a table sampled at that many uniformly spaced quantiles,
+    so mapping a source quantile is an index and a linear blend instead of
+    a binary search over the reference values. fit compiles the tables of a
+    reference once, and transform reuses them for every source. The table
+    is exact at its samples and linear in between, so a matched value
+    deviates from the exact one by at most the difference of the two
+    samples around its quantile. Where the reference values are sparse,
+    e.g. in the tails of a channel, this is not small: for the b channel of
+    LAB images it reaches about 26 at 4096 quantiles and 38 at 256.
+
+    Besides single images (H, W, C), stacks of sources (N, H, W, C) can be
+    matched to a single reference (H, W, C) or to a stack of N references.
+    The statistics of a single reference are computed only once.
+
+    The result is either returned in a new float32 buffer or written to a
+    caller-supplied one, which may be the source itself. The integer and
+    binned engines run in two passes over chunks of the interleaved
+    buffer, a histogram pass and a mapping pass, so their peak memory is
+    the input plus the output buffer and a few chunk-sized temporaries. The
+    exact float engine needs temporaries of the size of one channel.
+
+    Images that do not fit into memory are matched tile by tile in the same
+    two passes: the histograms of the tiles are accumulated, and the source
+    tiles are mapped with the resulting tables. Tiled matching requires
+    either integer images or bins, see OperationContext.match_tiled.
+    """
+
+    _input_types = Operation._input_types + _LUT_TYPES
 
     def __init__(self, channels: ChannelsType, check_input: bool = False,
-                 match_prop: float = MATCH_FULL):
+                 match_prop: float = MATCH_FULL,
+                 channel_ranges: Optional[Tuple[ChannelRange, ...]] = None,
+                 bins: Optional[int] = None,
+                 quantiles: Optional[int] = None):
         super().__init__(channels, check_input)
         self.match_prop = float(match_prop)
+        self.channel_ranges = channel_ranges
+        self.bins = bins
+        self.quantiles = quantiles
+
+        if self.bins is not None and self.channel_ranges is None:
+            raise ValueError('binned matching requires the channel ranges')
 
     @property
     def match_prop(self) -> float:
@@ -22,54 +129,767 @@ class HistogramMatching(Operation):
 
     @match_prop.setter
     def match_prop(self, matching_proportion: float) -> None:
-        if MATCH_ZERO <= matching_proportion <= MATCH_FULL:
-            self._match_prop = matching_proportion
+        self._match_prop = _verify_match_prop(matching_proportion)
+
+    @property
+    def channel_ranges(self) -> Optional[Tuple[ChannelRange, ...]]:
+        """ Returns the ranges of the color space channels """
+        return self._channel_ranges
+
+    @channel_ranges.setter
+    def channel_ranges(
+            self, channel_ranges: Optional[Tuple[ChannelRange, ...]]) -> None:
+        if channel_ranges is not None:
+            if not isinstance(channel_ranges, tuple):
+                raise TypeError(
+                    f'channel ranges has to be of type '
+                    f'{repr(Tuple[ChannelRange, ...])}')
+
+            for channel_range in channel_ranges:
+                if not isinstance(channel_range, ChannelRange):
+                    raise TypeError(
+                        f'Channel range has to be of {repr(ChannelRange)}')
+        self._channel_ranges = channel_ranges
+
+    @property
+    def bins(self) -> Optional[int]:
+        """ Returns the number of histogram bins, None for exact matching """
+        return self._bins
+
+    @bins.setter
+    def bins(self, bins: Optional[int]) -> None:
+        _verify_count('bins', bins, 1)
+        self._bins = bins
+
+    @property
+    def quantiles(self) -> Optional[int]:
+        """ Returns the size of the inverse CDF table, None for direct
+        interpolation of the reference CDF """
+        return self._quantiles
+
+    @quantiles.setter
+    def quantiles(self, quantiles: Optional[int]) -> None:
+        _verify_count('quantiles', quantiles, _MIN_QUANTILES)
+        self._quantiles = quantiles
+
+    def sweep(self, source: np.ndarray, reference: np.ndarray,
+              match_props: Sequence[float]) -> List[np.ndarray]:
+        """ Matches the source once and returns one result per matching
+        proportion, each equal to the result of the operation with that
+        proportion up to float32 rounding """
+        match_props = [_verify_match_prop(float(match_prop))
+                       for match_prop in match_props]
+
+        if self.check_input:
+            self._verify_input(source, reference)
+
+        matched = self._full_match()._apply(source, reference)
+        return self._proportions(source, matched, match_props)
+
+    def sweep_statistics(self, source: np.ndarray,
+                         reference_statistics: Union[Histograms,
+                                                     InverseCdfs],
+                         match_props: Sequence[float],
+                         source_statistics: Optional[Histograms] = None
+                         ) -> List[np.ndarray]:
+        """ Matches the source once to the statistics of a reference, see
+        transform, and returns one result per matching proportion """
+        match_props = [_verify_match_prop(float(match_prop))
+                       for match_prop in match_props]
+        matched = self._full_match().transform(
+            source, reference_statistics, source_statistics=source_statistics)
+        return self._proportions(source, matched, match_props)
+
+    def _full_match(self) -> 'HistogramMatching':
+        """ Returns a copy of the operation with full matching """
+        full_match = copy.copy(self)
+        full_match.match_prop = MATCH_FULL
+        return full_match
+
+    @staticmethod
+    def _proportions(source: np.ndarray, matched: np.ndarray,
+                     match_props: List[float]) -> List[np.ndarray]:
+        """ Blends the full matching result with the source per
+        proportion """
+        source = source.astype(np.float32)
+        diff = source - matched
+        return [source - diff * np.float32(match_prop)
+                for match_prop in match_props]
+
+    def fit(self, reference: np.ndarray) -> Union[Histograms, InverseCdfs]:
+        """ Computes the histograms of a reference, see Operation.fit. If a
+        number of quantiles is given, the inverse CDFs of the reference are
+        compiled into dense tables once instead, which transform reuses for
+        every source, and float references are fitted without bins as
+        well """
+        if self.quantiles is None:
+            histograms: Histograms = super().fit(reference)
+            return histograms
+        if reference.dtype in _LUT_TYPES or self.bins is not None:
+            return self.inverse_cdfs(super().fit(reference))
+
+        if reference.ndim not in (DIM_3, DIM_4):
+            raise ValueError(
+                f'Reference has to be 3 or 4 dimensional, but it is '
+                f'{reference.ndim} dimensional')
+        channels = self._pixels(reference).T
+        return InverseCdfs(np.array([self._exact_inverse_cdf(channel)[1]
+                                     for channel in channels]))
+
+    def inverse_cdfs(self, histograms: Histograms) -> InverseCdfs:
+        """ Compiles the histograms of a reference, e.g. those of a
+        dataset, into dense inverse CDF tables of the configured number of
+        quantiles """
+        if self.quantiles is None:
+            raise ValueError('inverse CDF tables require quantiles')
+        counts = histograms.counts
+        if histograms.binned:
+            _, _, edges = self._tile_binning(list(range(len(counts))),
+                                             counts.shape[-1])
+            cdfs = [self._binned_inverse_cdf(channel_counts, channel_edges)
+                    for channel_counts, channel_edges in zip(counts, edges)]
+        else:
+            cdfs = [self._integer_inverse_cdf(channel_counts)
+                    for channel_counts in counts]
+        return InverseCdfs(np.array([table for _, table in cdfs]))
+
+    def transform(self, source: np.ndarray,
+                  reference_statistics: Union[Histograms, InverseCdfs],
+                  out: Optional[np.ndarray] = None,
+                  source_statistics: Any = None) -> np.ndarray:
+        """ Matches a source to the statistics of a reference, see
+        Operation.transform. Float sources without bins are matched exactly
+        to the inverse CDF tables of fit """
+        if source.dtype in _LUT_TYPES or self.bins is not None or \
+                not isinstance(reference_statistics, InverseCdfs):
+            return super().transform(source, reference_statistics, out,
+                                     source_statistics)
+        if source_statistics is not None:
+            raise ValueError('exact matching of float images cannot take '
+                             'source statistics')
+
+        if self.check_input:
+            self._verify_input(source, source)
+        if out is None:
+            out = np.empty(source.shape, dtype=np.float32)
+        else:
+            self._verify_output(source, out)
+
+        sources = source if source.ndim == DIM_4 else source[np.newaxis]
+        results = out if out.ndim == DIM_4 else out[np.newaxis]
+        tables = reference_statistics.tables
+        if self.match_prop == MATCH_ZERO:
+            np.copyto(results, sources)
+        else:
+            self._exact_engine(sources, results, self.channels,
+                               lambda channel: [(None, tables[channel])])
+        return out
+
+    def tile_statistics(self, tiles: Iterable[np.ndarray]) -> Histograms:
+        """ Accumulates the histograms of all channels of an image streamed
+        as tiles (..., C), integer tiles are counted per value and float
+        tiles in bins over the channel ranges """
+        histograms: Optional[Histograms] = None
+        for tile in tiles:
+            tile_histograms = self._tile_histograms(tile)
+            histograms = tile_histograms if histograms is None else \
+                self.merge_statistics(histograms, tile_histograms)
+
+        if histograms is None:
+            raise ValueError('there are no tiles to accumulate')
+        return histograms
+
+    def tile_mapping(self, source_statistics: Histograms,
+                     reference_statistics: Union[Histograms, InverseCdfs]
+                     ) -> HistogramMapping:
+        """ Computes the mapping of the source tiles from the histograms of
+        the source and either the histograms or the inverse CDF tables of
+        the reference, the matching proportion is blended into it """
+        s_counts = source_statistics.counts
+        if isinstance(reference_statistics, InverseCdfs):
+            n_channels = len(reference_statistics.tables)
+        else:
+            n_channels = len(reference_statistics.counts)
+            if source_statistics.binned != reference_statistics.binned:
+                raise ValueError('Source and reference have to be either '
+                                 'both integer or both float images')
+        if len(s_counts) != n_channels:
+            raise ValueError(
+                f'The number of channels in source and reference '
+                f'have to be the same, but source has {len(s_counts)} and '
+                f'reference has {n_channels}')
+
+        channels = [channel % len(s_counts) for channel in self.channels]
+        if not source_statistics.binned:
+            if isinstance(reference_statistics, InverseCdfs):
+                r_cdfs = self._compiled_cdfs(reference_statistics, channels)
+            else:
+                r_cdfs = {channel: [self._integer_inverse_cdf(
+                    reference_statistics.counts[channel])]
+                    for channel in channels}
+            luts = self._luts(s_counts[np.newaxis], r_cdfs, tuple(channels))
+            return HistogramMapping(luts[0].astype(np.float32), None)
+
+        bins = s_counts.shape[-1]
+        _, _, edges = self._tile_binning(channels, bins)
+        if isinstance(reference_statistics, InverseCdfs):
+            r_cdfs = self._compiled_cdfs(reference_statistics, channels)
         else:
-            raise ValueError(f'matching proportion has to be '
-                             f'in range [{MATCH_ZERO}, {MATCH_FULL}], '
-                             f'the given value is {matching_proportion}')
+            r_counts = reference_statistics.counts
+            if r_counts.shape != s_counts.shape:
+                raise ValueError(
+                    f'Histograms of {bins} and {r_counts.shape[-1]} bins '
+                    f'cannot be matched')
+            r_cdfs = {channel: [self._binned_inverse_cdf(
+                r_counts[channel], channel_edges)]
+                for channel, channel_edges in zip(channels, edges)}
+        tables, slopes = self._binned_mapping(
+            edges, s_counts[np.newaxis, channels],
+            [r_cdfs[channel] for channel in channels])
+        return HistogramMapping(tables[0].astype(np.float32),
+                                slopes[0].astype(np.float32))
+
+    def map_tile(self, tile: np.ndarray,
+                 mapping: HistogramMapping) -> np.ndarray:
+        """ Maps a source tile (..., C) to a new float32 tile """
+        out = np.empty(tile.shape, dtype=np.float32)
+        if self.match_prop == MATCH_ZERO:
+            np.copyto(out, tile)
+        elif mapping.slopes is None:
+            if tile.dtype not in _LUT_TYPES:
+                raise TypeError(f'Tile has to be of one of the types '
+                                f'{_LUT_TYPES}, but it is {tile.dtype}')
+            # values beyond the tables would read those of the next channel
+            lut_size = mapping.tables.shape[-1]
+            if np.iinfo(tile.dtype).max >= lut_size and tile.size and \
+                    tile.max() >= lut_size:
+                raise ValueError(
+                    f'Tile values have to be less than {lut_size}, the size '
+                    f'of the lookup tables, but the maximum is {tile.max()}')
+            self._map_lut(tile[np.newaxis], out[np.newaxis],
+                          mapping.tables[np.newaxis])
+        else:
+            channels = [channel % tile.shape[-1] for channel in self.channels]
+            minima, scales, _ = self._tile_binning(
+                channels, mapping.tables.shape[-1] - 1)
+            self._map_binned(tile[np.newaxis], out[np.newaxis],
+                             mapping.tables[np.newaxis],
+                             mapping.slopes[np.newaxis], channels, minima,
+                             scales)
+        return out
+
+    def merge_statistics(self, first: Histograms,
+                         second: Histograms) -> Histograms:
+        """ Adds up the histograms of two images or tiles, integer
+        histograms of different sizes are padded with zeros """
+        if first.binned != second.binned:
+            raise ValueError('Binned and integer histograms cannot be merged')
+        if len(first.counts) != len(second.counts):
+            raise ValueError(
+                f'Histograms of {len(first.counts)} and '
+                f'{len(second.counts)} channels cannot be merged')
+        if first.binned and first.counts.shape != second.counts.shape:
+            raise ValueError(
+                f'Histograms of {first.counts.shape[-1]} and '
+                f'{second.counts.shape[-1]} bins cannot be merged')
+
+        size = max(first.counts.shape[-1], second.counts.shape[-1])
+        return Histograms(_resize_counts(first.counts, size) +
+                          _resize_counts(second.counts, size),
+                          first.binned)
+
+    def _tile_histograms(self, tile: np.ndarray) -> Histograms:
+        """ Counts the histograms of all channels of a tile """
+        channels = list(range(tile.shape[-1]))
+        if tile.dtype in _LUT_TYPES:
+            counts = self._histograms(tile[np.newaxis], channels,
+                                      np.iinfo(tile.dtype).max + 1,
+                                      lambda chunk: chunk)
+            return Histograms(counts[0], False)
+
+        if self.bins is None:
+            raise ValueError('tiled matching of float images requires bins')
+        minima, scales, _ = self._tile_binning(channels, self.bins)
+        counts = self._binned_histograms(tile[np.newaxis], channels, minima,
+                                         scales, self.bins)
+        return Histograms(counts[0], True)
+
+    def _tile_binning(self, channels: List[int], bins: int
+                      ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ Returns the binning of the given channels for histograms with
+        the given number of bins, which has to be the configured one """
+        if self.channel_ranges is None:
+            raise ValueError('binned matching requires the channel ranges')
+        if bins != self.bins:
+            raise ValueError(f'Histograms of {bins} bins cannot be matched '
+                             f'with {self.bins} bins')
+        return self._binning(self.channel_ranges, channels, bins)
+
+    def _verify_input(self, source: np.ndarray,
+                      reference: np.ndarray) -> None:
+        super()._verify_input(*self._first_images(source, reference))
 
     def _apply(self, source: np.ndarray,
                reference: np.ndarray) -> np.ndarray:
-        result = np.copy(source)
-        for channel in self.channels:
-            result[:, :, channel] = \
-                self._match_channel(source[:, :, channel],
-                                    reference[:, :, channel])
-        return result.astype(np.float32)
+        out = np.empty(source.shape, dtype=np.float32)
+        return self._apply_out(source, reference, out)
+
+    def _apply_out(self, source: np.ndarray, reference: np.ndarray,
+                   out: np.ndarray) -> np.ndarray:
+        if source.ndim != DIM_4:
+            self._apply_stack(source[np.newaxis], reference[np.newaxis],
+                              out[np.newaxis])
+            return out
+
+        if reference.ndim != DIM_4:
+            reference = reference[np.newaxis]
+        self._apply_stack(source, reference, out)
+        return out
+
+    def _apply_stack(self, sources: np.ndarray, references: np.ndarray,
+                     out: np.ndarray) -> None:
+        """ Matches a stack of N sources to either a single reference or to
+        a stack of N references and writes the result to out, the
+        statistics of a single reference are computed only once """
+        if self.match_prop == MATCH_ZERO:
+            np.copyto(out, sources)
+        elif sources.dtype in _LUT_TYPES and references.dtype in _LUT_TYPES:
+            self._lut_engine(sources, references, out, self.channels)
+        elif self.bins is not None:
+            if self.channel_ranges is None:
+                raise ValueError('binned matching requires the channel '
+                                 'ranges')
+            self._binned_engine(sources, references, out,
+                                self.channels, self.channel_ranges,
+                                self.bins)
+        else:
+            self._exact_engine(
+                sources, out, self.channels,
+                lambda channel: [self._exact_inverse_cdf(
+                    reference[..., channel]) for reference in references])
 
     def _match_channel(self, source: np.ndarray,
-                       reference: np.ndarray) -> np.ndarray:
+                       reference: np.ndarray,
+                       channel_range: Optional[ChannelRange] = None
+                       ) -> np.ndarray:
         if self.match_prop == MATCH_ZERO:
             return source
 
-        source_shape = source.shape
-        source = source.ravel()
-        reference = reference.ravel()
+        if source.dtype in _LUT_TYPES and reference.dtype in _LUT_TYPES:
+            return self._match_channel_lut(source, reference)
+
+        if self.bins is not None:
+            if channel_range is None:
+                raise ValueError('binned matching requires a channel range')
+            return self._match_channel_binned(source, reference,
+                                              channel_range, self.bins)
+
+        return self._match_exact(source, self._exact_inverse_cdf(reference),
+                                 np.dtype(float))
+
+    def _exact_engine(self, sources: np.ndarray, out: np.ndarray,
+                      channels: ChannelsType,
+                      reference_cdfs: Callable[[int], List[InverseCdf]]
+                      ) -> None:
+        """ Matches the channels of stacks of images exactly by sorting to
+        the inverse CDFs of a channel of the references, the temporary
+        memory is bounded by the size of a channel """
+        n_channels = sources.shape[-1]
+        channels = tuple(channel % n_channels for channel in channels)
+        for channel in set(range(n_channels)) - set(channels):
+            out[..., channel] = sources[..., channel]
 
+        for channel in channels:
+            r_cdfs = reference_cdfs(channel)
+            for idx, source in enumerate(sources):
+                out[idx, ..., channel] = self._match_exact(
+                    source[..., channel], r_cdfs[idx % len(r_cdfs)],
+                    out.dtype)
+
+    def _exact_inverse_cdf(self, reference: np.ndarray) -> InverseCdf:
+        """ Computes the inverse CDF of a reference channel from its
+        unique values and their quantiles """
+        r_values, r_counts = np.unique(reference, return_counts=True)
+        r_quantiles = np.cumsum(r_counts).astype(float) / (
+            reference.size + sys.float_info.epsilon)
+        return self._compile(r_quantiles, r_values)
+
+    def _match_exact(self, source: np.ndarray, r_cdf: InverseCdf,
+                     dtype: np.dtype) -> np.ndarray:
+        """ Matches a source channel to the reference CDF by sorting, the
+        result is of the given type """
         # get unique pixel values (sorted),
         # indices of the unique array and counts
-        _, s_indices, s_counts = np.unique(source,
-                                           return_counts=True,
-                                           return_inverse=True)
-        r_values, r_counts = np.unique(reference, return_counts=True)
+        s_values, s_indices, s_counts = np.unique(source,
+                                                  return_counts=True,
+                                                  return_inverse=True)
 
         # compute the cumulative sum of the counts
         s_quantiles = np.cumsum(s_counts).astype(float) / (
             source.size + sys.float_info.epsilon)
-        r_quantiles = np.cumsum(r_counts).astype(float) / (
-            reference.size + sys.float_info.epsilon)
 
         # interpolate linearly to find the pixel values in the reference
         # that correspond most closely to the quantiles in the source image
-        interp_values = np.interp(s_quantiles, r_quantiles, r_values)
+        interp_values = self._inverse_cdf(s_quantiles, r_cdf)
+
+        # apply matching proportion to the unique values
+        interp_values = self._blend(s_values.astype(float), interp_values)
 
         # pick the interpolated pixel values using the inverted source indices
-        result = interp_values[s_indices]
+        result: np.ndarray = \
+            interp_values.astype(dtype)[s_indices].reshape(source.shape)
+        return result
 
-        # apply matching proportion
-        if self.match_prop < MATCH_FULL:
-            diff = source.astype(float) - result
-            result = source.astype(float) - (diff * self.match_prop)
+    def _match_channel_lut(self, source: np.ndarray,
+                           reference: np.ndarray) -> np.ndarray:
+        """ Matches an integer channel in O(N): the histograms are counted
+        with bincount and the mapping is applied as a lookup table """
+        out = np.empty(source.shape + (1,))
+        self._lut_engine(source[np.newaxis, ..., np.newaxis],
+                         reference[np.newaxis, ..., np.newaxis],
+                         out[np.newaxis], (0,))
+        return out[..., 0]
+
+    def _lut_engine(self, sources: np.ndarray, references: np.ndarray,
+                    out: np.ndarray, channels: ChannelsType) -> None:
+        """ Matches stacks of integer images by means of lookup tables (N, C,
+        K) of the matched values """
+        lut_size = np.iinfo(np.promote_types(sources.dtype,
+                                             references.dtype)).max + 1
+
+        all_channels = list(range(sources.shape[-1]))
+        s_counts = self._histograms(sources, all_channels, lut_size,
+                                    lambda chunk: chunk)
+        r_counts = self._histograms(references, all_channels, lut_size,
+                                    lambda chunk: chunk)
+
+        r_cdfs = {channel % len(all_channels): [
+            self._integer_inverse_cdf(counts)
+            for counts in r_counts[:, channel]] for channel in channels}
+        luts = self._luts(s_counts, r_cdfs, channels)
+        self._map_lut(sources, out, luts.astype(out.dtype))
+
+    def _luts(self, s_counts: np.ndarray,
+              r_cdfs: Dict[int, List[InverseCdf]],
+              channels: ChannelsType) -> np.ndarray:
+        """ Computes the lookup tables (N, C, K) from the source histograms
+        (N, C, K) and the inverse CDFs of the channels of 1 or N
+        references, channels which are not matched are mapped onto
+        themselves """
+        n_images, n_channels, lut_size = s_counts.shape
+        luts = np.tile(np.arange(lut_size, dtype=float),
+                       (n_images, n_channels, 1))
+        for channel in channels:
+            channel %= n_channels
+            luts[:, channel] = self._lookup_tables(s_counts[:, channel],
+                                                   r_cdfs[channel])
+        return luts
+
+    def _map_lut(self, sources: np.ndarray, out: np.ndarray,
+                 luts: np.ndarray) -> None:
+        """ Maps stacks of integer images with lookup tables (N, C, K). The
+        pixel values are offset by K times the index of their table, so that
+        a chunk of the interleaved buffer is mapped with a single gather """
+        n_channels, lut_size = luts.shape[-2:]
+        luts = luts.ravel()
+
+        s_pixels, out_pixels = self._pixels(sources), self._pixels(out)
+        pixels_per_image = len(s_pixels) // len(sources)
+        for rows in self._chunks(len(s_pixels)):
+            first_code, offsets = self._chunk_offsets(
+                rows, pixels_per_image, n_channels, lut_size)
+            s_codes = np.add(s_pixels[rows], offsets, dtype=np.intp)
+            np.take(luts[first_code:], s_codes, out=out_pixels[rows],
+                    mode='clip')
+
+    def _lookup_tables(self, s_counts: np.ndarray,
+                       r_cdfs: List[InverseCdf]) -> np.ndarray:
+        """ Computes the matched value for every integer pixel value from
+        the source histograms (N, K) and the inverse CDFs of 1 or N
+        references, the matching proportion is blended into the tables """
+        # values absent in the source do not change the cumulative sum of
+        # the present ones, so the quantiles equal those of np.unique
+        s_quantiles = np.cumsum(s_counts, axis=-1).astype(float) / (
+            s_counts.sum(axis=-1, keepdims=True) + sys.float_info.epsilon)
+
+        luts = np.empty(s_quantiles.shape)
+        for idx, r_cdf in enumerate(r_cdfs):
+            rows = self._reference_rows(len(r_cdfs), idx)
+            luts[rows] = self._inverse_cdf(s_quantiles[rows], r_cdf)
+
+        return self._blend(np.arange(luts.shape[-1], dtype=float), luts)
+
+    def _integer_inverse_cdf(self, counts: np.ndarray) -> InverseCdf:
+        """ Computes the inverse CDF of a reference channel from the counts
+        of its integer values """
+        r_values = np.flatnonzero(counts)
+        r_quantiles = np.cumsum(counts[r_values]).astype(float) / (
+            counts.sum() + sys.float_info.epsilon)
+        return self._compile(r_quantiles, r_values)
+
+    def _match_channel_binned(self, source: np.ndarray,
+                              reference: np.ndarray,
+                              channel_range: ChannelRange,
+                              bins: int) -> np.ndarray:
+        """ Matches a channel approximately by means of fixed-bin
+        histograms over the channel range """
+        out = np.empty(source.shape + (1,))
+        self._binned_engine(source[np.newaxis, ..., np.newaxis],
+                            reference[np.newaxis, ..., np.newaxis],
+                            out[np.newaxis], (0,), (channel_range,), bins)
+        return out[..., 0]
+
+    def _binned_engine(self, sources: np.ndarray, references: np.ndarray,
+                       out: np.ndarray, channels: ChannelsType,
+                       channel_ranges: Tuple[ChannelRange, ...],
+                       bins: int) -> None:
+        """ Matches the channels of stacks of images by means of fixed-bin
+        histograms """
+        n_channels = sources.shape[-1]
+        selected = [channel % n_channels for channel in channels]
+        minima, scales, edges = self._binning(channel_ranges, selected, bins)
+
+        s_counts = self._binned_histograms(sources, selected, minima, scales,
+                                           bins)
+        r_counts = self._binned_histograms(references, selected, minima,
+                                           scales, bins)
 
-        return result.reshape(source_shape)
+        r_cdfs = [[self._binned_inverse_cdf(counts, edges[idx])
+                   for counts in r_counts[:, idx]]
+                  for idx in range(len(selected))]
+        tables, slopes = self._binned_mapping(edges, s_counts, r_cdfs)
+        self._map_binned(sources, out, tables.astype(out.dtype),
+                         slopes.astype(out.dtype), selected, minima, scales)
+
+    @staticmethod
+    def _binning(channel_ranges: Tuple[ChannelRange, ...],
+                 channels: List[int],
+                 bins: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ Returns the minima, the scales from values to bin coordinates
+        and the bin edges (C, bins + 1) of the given channels """
+        minima = np.array([channel_ranges[channel].min
+                           for channel in channels])
+        maxima = np.array([channel_ranges[channel].max
+                           for channel in channels])
+        scales = bins / (maxima - minima)
+        edges = np.linspace(minima, maxima, bins + 1, axis=-1)
+        return minima, scales, edges
+
+    def _binned_histograms(self, images: np.ndarray, channels: List[int],
+                           minima: np.ndarray, scales: np.ndarray,
+                           bins: int) -> np.ndarray:
+        """ Counts the fixed-bin histograms (N, C, bins) of the given
+        channels of a stack of images """
+        def to_bins(chunk: np.ndarray) -> np.ndarray:
+            positions = self._bin_positions(chunk, minima, scales, bins)
+            bin_indices: np.ndarray = np.minimum(positions.astype(np.intp),
+                                                 bins - 1)
+            return bin_indices
+
+        counts: np.ndarray = self._histograms(images, channels, bins + 1,
+                                              to_bins)[..., :bins]
+        return counts
+
+    def _binned_mapping(self, edges: np.ndarray, s_counts: np.ndarray,
+                        r_cdfs: Sequence[List[InverseCdf]]
+                        ) -> Tuple[np.ndarray, np.ndarray]:
+        """ Computes the matched values of the bin edges (N, C, bins + 1)
+        and the slopes between them from the source histograms (N, C, bins)
+        and the inverse CDFs of the channels of 1 or N references """
+        bins = edges.shape[-1] - 1
+        tables = np.empty(s_counts.shape[:-1] + (bins + 1,))
+        for idx in range(s_counts.shape[1]):
+            tables[:, idx] = self._binned_tables(edges[idx],
+                                                 s_counts[:, idx],
+                                                 r_cdfs[idx])
+
+        # interpolate linearly between the matched values of the bin edges
+        slopes = np.zeros_like(tables)
+        slopes[..., :bins] = np.diff(tables, axis=-1)
+        return tables, slopes
+
+    def _map_binned(self, sources: np.ndarray, out: np.ndarray,
+                    tables: np.ndarray, slopes: np.ndarray,
+                    channels: List[int], minima: np.ndarray,
+                    scales: np.ndarray) -> None:
+        """ Maps the given channels of stacks of images with the tables (N,
+        C, bins + 1) of the matched bin edges and their slopes, the other
+        channels are copied. The bins of a table are coded as table * (bins
+        + 1) + bin, so that the codes of a chunk of the interleaved buffer
+        index the flattened tables """
+        table_size = tables.shape[-1]
+        bins = table_size - 1
+        tables, slopes = tables.ravel(), slopes.ravel()
+
+        s_pixels, out_pixels = self._pixels(sources), self._pixels(out)
+        pixels_per_image = len(s_pixels) // len(sources)
+        for rows in self._chunks(len(s_pixels)):
+            out_pixels[rows] = s_pixels[rows]
+
+            fractions = self._bin_positions(s_pixels[rows, channels],
+                                            minima, scales, bins)
+            s_codes = np.minimum(fractions.astype(np.intp), bins - 1)
+            fractions -= s_codes
+
+            first_code, offsets = self._chunk_offsets(
+                rows, pixels_per_image, len(channels), table_size)
+            s_codes += offsets
+            matched = np.take(tables[first_code:], s_codes)
+            matched += fractions * np.take(slopes[first_code:], s_codes)
+            out_pixels[rows, channels] = matched
+
+    def _binned_tables(self, edges: np.ndarray, s_counts: np.ndarray,
+                       r_cdfs: List[InverseCdf]) -> np.ndarray:
+        """ Computes the matched values of the bin edges of a channel from
+        the source histograms (N, bins) and the inverse CDFs of 1 or N
+        references """
+        # source quantiles at the bin edges
+        s_quantiles = np.cumsum(s_counts, axis=-1) / (
+            s_counts.sum(axis=-1, keepdims=True) + sys.float_info.epsilon)
+        s_quantiles = np.concatenate(
+            (np.zeros((len(s_quantiles), 1)), s_quantiles), axis=-1)
+
+        tables = np.empty(s_quantiles.shape)
+        for idx, r_cdf in enumerate(r_cdfs):
+            rows = self._reference_rows(len(r_cdfs), idx)
+            tables[rows] = self._inverse_cdf(s_quantiles[rows], r_cdf)
+
+        return self._blend(edges, tables)
+
+    def _binned_inverse_cdf(self, counts: np.ndarray,
+                            edges: np.ndarray) -> InverseCdf:
+        """ Computes the inverse CDF of a reference channel from its
+        fixed-bin histogram, the pixels are assumed to be uniformly
+        distributed within a bin and empty bins are skipped to keep the
+        quantiles strictly increasing """
+        r_bins = np.flatnonzero(counts)
+        r_quantiles = np.concatenate(([0.], np.cumsum(counts[r_bins]))) / (
+            counts.sum() + sys.float_info.epsilon)
+        r_values = np.concatenate((edges[r_bins[:1]], edges[r_bins + 1]))
+        return self._compile(r_quantiles, r_values)
+
+    @staticmethod
+    def _bin_positions(values: np.ndarray, minima: np.ndarray,
+                       scales: np.ndarray, bins: int) -> np.ndarray:
+        """ Returns the continuous bin coordinate of each value, clipped
+        to [0, bins] """
+        dtype = np.result_type(values.dtype, np.float32)
+        positions: np.ndarray = \
+            (values - minima.astype(dtype)) * scales.astype(dtype)
+        return np.clip(positions, 0, bins, out=positions)
+
+    def _histograms(self, images: np.ndarray, channels: List[int],
+                    table_size: int,
+                    to_bins: Callable[[np.ndarray], np.ndarray]
+                    ) -> np.ndarray:
+        """ Counts the histograms (N, C, table_size) of the given channels
+        of a stack of images chunk by chunk, to_bins maps a chunk of pixels
+        to bin indices. The bins are offset by table_size times the index of
+        their histogram, so that a chunk is counted with a single
+        bincount """
+        n_images, n_channels = len(images), len(channels)
+        counts = np.zeros(n_images * n_channels * table_size, dtype=np.intp)
+
+        pixels = self._pixels(images)
+        pixels_per_image = len(pixels) // n_images
+        for rows in self._chunks(len(pixels)):
+            first_code, offsets = self._chunk_offsets(
+                rows, pixels_per_image, n_channels, table_size)
+            codes = np.add(to_bins(pixels[rows, channels]), offsets,
+                           dtype=np.intp)
+            chunk_counts = np.bincount(codes.ravel())
+            counts[first_code:first_code + chunk_counts.size] += chunk_counts
+
+        return counts.reshape(n_images, n_channels, table_size)
+
+    @staticmethod
+    def _pixels(images: np.ndarray) -> np.ndarray:
+        """ Returns a stack of images (N, ..., C) as pixels (N * ..., C),
+        which is a view for contiguous stacks """
+        return images.reshape(-1, images.shape[-1])
+
+    @staticmethod
+    def _chunks(n_pixels: int) -> Iterator[slice]:
+        """ Splits the pixels into chunks that keep temporary arrays
+        small """
+        for start in range(0, n_pixels, _CHUNK_SIZE):
+            yield slice(start, min(start + _CHUNK_SIZE, n_pixels))
+
+    @staticmethod
+    def _chunk_offsets(rows: slice, pixels_per_image: int, n_channels: int,
+                       table_size: int) -> Tuple[int, np.ndarray]:
+        """ Returns the code of the first table of a chunk of pixels and
+        the code offsets of the tables of the pixels relative to it """
+        first_image = rows.start // pixels_per_image
+        if (rows.stop - 1) // pixels_per_image == first_image:
+            images = np.zeros(1, dtype=np.intp)
+        else:
+            images = np.arange(rows.start, rows.stop) // pixels_per_image - \
+                first_image
+
+        offsets = (images[:, np.newaxis] * n_channels +
+                   np.arange(n_channels)) * table_size
+        return first_image * n_channels * table_size, offsets
+
+    @staticmethod
+    def _reference_rows(n_references: int, idx: int) -> slice:
+        """ Returns the source rows that are matched to a reference, a
+        single reference is shared by all sources """
+        return slice(None) if n_references == 1 else slice(idx, idx + 1)
+
+    def _compile(self, r_quantiles: np.ndarray,
+                 r_values: np.ndarray) -> InverseCdf:
+        """ Returns the inverse CDF of a reference channel, which is
+        compiled into a dense table if a number of quantiles is given """
+        if self.quantiles is None:
+            return r_quantiles, r_values
+        return None, self._inverse_cdf_table(r_quantiles, r_values,
+                                             self.quantiles)
+
+    @staticmethod
+    def _compiled_cdfs(inverse_cdfs: InverseCdfs, channels: List[int]
+                       ) -> Dict[int, List[InverseCdf]]:
+        """ Returns the inverse CDFs of the given channels of a single
+        reference from its tables """
+        return {channel: [(None, inverse_cdfs.tables[channel])]
+                for channel in channels}
+
+    def _inverse_cdf(self, quantiles: np.ndarray,
+                     r_cdf: InverseCdf) -> np.ndarray:
+        """ Evaluates the inverse CDF of the reference at the given
+        quantiles """
+        r_quantiles, r_values = r_cdf
+        if r_quantiles is None:
+            return self._lookup_inverse_cdf(r_values, quantiles)
+        result: np.ndarray = np.interp(quantiles, r_quantiles, r_values)
+        return result
+
+    @staticmethod
+    def _inverse_cdf_table(r_quantiles: np.ndarray, r_values: np.ndarray,
+                           size: int) -> np.ndarray:
+        """ Samples the inverse CDF of the reference at uniformly
+        spaced quantiles """
+        table: np.ndarray = np.interp(np.linspace(0., 1., size),
+                                      r_quantiles, r_values)
+        return table
+
+    @staticmethod
+    def _lookup_inverse_cdf(table: np.ndarray,
+                            quantiles: np.ndarray) -> np.ndarray:
+        """ Evaluates a dense inverse CDF table by indexing and blending
+        the two neighboring samples """
+        positions = np.clip(quantiles, 0., 1.) * (table.size - 1)
+        indices = np.minimum(positions.astype(np.intp), table.size - 2)
+        fraction = positions - indices
+        result: np.ndarray = table[indices] + fraction * (
+            table[indices + 1] - table[indices])
+        return result
+
+    def _blend(self, values: np.ndarray,
+               matched_values: np.ndarray) -> np.ndarray:
+        """ Applies the matching proportion to matched values """
+        if self.match_prop < MATCH_FULL:
+            blended: np.ndarray = \
+                values - ((values - matched_values) * self.match_prop)
+            return blended
+        return matched_values
@@ -0,0 +1,104 @@
+"""This module implements Mean and Standard Deviation Matching operation"""
+from typing import List, Tuple
+
+import numpy as np
+
+from .feature_distribution_matching import (AffineMapping,
+                                            FeatureDistributionMatching,
+                                            Moments)
+
+
+class MeanStdMatching(FeatureDistributionMatching):
+    """Mean and Standard Deviation Matching operation class
+
+    Each matched channel of the source is given the mean and the standard
+    deviation of the reference channel independently, i.e. the covariance
+    of Feature Distribution Matching is reduced to its diagonal. The affine
+    mapping has a diagonal matrix and is applied as a multiply-add per
+    value, which needs neither matrix decompositions nor a dense matrix
+    product.
+
+    The clipping to the channel ranges, the output buffers, the stacks and
+    the tiles are shared with Feature Distribution Matching. Only the sums
+    of squares of the channels are accumulated, the covariances of its
+    moments are left zero, so the moments of a dataset written for Feature
+    Distribution Matching can be matched as well, but not the other way
+    round, and conversions cannot be folded into the mapping. A source
+    channel of zero deviation is mapped to the reference mean.
+    """
+
+    @staticmethod
+    def _affine_mapping(source_moments: Moments,
+                        reference_moments: Moments,
+                        channels: List[int]) -> AffineMapping:
+        """ Computes the diagonal affine mapping of the given channels that
+        gives the source pixels the means and the standard deviations of the
+        reference """
+        source_std = MeanStdMatching._std(source_moments, channels)
+        reference_std = MeanStdMatching._std(reference_moments, channels)
+        scale = np.divide(reference_std, source_std,
+                          out=np.zeros(np.broadcast(reference_std,
+                                                    source_std).shape),
+                          where=source_std > 0.)
+
+        matrix = scale[..., np.newaxis] * np.identity(len(channels))
+        bias = reference_moments.mean[..., channels] - \
+            source_moments.mean[..., channels] * scale
+        return AffineMapping(matrix, bias)
+
+    @staticmethod
+    def _std(moments: Moments, channels: List[int]) -> np.ndarray:
+        """ Returns the standard deviations of the given channels, or those
+        of each image of a stack """
+        variance = moments.scatter[..., channels, channels] / moments.count
+        std: np.ndarray = np.sqrt(np.maximum(variance, 0.))
+        return std
+
+    def converted_mapping(self, source_statistics: Moments,
+                          reference_statistics: Moments,
+                          matrix: np.ndarray) -> AffineMapping:
+        """ Conversions cannot be folded, the variances after a conversion
+        depend on the covariances, which are not accumulated """
+        raise NotImplementedError(
+            'Mean and Standard Deviation Matching does not accumulate the '
+            'covariances a converted mapping needs')
+
+    @staticmethod
+    def _pixel_moments(pixels: np.ndarray) -> Moments:
+        """ Computes the moments of pixels (P, C), or of each image of a
+        stack of pixels (N, P, C), like Feature Distribution Matching, but
+        only the sums of squares of the channels, the diagonals of the
+        scatter matrices, are accumulated """
+        return FeatureDistributionMatching._chunk_moments(
+            pixels, MeanStdMatching._squares)
+
+    @staticmethod
+    def _squares(channels: np.ndarray) -> np.ndarray:
+        """ Computes the diagonal scatter matrices (..., C, C) of centered
+        pixels given channel by channel (..., C, P) from the sums of squares
+        of the channels """
+        squares = np.einsum('...cp,...cp->...c', channels, channels)
+        scatter: np.ndarray = \
+            squares[..., np.newaxis] * np.identity(channels.shape[-2])
+        return scatter
+
+    def _chunk_mapping(self, pixels: np.ndarray, mapping: AffineMapping,
+                       channels: List[int]
+                       ) -> Tuple[AffineMapping, np.ndarray, np.ndarray]:
+        """ Extends a mapping to all channels like Feature Distribution
+        Matching, but its matrix is replaced by the diagonal repeated to the
+        shape of a chunk, the per-channel scales """
+        chunk_mapping, minima, maxima = super()._chunk_mapping(
+            pixels, mapping, channels)
+        scale = np.diagonal(chunk_mapping.matrix, axis1=-2, axis2=-1)
+        scales = np.ascontiguousarray(np.broadcast_to(
+            scale[..., np.newaxis, :], chunk_mapping.bias.shape))
+        return AffineMapping(scales, chunk_mapping.bias), minima, maxima
+
+    @staticmethod
+    def _transform_chunk(pixels: np.ndarray,
+                         matrix: np.ndarray) -> np.ndarray:
+        """ Scales a chunk of pixels (..., P, C) by the repeated per-channel
+        scales of _chunk_mapping to a new chunk of their type """
+        transformed: np.ndarray = pixels * matrix[..., :pixels.shape[-2], :]
+        return transformed
@@ -0,0 +1,222 @@
+"""This module implements Online Feature Distribution Matching operation"""
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from core import DIM_3, DIM_4
+from matching import ChannelsType
+from utils.cs_conversion import ChannelRange
+
+from .feature_distribution_matching import (AffineMapping,
+                                            FeatureDistributionMatching,
+                                            Moments)
+
+# default weight of the past frames in the source statistics
+DEFAULT_SMOOTHING = 0.9
+
+# default drift of the source statistics that recomputes the mapping, in
+# standard deviations of the source channels
+DEFAULT_DRIFT_THRESHOLD = 0.01
+
+
+class OnlineFeatureDistributionMatching(FeatureDistributionMatching):
+    """Online Feature Distribution Matching operation class
+
+    The frames of a video are matched one after another. The source
+    statistics are an exponential moving average of the mean and the
+    covariance of the frames, optionally computed on every n-th pixel of
+    every n-th row, and the affine mapping is only recomputed once they
+    drift from the statistics of the current mapping by more than a
+    threshold. This lowers the latency per frame and keeps the colors of
+    consecutive frames stable.
+
+    The operation is stateful: a stack of frames (N, H, W, C) is matched in
+    order, the moments of a reference are kept while the same reference
+    array is given, and reset starts a new video. The mapping is kept for
+    reference moments of equal values, so it is also kept if the moments
+    are recomputed for each frame, e.g. converted by an OperationContext.
+    """
+
+    def __init__(self, channels: ChannelsType,
+                 channel_ranges: Tuple[ChannelRange, ...],
+                 check_input: bool = False,
+                 smoothing: float = DEFAULT_SMOOTHING,
+                 subsampling: int = 1,
+                 drift_threshold: float = DEFAULT_DRIFT_THRESHOLD):
+        super().__init__(channels, channel_ranges, check_input)
+        self.smoothing = smoothing
+        self.subsampling = subsampling
+        self.drift_threshold = drift_threshold
+        self.reset()
+
+    @property
+    def smoothing(self) -> float:
+        """ Returns the weight of the past frames in the source
+        statistics """
+        return self._smoothing
+
+    @smoothing.setter
+    def smoothing(self, smoothing: float) -> None:
+        if not 0. <= smoothing < 1.:
+            raise ValueError(f'smoothing has to be in range [0, 1), '
+                             f'the given value is {smoothing}')
+        self._smoothing = float(smoothing)
+
+    @property
+    def subsampling(self) -> int:
+        """ Returns the stride of the rows and the columns whose pixels
+        contribute to the statistics """
+        return self._subsampling
+
+    @subsampling.setter
+    def subsampling(self, subsampling: int) -> None:
+        if not isinstance(subsampling, int) or isinstance(subsampling, bool):
+            raise TypeError(f'subsampling has to be of type {repr(int)}')
+        if subsampling < 1:
+            raise ValueError(f'subsampling has to be at least 1, '
+                             f'the given value is {subsampling}')
+        self._subsampling = subsampling
+
+    @property
+    def drift_threshold(self) -> float:
+        """ Returns the drift of the source statistics that recomputes the
+        mapping, in standard deviations of the source channels """
+        return self._drift_threshold
+
+    @drift_threshold.setter
+    def drift_threshold(self, drift_threshold: float) -> None:
+        if drift_threshold < 0.:
+            raise ValueError(f'drift threshold has to be non-negative, '
+                             f'the given value is {drift_threshold}')
+        self._drift_threshold = float(drift_threshold)
+
+    @property
+    def recomputations(self) -> int:
+        """ Returns the number of mappings computed since the last reset """
+        return self._recomputations
+
+    def reset(self) -> None:
+        """ Forgets the statistics of the past frames and of the reference,
+        e.g. at the start of a new video """
+        self._statistics: Optional[Moments] = None
+        self._mapped_statistics: Optional[Moments] = None
+        self._mapped_reference: Optional[Moments] = None
+        self._mapping: Optional[AffineMapping] = None
+        self._reference: Optional[np.ndarray] = None
+        self._reference_moments: Optional[List[Moments]] = None
+        self._recomputations = 0
+
+    def fit(self, reference: np.ndarray) -> Moments:
+        """ Computes the moments of a reference image, which are kept while
+        the same reference array is given, or the merged moments of a
+        stack of references """
+        if reference.ndim != DIM_3:
+            moments: Moments = super().fit(reference)
+            return moments
+        return self._reference_statistics(reference)[0]
+
+    def tile_statistics(self, tiles: Iterable[np.ndarray]) -> Moments:
+        """ Accumulates the moments of the subsampled pixels of an image
+        streamed as tiles (H, W, C) """
+        step = self.subsampling
+        return super().tile_statistics(tile[::step, ::step] for tile in tiles)
+
+    def tile_mapping(self, source_statistics: Moments,
+                     reference_statistics: Moments) -> AffineMapping:
+        """ Adds the moments of a frame to the moving average of the source
+        statistics and returns the mapping of the frame, which is only
+        recomputed if the statistics drift beyond the threshold or the
+        reference statistics change """
+        statistics = self._updated(source_statistics)
+        self._statistics = statistics
+
+        if self._mapping is None or self._mapped_statistics is None or \
+                self._mapped_reference is None or \
+                not self._equal(reference_statistics,
+                                self._mapped_reference) or \
+                self._drift(statistics, self._mapped_statistics) > \
+                self.drift_threshold:
+            self._mapping = super().tile_mapping(statistics,
+                                                 reference_statistics)
+            self._mapped_statistics = statistics
+            self._mapped_reference = reference_statistics
+            self._recomputations += 1
+        return self._mapping
+
+    @staticmethod
+    def _equal(first: Moments, second: Moments) -> bool:
+        """ Returns whether two moments are the same or of equal values """
+        return first is second or (
+            first.count == second.count and
+            np.array_equal(first.mean, second.mean) and
+            np.array_equal(first.scatter, second.scatter))
+
+    def _updated(self, frame_moments: Moments) -> Moments:
+        """ Returns the moving average with the moments of a frame mixed in,
+        it is kept as moments of unit count whose scatter matrix is the
+        covariance """
+        frame = Moments(1, frame_moments.mean,
+                        frame_moments.scatter / frame_moments.count)
+        if self._statistics is None:
+            return frame
+        if self._statistics.mean.shape != frame.mean.shape:
+            raise ValueError(
+                f'Frames of {len(self._statistics.mean)} and '
+                f'{len(frame.mean)} channels cannot be matched in one video')
+
+        # mean and covariance of the mixture of the past and the frame
+        weight = self.smoothing
+        delta = frame.mean - self._statistics.mean
+        mean = self._statistics.mean + (1. - weight) * delta
+        covariance = weight * self._statistics.scatter + \
+            (1. - weight) * frame.scatter + \
+            weight * (1. - weight) * np.outer(delta, delta)
+        return Moments(1, mean, covariance)
+
+    def _drift(self, statistics: Moments, mapped_statistics: Moments) -> float:
+        """ Returns the largest change of the means and the covariances of
+        the matched channels since the last mapping, relative to the
+        standard deviations of the channels at that time """
+        channels = self._selected(len(statistics.mean))
+        current = statistics.scatter[np.ix_(channels, channels)]
+        mapped = mapped_statistics.scatter[np.ix_(channels, channels)]
+
+        std = np.sqrt(np.maximum(np.diagonal(mapped), np.finfo(float).tiny))
+        mean_drift = np.abs(statistics.mean[channels] -
+                            mapped_statistics.mean[channels]) / std
+        covariance_drift = np.abs(current - mapped) / np.outer(std, std)
+        return float(max(np.max(mean_drift), np.max(covariance_drift)))
+
+    def _apply_out(self, source: np.ndarray, reference: np.ndarray,
+                   out: np.ndarray) -> np.ndarray:
+        """ Matches a frame, or the frames of a stack in order """
+        references = self._reference_statistics(reference)
+        if source.ndim != DIM_4:
+            self._match_frame(source, references[0], out)
+            return out
+
+        for idx, frame in enumerate(source):
+            self._match_frame(frame, references[idx % len(references)],
+                              out[idx])
+        return out
+
+    def _match_frame(self, frame: np.ndarray, reference_statistics: Moments,
+                     out: np.ndarray) -> None:
+        """ Matches a frame (H, W, C) and writes it to out """
+        mapping = self.tile_mapping(self.tile_statistics([frame]),
+                                    reference_statistics)
+        self._map_pixels(self._get_feature_matrix(frame),
+                         self._get_feature_matrix(out), mapping,
+                         self._selected(frame.shape[-1]))
+
+    def _reference_statistics(self, reference: np.ndarray) -> List[Moments]:
+        """ Returns the moments of a reference, or of each reference of a
+        stack, which are kept while the same reference array is given """
+        if reference is not self._reference or \
+                self._reference_moments is None:
+            references = reference if reference.ndim == DIM_4 \
+                else [reference]
+            self._reference = reference
+            self._reference_moments = [self.tile_statistics([image])
+                                       for image in references]
+        return self._reference_moments
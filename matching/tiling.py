@@ -0,0 +1,61 @@
+"""This module splits images into tiles for out-of-core matching"""
+from typing import Iterator, Optional, Tuple
+
+TileShape = Tuple[int, int]
+
+# default bound of the working memory of tiled matching in bytes
+DEFAULT_MEMORY_BUDGET = 1 << 28
+
+# upper bound of the working memory per value of a tile in bytes, it covers
+# the tile read from the image, its converted copy, the intermediate arrays
+# of the mapping and the tile converted back
+BYTES_PER_VALUE = 32
+
+
+def tile_shape_for_budget(image_shape: Tuple[int, ...], memory_budget: int,
+                          tile_shape: Optional[TileShape] = None
+                          ) -> TileShape:
+    """ Returns the shape of the tiles of an image (H, W, C) whose working
+    memory fits into the memory budget, by default the tiles are bands of
+    full rows, which are contiguous in memory-mapped images """
+    if not isinstance(memory_budget, int) or isinstance(memory_budget, bool):
+        raise TypeError(f'memory budget has to be of type {repr(int)}')
+
+    height, width, n_channels = image_shape
+    pixel_bytes = n_channels * BYTES_PER_VALUE
+    if memory_budget < pixel_bytes:
+        raise ValueError(f'memory budget has to be at least {pixel_bytes} '
+                         f'bytes, the given value is {memory_budget}')
+
+    if tile_shape is None:
+        max_pixels = memory_budget // pixel_bytes
+        if max_pixels >= width:
+            return min(height, max_pixels // width), width
+        return 1, max_pixels
+
+    if not isinstance(tile_shape, tuple) or len(tile_shape) != 2:
+        raise TypeError(f'tile shape has to be of type {repr(TileShape)}')
+    for size in tile_shape:
+        if not isinstance(size, int) or isinstance(size, bool):
+            raise TypeError(f'tile shape has to be of type {repr(TileShape)}')
+        if size < 1:
+            raise ValueError(f'tile sizes have to be positive, '
+                             f'the given tile shape is {tile_shape}')
+
+    rows, cols = min(tile_shape[0], height), min(tile_shape[1], width)
+    if rows * cols * pixel_bytes > memory_budget:
+        raise ValueError(f'tiles of shape {tile_shape} exceed the memory '
+                         f'budget of {memory_budget} bytes')
+    return rows, cols
+
+
+def tiles(image_shape: Tuple[int, ...],
+          tile_shape: TileShape) -> Iterator[Tuple[slice, slice]]:
+    """ Splits an image (H, W, ...) into tiles in row-major order, the tiles
+    at the bottom and the right border may be smaller """
+    height, width = image_shape[:2]
+    rows, cols = tile_shape
+    for top in range(0, height, rows):
+        for left in range(0, width, cols):
+            yield (slice(top, min(top + rows, height)),
+                   slice(left, min(left + cols, width)))
@@ -15,6 +15,7 @@ Feature: Running image statistics matching with different parameters
       | matching_algorithm |
       | hm                 |
       | fdm                |
+      | msm                |
 
   Scenario Outline: Calling with color space parameter
     Given <matching_algorithm>
@@ -116,6 +117,68 @@ Feature: Running image statistics matching with different parameters
       | -m 1.                    | hm                 |
       | -m 0.567                 | hm                 |
 
+  Scenario Outline: Calling with several match proportion parameters
+    Given <matching_algorithm>
+    And <match_proportion_param>
+    When calling main
+    Then no exception is raised
+    And an output file per match proportion is created
+
+    Examples:
+      | match_proportion_param          | matching_algorithm |
+      | -m 0.25 -m 0.5 -m 0.75 -m 1.0   | hm                 |
+      | --match-proportion 0. -m 0.567  | hm                 |
+
+  Scenario Outline: Calling with bins parameter
+    Given <matching_algorithm>
+    And <color_space_param>
+    And <bins_param>
+    When calling main
+    Then no exception is raised
+    And an output file is created
+
+    Examples:
+      | color_space_param | bins_param  | matching_algorithm |
+      | --color-space lab | --bins 1024 | hm                 |
+      | -s hsv            | -b 256      | hm                 |
+      | -s rgb            | -b 64       | hm                 |
+
+  Scenario Outline: Calling with wrong bins parameter
+    Given <matching_algorithm>
+    And <bins_param>
+    When calling main
+    Then an exception is raised
+
+    Examples:
+      | bins_param | matching_algorithm |
+      | --bins 0   | hm                 |
+      | --bins -1  | hm                 |
+      | -b 1.5     | hm                 |
+      | -b 256     | fdm                |
+
+  Scenario Outline: Calling with quantiles parameter
+    Given <matching_algorithm>
+    And <quantiles_param>
+    When calling main
+    Then no exception is raised
+    And an output file is created
+
+    Examples:
+      | quantiles_param  | matching_algorithm |
+      | --quantiles 4096 | hm                 |
+      | -q 2             | hm                 |
+
+  Scenario Outline: Calling with wrong quantiles parameter
+    Given <matching_algorithm>
+    And <quantiles_param>
+    When calling main
+    Then an exception is raised
+
+    Examples:
+      | quantiles_param  | matching_algorithm |
+      | --quantiles 1    | hm                 |
+      | -q 4096          | fdm                |
+
   Scenario Outline: Calling with verify input parameter
     Given <matching_algorithm>
     And <verify_input_param>
@@ -9,6 +9,7 @@ from pytest_bdd import given, scenarios, then, when
 
 import main
 from core import HM_PLOT_FILE
+from utils.application import sweep_result_paths
 
 OUTPUT_FILE = 'output.png'
 
@@ -23,6 +24,8 @@ scenarios('../scenarios/runner.feature',
                                   color_space_param=str,
                                   channels_param=str,
                                   match_proportion_param=str,
+                                  bins_param=str,
+                                  quantiles_param=str,
                                   verify_input_param=str,
                                   plot_param=str, ))
 
@@ -80,6 +83,17 @@ def given_match_proportion_param(params: Dict[str, Any],
     params['match_proportion_param'] = match_proportion_param
 
 
+@given('<bins_param>')
+def given_bins_param(params: Dict[str, Any], bins_param: str) -> None:
+    params['bins_param'] = bins_param
+
+
+@given('<quantiles_param>')
+def given_quantiles_param(params: Dict[str, Any],
+                          quantiles_param: str) -> None:
+    params['quantiles_param'] = quantiles_param
+
+
 @given('<verify_input_param>')
 def given_verify_input_param(params: Dict[str, Any],
                              verify_input_param: bool) -> None:
@@ -105,6 +119,10 @@ def calling_main(params: Dict[str, Any], click_runner: CliRunner) -> None:
         command += params['channels_param'].split(' ')
     if 'match_proportion_param' in params:
         command += params['match_proportion_param'].split(' ')
+    if 'bins_param' in params:
+        command += params['bins_param'].split(' ')
+    if 'quantiles_param' in params:
+        command += params['quantiles_param'].split(' ')
     if 'verify_input_param' in params:
         command += params['verify_input_param'].split(' ')
     if 'plot_param' in params:
@@ -128,6 +146,16 @@ def output_exists(params: Dict[str, Any]) -> None:
     assert os.path.exists(params['result_path'])
 
 
+@then('an output file per match proportion is created')
+def output_per_match_proportion_exists(params: Dict[str, Any]) -> None:
+    match_props = [float(value) for value in
+                   params['match_proportion_param'].split(' ')[1::2]]
+    result_paths = sweep_result_paths(params['result_path'], match_props)
+    for result_path in result_paths:
+        assert os.path.exists(result_path)
+        os.remove(result_path)
+
+
 @then('an HM plot file is created')
 def hm_plot_exists() -> None:
     assert os.path.exists(HM_PLOT_FILE)
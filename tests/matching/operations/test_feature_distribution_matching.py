@@ -2,18 +2,23 @@
 # pylint: disable=missing-function-docstring (C0116)
 # pylint: disable=protected-access (W0212)
 import inspect
+import tracemalloc
 from typing import Callable, Tuple
 from unittest.mock import MagicMock, Mock, patch
 
 import numpy as np
 import pytest
 
+from core import HSV, LAB
 from matching import ChannelsType
 from matching.operations import \
     FeatureDistributionMatching as FeatureDistMatching
+from matching.operations import feature_distribution_matching as fdm_module
+from matching.operations.feature_distribution_matching import Moments
 from tests import (CHANNEL_RANGES_DEFAULT, CHANNELS_DEFAULT, MUNICH_1_PATH,
                    MUNICH_2_PATH)
 from utils.cs_conversion import ChannelRange
+from utils.cs_conversion.cs_converter_builder import build_cs_converter
 from utils.image_io import read_image
 
 ImageGenType = Callable[[Tuple[int, int, int], int], np.ndarray]
@@ -63,63 +68,87 @@ def test_get_feature_matrix(test_image: np.array,
     np.testing.assert_array_equal(result, test_image.reshape(des_shape))
 
 
-def test_center_image() -> None:
-    test_image = TEST_IMAGE_423
-    test_image_mat = FeatureDistMatching._get_feature_matrix(test_image)
-    test_image_mean = np.mean(test_image_mat, axis=0)
-    result_image_mat, result_mean = FeatureDistMatching._center_image(
-        test_image_mat)
-    np.testing.assert_array_equal(result_mean, test_image_mean)
-    np.testing.assert_almost_equal(np.mean(result_image_mat, axis=0),
-                                   np.zeros(3))
+@pytest.mark.parametrize('chunk_size', [3, 8, 1 << 16])
+def test_moments(chunk_size: int, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(fdm_module, '_CHUNK_SIZE', chunk_size)
+    feature_mat = FeatureDistMatching._get_feature_matrix(TEST_IMAGE_423)
 
+    moments = FeatureDistMatching._moments(TEST_IMAGE_423)
+    assert moments.count == len(feature_mat)
+    np.testing.assert_almost_equal(moments.mean,
+                                   np.mean(feature_mat, axis=0))
+    np.testing.assert_almost_equal(moments.scatter / moments.count,
+                                   np.cov(feature_mat, rowvar=False,
+                                          bias=True))
 
-def test_whitening() -> None:
-    test_image = TEST_IMAGE_423
-    test_image_mat = FeatureDistMatching._get_feature_matrix(test_image)
-    FeatureDistMatching._center_image(test_image_mat)
 
-    result = FeatureDistMatching._whitening(test_image_mat)
-    np.testing.assert_almost_equal(np.cov(result, rowvar=False),
-                                   np.identity(3))
+def test_moments_memory() -> None:
+    rng = np.random.default_rng(1337)
+    image = rng.random((1500, 1200, 3), dtype=np.float32)
 
+    # the statistics need no full-size intermediate
+    tracemalloc.start()
+    FeatureDistMatching._moments(image)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
 
-def test_whitening_2d() -> None:
-    test_image = TEST_IMAGE_421
-    test_image_mat = FeatureDistMatching._get_feature_matrix(test_image)
-    FeatureDistMatching._center_image(test_image_mat)
+    assert peak < image.nbytes / 4
 
-    result = FeatureDistMatching._whitening(test_image_mat)
-    np.testing.assert_almost_equal(np.var(result), 1.)
 
+@pytest.mark.parametrize('test_image', [TEST_IMAGE_423, TEST_IMAGE_421])
+def test_whitening(test_image: np.ndarray) -> None:
+    feature_mat = FeatureDistMatching._get_feature_matrix(test_image)
+    covariance = np.atleast_2d(np.cov(feature_mat, rowvar=False))
 
-def test_covariance_transformation() -> None:
-    test_image = TEST_IMAGE_423
-    test_image_mat = FeatureDistMatching._get_feature_matrix(test_image)
-    FeatureDistMatching._center_image(test_image_mat)
-    test_image_white = FeatureDistMatching._whitening(test_image_mat)
+    whitening = FeatureDistMatching._whitening(covariance)
+    result = (feature_mat - np.mean(feature_mat, axis=0)) @ whitening
+    np.testing.assert_almost_equal(
+        np.atleast_2d(np.cov(result, rowvar=False)),
+        np.identity(test_image.shape[-1]))
 
-    feature_mat_ref = FeatureDistMatching._get_feature_matrix(TEST_IMAGE_243)
 
-    result = FeatureDistMatching._covariance_transformation(test_image_white,
-                                                            feature_mat_ref)
-    np.testing.assert_almost_equal(np.cov(result, rowvar=False),
-                                   np.cov(feature_mat_ref, rowvar=False))
+@pytest.mark.parametrize('test_image', [TEST_IMAGE_243, TEST_IMAGE_241])
+def test_coloring(test_image: np.ndarray) -> None:
+    feature_mat = FeatureDistMatching._get_feature_matrix(test_image)
+    covariance = np.atleast_2d(np.cov(feature_mat, rowvar=False))
+
+    coloring = FeatureDistMatching._coloring(covariance)
+    np.testing.assert_almost_equal(coloring.T @ coloring, covariance)
 
 
-def test_covariance_transformation_2d() -> None:
-    test_image = TEST_IMAGE_421
-    test_image_mat = FeatureDistMatching._get_feature_matrix(test_image)
-    FeatureDistMatching._center_image(test_image_mat)
-    test_image_white = FeatureDistMatching._whitening(test_image_mat)
+@pytest.mark.parametrize('source, reference',
+                         [(TEST_IMAGE_423, TEST_IMAGE_243),
+                          (TEST_IMAGE_421, TEST_IMAGE_241)])
+def test_transform(source: np.ndarray, reference: np.ndarray) -> None:
+    feature_mat_src = FeatureDistMatching._get_feature_matrix(source)
+    feature_mat_ref = FeatureDistMatching._get_feature_matrix(reference)
+    source_cov = np.atleast_2d(np.cov(feature_mat_src, rowvar=False))
+    reference_cov = np.atleast_2d(np.cov(feature_mat_ref, rowvar=False))
 
-    feature_mat_ref = FeatureDistMatching._get_feature_matrix(
-        TEST_IMAGE_243[:, :, 0])
+    matrix = FeatureDistMatching._transform(source_cov, reference_cov)
+    np.testing.assert_almost_equal(matrix.T @ source_cov @ matrix,
+                                   reference_cov)
 
-    result = FeatureDistMatching._covariance_transformation(test_image_white,
-                                                            feature_mat_ref)
-    np.testing.assert_almost_equal(np.var(result),
-                                   np.var(feature_mat_ref))
+    # equal covariances are neither rotated nor mirrored
+    np.testing.assert_almost_equal(
+        FeatureDistMatching._transform(source_cov, source_cov),
+        np.identity(source.shape[-1]))
+
+
+def test_affine_mapping() -> None:
+    feature_mat_src = FeatureDistMatching._get_feature_matrix(TEST_IMAGE_423)
+    feature_mat_ref = FeatureDistMatching._get_feature_matrix(TEST_IMAGE_243)
+    matrix, bias = FeatureDistMatching._affine_mapping(
+        FeatureDistMatching._moments(feature_mat_src),
+        FeatureDistMatching._moments(feature_mat_ref), [0, 2])
+    assert matrix.shape == (2, 2)
+
+    result = feature_mat_src[:, [0, 2]] @ matrix + bias
+    np.testing.assert_almost_equal(np.mean(result, axis=0),
+                                   np.mean(feature_mat_ref[:, [0, 2]], axis=0))
+    np.testing.assert_almost_equal(
+        np.cov(result, rowvar=False),
+        np.cov(feature_mat_ref[:, [0, 2]], rowvar=False))
 
 
 @pytest.fixture(name='feature_dist_matching')
@@ -134,32 +163,40 @@ def test_design() -> None:
     assert len(FeatureDistMatching.__mro__) == 4
 
 
+def unclipped_matching(n_channels: int) -> FeatureDistMatching:
+    return FeatureDistMatching(CHANNELS_DEFAULT[0:n_channels],
+                               (ChannelRange(-1e6, 1e6),) * n_channels,
+                               check_input=True)
+
+
 @pytest.mark.parametrize('channel_range_max', [1.0, 255.])
 def test_matching(channel_range_max: float) -> None:
     source = TEST_IMAGE_423
     reference = TEST_IMAGE_243
     source[:, :, 1] *= channel_range_max
     reference[:, :, 1] *= channel_range_max
-    result = FeatureDistMatching._matching(source, reference)
+    result = unclipped_matching(3)._apply(source, reference).astype(float)
 
     feature_mat_result = FeatureDistMatching._get_feature_matrix(result)
     feature_mat_ref = FeatureDistMatching._get_feature_matrix(reference)
 
     result_mean = np.mean(feature_mat_result, axis=0)
     reference_mean = np.mean(feature_mat_ref, axis=0)
-    np.testing.assert_almost_equal(result_mean, reference_mean)
+    np.testing.assert_allclose(result_mean, reference_mean,
+                               atol=1e-5 * channel_range_max)
 
     feature_mat_result -= result_mean
     feature_mat_ref -= reference_mean
-    np.testing.assert_almost_equal(np.cov(feature_mat_result, rowvar=False),
-                                   np.cov(feature_mat_ref, rowvar=False))
+    np.testing.assert_allclose(np.cov(feature_mat_result, rowvar=False),
+                               np.cov(feature_mat_ref, rowvar=False),
+                               rtol=1e-4, atol=1e-6 * channel_range_max ** 2)
 
 
 @pytest.mark.parametrize('channel_range_max', [1.0, 255.])
 def test_matching_2d(channel_range_max: float) -> None:
     source = TEST_IMAGE_421 * channel_range_max
     reference = TEST_IMAGE_421 * channel_range_max
-    result = FeatureDistMatching._matching(source, reference)
+    result = unclipped_matching(1)._apply(source, reference).astype(float)
 
     feature_mat_result = FeatureDistMatching._get_feature_matrix(result)
     feature_mat_ref = FeatureDistMatching._get_feature_matrix(reference)
@@ -167,13 +204,14 @@ def test_matching_2d(channel_range_max: float) -> None:
     result_mean = np.mean(feature_mat_result, axis=0)
     reference_mean = np.mean(feature_mat_ref, axis=0)
 
-    np.testing.assert_almost_equal(result_mean, reference_mean)
+    np.testing.assert_allclose(result_mean, reference_mean,
+                               atol=1e-5 * channel_range_max)
 
     feature_mat_result -= result_mean
     feature_mat_ref -= reference_mean
 
-    np.testing.assert_almost_equal(np.var(feature_mat_result),
-                                   np.var(feature_mat_ref))
+    np.testing.assert_allclose(np.var(feature_mat_result),
+                               np.var(feature_mat_ref), rtol=1e-4)
 
 
 @pytest.mark.parametrize('source, reference',
@@ -250,48 +288,91 @@ def test_apply_channel_range(
     assert np.min(result[:, :, 2]) >= -127.
 
 
+@patch.object(FeatureDistMatching, FeatureDistMatching._map_pixels.__name__)
 @patch.object(FeatureDistMatching,
-              FeatureDistMatching._get_feature_matrix.__name__)
+              FeatureDistMatching._affine_mapping.__name__)
 @patch.object(FeatureDistMatching,
-              FeatureDistMatching._center_image.__name__,
-              return_value=(np.ones((2, 3)), np.ones((2, 3))))
-@patch.object(FeatureDistMatching, FeatureDistMatching._whitening.__name__)
+              FeatureDistMatching._pixel_moments.__name__)
 @patch.object(FeatureDistMatching,
-              FeatureDistMatching._covariance_transformation.__name__)
-def test_matching_order(covariance_transformation: MagicMock,
-                        whitening: MagicMock,
-                        center_image: MagicMock,
-                        get_feature_matrix: MagicMock,
+              FeatureDistMatching._get_pixel_stack.__name__)
+def test_matching_order(get_pixel_stack: MagicMock,
+                        pixel_moments: MagicMock,
+                        affine_mapping: MagicMock,
+                        map_pixels: MagicMock,
                         feature_dist_matching: FeatureDistMatching) -> None:
     mock = Mock()
-    mock_get_feature_matrix = 'mock_get_feature_matrix'
-    mock_center_image = 'mock_center_image'
-    mock_whitening = 'mock_whitening'
-    mock_covariance_transformation = 'mock_covariance_transformation'
+    mock_get_pixel_stack = 'mock_get_pixel_stack'
+    mock_pixel_moments = 'mock_pixel_moments'
+    mock_affine_mapping = 'mock_affine_mapping'
+    mock_map_pixels = 'mock_map_pixels'
 
-    mock.attach_mock(get_feature_matrix, mock_get_feature_matrix)
-    mock.attach_mock(center_image, mock_center_image)
-    mock.attach_mock(whitening, mock_whitening)
-    mock.attach_mock(covariance_transformation, mock_covariance_transformation)
+    mock.attach_mock(get_pixel_stack, mock_get_pixel_stack)
+    mock.attach_mock(pixel_moments, mock_pixel_moments)
+    mock.attach_mock(affine_mapping, mock_affine_mapping)
+    mock.attach_mock(map_pixels, mock_map_pixels)
 
     source = TEST_IMAGE_423
     reference = TEST_IMAGE_243
-    feature_dist_matching._matching(source, reference)
-
-    # check the call order
-    expected_calls = [mock_get_feature_matrix,
-                      mock_get_feature_matrix,
-                      mock_center_image,
-                      mock_center_image,
-                      mock_whitening,
-                      mock_covariance_transformation,
-                      mock_covariance_transformation + '().__iadd__',
-                      mock_covariance_transformation + '().__iadd__().reshape']
+    feature_dist_matching._apply(source, reference)
+
+    # the moments are accumulated before the pixels are mapped in one pass
+    expected_calls = [mock_get_pixel_stack,
+                      mock_get_pixel_stack,
+                      mock_pixel_moments,
+                      mock_get_pixel_stack,
+                      mock_pixel_moments,
+                      mock_affine_mapping,
+                      mock_map_pixels]
 
     calls = [call[0] for call in mock.mock_calls]
     assert calls == expected_calls
 
 
+@pytest.mark.parametrize('channels', [(0,), (0, 2), (0, 1, 2)])
+@pytest.mark.parametrize('n_references', [0, 1, 4])
+def test_apply_stack(channels: ChannelsType, n_references: int) -> None:
+    rng = np.random.default_rng(1337)
+    sources = rng.random((4, 20, 30, 3), dtype=np.float32)
+    references = rng.beta(2., 5., (4, 25, 20, 3)).astype(np.float32)
+    # 0 references stands for a single reference image without stack axis
+    reference = references[0] if n_references == 0 \
+        else references[:n_references]
+
+    feature_dist_matching = FeatureDistMatching(
+        channels, CHANNEL_RANGES_DEFAULT, check_input=True)
+    result = feature_dist_matching(sources, reference)
+
+    # the stack is matched like each of its images
+    assert result.shape == sources.shape
+    assert result.dtype == np.float32
+    for idx, source in enumerate(sources):
+        expected_result = feature_dist_matching(
+            source, references[idx if n_references > 1 else 0])
+        np.testing.assert_allclose(result[idx], expected_result, atol=1e-6)
+
+
+def test_apply_stack_out(feature_dist_matching: FeatureDistMatching) -> None:
+    rng = np.random.default_rng(1337)
+    sources = rng.random((3, 20, 30, 3), dtype=np.float32)
+    references = rng.beta(2., 5., (3, 25, 20, 3)).astype(np.float32)
+    expected_result = feature_dist_matching(sources, references)
+
+    # in-place matching of a stack
+    result = feature_dist_matching(sources, references, out=sources)
+    assert result is sources
+    np.testing.assert_array_equal(sources, expected_result)
+
+
+@pytest.mark.parametrize('reference_shape',
+                         [(3, 25, 20, 3), (1, 2, 25, 20, 3), (25, 20)])
+def test_verify_input_stack(reference_shape: Tuple[int, ...],
+                            feature_dist_matching: FeatureDistMatching) -> \
+        None:
+    sources = np.ones((4, 20, 30, 3))
+    with pytest.raises(ValueError):
+        feature_dist_matching(sources, np.ones(reference_shape))
+
+
 @pytest.mark.parametrize('source_path, reference_path',
                          [(MUNICH_1_PATH, MUNICH_2_PATH),
                           (MUNICH_2_PATH, MUNICH_1_PATH),
@@ -307,7 +388,173 @@ def test_apply_images(source_path: str, reference_path: str,
     assert 0.1 < np.mean(result) < 0.9
     assert np.min(result) >= 0.
     assert result.dtype == np.float32
+    if source_path == reference_path:
+        np.testing.assert_allclose(result, source, atol=1e-6)
+        return
     with np.testing.assert_raises(AssertionError):
         np.testing.assert_array_equal(result, source)
     with np.testing.assert_raises(AssertionError):
         np.testing.assert_array_equal(result, reference)
+
+
+@pytest.mark.parametrize('channels', [(0,), (1, 2), (0, 1, 2)])
+def test_apply_out(channels: ChannelsType,
+                   feature_dist_matching: FeatureDistMatching) -> None:
+    source = read_image(MUNICH_1_PATH)
+    reference = read_image(MUNICH_2_PATH)
+    feature_dist_matching.channels = channels
+    expected_result = feature_dist_matching(source, reference)
+
+    out = np.empty(source.shape, dtype=np.float32)
+    result = feature_dist_matching(source, reference, out=out)
+    assert result is out
+    np.testing.assert_array_equal(out, expected_result)
+
+    # in-place matching
+    result = feature_dist_matching(source, reference, out=source)
+    assert result is source
+    np.testing.assert_array_equal(source, expected_result)
+
+
+def test_apply_out_memory(feature_dist_matching: FeatureDistMatching) -> None:
+    rng = np.random.default_rng(1337)
+    source = rng.random((1500, 1200, 3), dtype=np.float32)
+    reference = rng.random((200, 300, 3), dtype=np.float32)
+    out = np.empty(source.shape, dtype=np.float32)
+
+    # the temporary memory does not grow with the image size
+    tracemalloc.start()
+    feature_dist_matching(source, reference, out=out)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert peak < out.nbytes / 2
+
+
+@pytest.mark.parametrize('channels', [(0,), (1, 2), (0, 1, 2)])
+def test_tile_statistics(channels: ChannelsType,
+                         feature_dist_matching: FeatureDistMatching) -> None:
+    source = read_image(MUNICH_1_PATH)
+    reference = read_image(MUNICH_2_PATH)
+    feature_dist_matching.channels = channels
+
+    # the moments of tiles merge to those of the whole image
+    moments = feature_dist_matching.tile_statistics(
+        np.array_split(source, 7))
+    pixels = source.reshape(-1, source.shape[-1]).astype(float)
+    assert moments.count == len(pixels)
+    np.testing.assert_allclose(moments.mean, np.mean(pixels, axis=0))
+    np.testing.assert_allclose(moments.scatter / moments.count,
+                               np.cov(pixels, rowvar=False, bias=True),
+                               atol=1e-10)
+
+    mapping = feature_dist_matching.tile_mapping(
+        moments, feature_dist_matching.tile_statistics([reference]))
+    result = np.concatenate([feature_dist_matching.map_tile(tile, mapping)
+                             for tile in np.array_split(source, 5, axis=1)],
+                            axis=1)
+    assert result.dtype == np.float32
+    np.testing.assert_allclose(
+        result, feature_dist_matching._apply(source, reference), atol=1e-5)
+
+
+def test_tile_statistics_error(
+        feature_dist_matching: FeatureDistMatching) -> None:
+    with pytest.raises(ValueError):
+        feature_dist_matching.tile_statistics([])
+
+    moments_3 = Moments(4, np.zeros(3), np.eye(3))
+    moments_1 = Moments(4, np.zeros(1), np.eye(1))
+    with pytest.raises(ValueError):
+        feature_dist_matching.merge_statistics(moments_3, moments_1)
+    with pytest.raises(ValueError):
+        feature_dist_matching.tile_mapping(moments_3, moments_1)
+
+
+def two_step_matching(source: np.ndarray, reference: np.ndarray,
+                      channels: Tuple[int, ...],
+                      channel_ranges: Tuple[ChannelRange, ...]) -> np.ndarray:
+    # whitening and coloring of the pixels as two steps with the singular
+    # value decompositions of the covariances, as FDM was first implemented
+    src = source[..., channels].reshape(-1, len(channels)).astype(float)
+    ref = reference[..., channels].reshape(-1, len(channels)).astype(float)
+    src -= np.mean(src, axis=0)
+    u_mat, s_vec, _ = np.linalg.svd(np.atleast_2d(np.cov(src, rowvar=False)))
+    white = src @ u_mat @ np.linalg.inv(np.diag(np.sqrt(s_vec)))
+    u_mat, s_vec, _ = np.linalg.svd(np.atleast_2d(np.cov(ref, rowvar=False)))
+    matched = white @ np.diag(np.sqrt(s_vec)) @ u_mat.T + np.mean(ref, axis=0)
+
+    result = source.astype(float)
+    result[..., channels] = matched.reshape(source.shape[:-1] +
+                                            (len(channels),))
+    for channel in channels:
+        np.clip(result[..., channel], channel_ranges[channel].min,
+                channel_ranges[channel].max, out=result[..., channel])
+    return result.astype(np.float32)
+
+
+@pytest.mark.parametrize('color_space', [LAB, HSV])
+@pytest.mark.parametrize('channels', [(0,), (1, 2), (0, 1, 2)])
+def test_apply_color_space(color_space: str,
+                           channels: Tuple[int, ...]) -> None:
+    converter = build_cs_converter(color_space)
+    channel_ranges = converter.target_channel_ranges()
+    source = converter.convert(read_image(MUNICH_2_PATH))
+    reference = converter.convert(read_image(MUNICH_1_PATH))
+
+    # the singular vectors are paired like in the two-step matching, so
+    # the colors are not mirrored differently outside rgb
+    feature_dist_matching = FeatureDistMatching(channels, channel_ranges)
+    expected = two_step_matching(source, reference, channels,
+                                 channel_ranges)
+    result = feature_dist_matching(source, reference)
+    scale = max(channel_range.max - channel_range.min
+                for channel_range in channel_ranges)
+    np.testing.assert_allclose(result, expected, atol=1e-4 * scale)
+
+    # the mapping of the statistics and of stacks pairs them alike
+    mapping = feature_dist_matching.tile_mapping(
+        feature_dist_matching.tile_statistics([source]),
+        feature_dist_matching.tile_statistics([reference]))
+    np.testing.assert_allclose(
+        feature_dist_matching.map_tile(source, mapping), expected,
+        atol=1e-4 * scale)
+    np.testing.assert_allclose(
+        feature_dist_matching(source[np.newaxis], reference)[0], expected,
+        atol=1e-4 * scale)
+
+
+def degenerate_sources() -> Tuple[np.ndarray, ...]:
+    rng = np.random.default_rng(42)
+    image = rng.random((30, 20, 3), dtype=np.float32)
+    gray_rgb = np.repeat(image[..., :1], 3, axis=-1)
+    constant_channel = image.copy()
+    constant_channel[..., 1] = 0.5
+    return gray_rgb, constant_channel, np.full_like(image, 0.25)
+
+
+@pytest.mark.parametrize('source', degenerate_sources())
+@pytest.mark.parametrize('channels', [(1,), (0, 1, 2)])
+@pytest.mark.filterwarnings('error')
+def test_apply_degenerate(source: np.ndarray,
+                          channels: Tuple[int, ...]) -> None:
+    reference = read_image(MUNICH_2_PATH)
+    feature_dist_matching = FeatureDistMatching(channels,
+                                                CHANNEL_RANGES_DEFAULT)
+
+    # directions without source variance get no variance instead of NaN,
+    # a constant channel that is matched alone takes the reference mean
+    result = feature_dist_matching(source, reference)
+    assert np.all(np.isfinite(result))
+    if channels == (1,) and np.ptp(source[..., 1]) == 0.:
+        np.testing.assert_allclose(result[..., 1],
+                                   np.mean(reference[..., 1]), rtol=1e-5)
+
+    # a degenerate image of a stack does not affect the others
+    stack = np.stack([reference[:30, :20], source])
+    results = feature_dist_matching(stack, reference)
+    assert np.all(np.isfinite(results))
+    np.testing.assert_allclose(results[1], result, atol=1e-6)
+    np.testing.assert_allclose(
+        results[0], feature_dist_matching(reference[:30, :20], reference),
+        atol=1e-6)
@@ -1,6 +1,9 @@
 # pylint: disable=missing-module-docstring (C0114)
 # pylint: disable=missing-function-docstring (C0116)
 import inspect
+import tracemalloc
+from typing import Tuple
+from unittest.mock import patch
 
 import cv2
 import numpy as np
@@ -10,7 +13,11 @@ from skimage.exposure import match_histograms
 from core import DIM_3, MATCH_FULL, MATCH_ZERO
 from matching import ChannelsType
 from matching.operations import HistogramMatching
-from tests import CHANNELS_DEFAULT, MUNICH_1_PATH, MUNICH_2_PATH
+from matching.operations.histogram_matching import Histograms, InverseCdfs
+from tests import (CHANNELS_DEFAULT, MUNICH_1_PATH, MUNICH_2_PATH,
+                   ONES_IMAGE_FLOAT)
+from utils.cs_conversion import ChannelRange
+from utils.cs_conversion.cs_rgb_to_lab import RgbToLabConverter
 
 from . import (TEST_REF_IMAGE, TEST_RES_IMAGE_02, TEST_RES_IMAGE_05,
                TEST_RES_IMAGE_08, TEST_SRC_IMAGE)
@@ -18,6 +25,8 @@ from . import (TEST_REF_IMAGE, TEST_RES_IMAGE_02, TEST_RES_IMAGE_05,
 # ground truth result image with matching proportion 1.0
 TEST_RES_IMAGE = match_histograms(TEST_SRC_IMAGE, TEST_REF_IMAGE)
 
+LAB_RANGES = RgbToLabConverter().target_channel_ranges()
+
 
 @pytest.fixture(name='hist_match')
 def fixture_histogram_matching() -> HistogramMatching:
@@ -172,3 +181,456 @@ def test_apply_2d_image(hist_match: HistogramMatching) -> None:
 
     # we test against scikit image histogram matching
     np.testing.assert_array_equal(result, TEST_RES_IMAGE[:, :, np.newaxis])
+
+
+@pytest.mark.parametrize('data_type', [np.uint8, np.uint16])
+@pytest.mark.parametrize('match_prop', [0.2, 0.5, MATCH_FULL])
+def test_match_channel_lut(data_type: np.dtype, match_prop: float) -> None:
+    # pylint: disable=protected-access (W0212)
+    max_value = np.iinfo(data_type).max
+    rng = np.random.default_rng(1337)
+    source = rng.integers(0, max_value, (64, 48), endpoint=True,
+                          dtype=data_type)
+    reference = (rng.beta(2., 5., (40, 50)) * max_value).astype(data_type)
+
+    hist_match = HistogramMatching(CHANNELS_DEFAULT, check_input=True,
+                                   match_prop=match_prop)
+    result = hist_match._match_channel(source, reference)
+
+    # the lookup table has to reproduce the exact implementation
+    expected_result = hist_match._match_channel(source.astype(float),
+                                                reference.astype(float))
+
+    assert result.shape == source.shape
+    np.testing.assert_array_equal(result, expected_result)
+
+
+def test_apply_integer_input(hist_match: HistogramMatching) -> None:
+    source = np.dstack([TEST_SRC_IMAGE] * DIM_3)
+    reference = np.dstack([TEST_REF_IMAGE] * DIM_3)
+
+    result = hist_match(source, reference)
+
+    assert result.dtype == np.float32
+    np.testing.assert_array_equal(result[:, :, 0], TEST_RES_IMAGE)
+
+
+@pytest.mark.parametrize('bins', [1.5, '8', True])
+def test_hm_bins_type_error(bins: int) -> None:
+    with pytest.raises(TypeError):
+        HistogramMatching(CHANNELS_DEFAULT, channel_ranges=LAB_RANGES,
+                          bins=bins)
+
+
+@pytest.mark.parametrize('bins', [0, -8])
+def test_hm_bins_value_error(bins: int) -> None:
+    with pytest.raises(ValueError):
+        HistogramMatching(CHANNELS_DEFAULT, channel_ranges=LAB_RANGES,
+                          bins=bins)
+
+
+def test_hm_bins_without_channel_ranges() -> None:
+    with pytest.raises(ValueError):
+        HistogramMatching(CHANNELS_DEFAULT, bins=256)
+
+
+def test_hm_channel_ranges_type_error() -> None:
+    with pytest.raises(TypeError):
+        HistogramMatching(CHANNELS_DEFAULT,
+                          channel_ranges=[1, 2, 3])  # type: ignore
+
+
+@pytest.mark.parametrize('match_prop', [0.5, MATCH_FULL])
+def test_match_channel_binned(match_prop: float) -> None:
+    # pylint: disable=protected-access (W0212)
+    bins = 1024
+    channel_range = LAB_RANGES[1]
+    rng = np.random.default_rng(1337)
+    source = rng.normal(20., 15., (120, 80)).astype(np.float32)
+    reference = rng.normal(-10., 30., (100, 90)).astype(np.float32)
+    source = np.clip(source, channel_range.min, channel_range.max)
+    reference = np.clip(reference, channel_range.min, channel_range.max)
+
+    exact_match = HistogramMatching(CHANNELS_DEFAULT, match_prop=match_prop)
+    binned_match = HistogramMatching(CHANNELS_DEFAULT, match_prop=match_prop,
+                                     channel_ranges=LAB_RANGES, bins=bins)
+
+    expected_result = exact_match._match_channel(source, reference)
+    result = binned_match._match_channel(source, reference, channel_range)
+
+    # outside of the sparse tails the error is within a few bin widths
+    bin_width = (channel_range.max - channel_range.min) / bins
+    error = np.abs(result - expected_result)
+    assert result.shape == source.shape
+    assert np.mean(error) < bin_width
+    assert np.quantile(error, 0.99) < 2 * bin_width
+
+
+def test_apply_binned() -> None:
+    source = np.dstack([TEST_SRC_IMAGE] * DIM_3).astype(np.float32)
+    reference = np.dstack([TEST_REF_IMAGE] * DIM_3).astype(np.float32)
+    channel_ranges = tuple([ChannelRange(0., 255.)] * DIM_3)
+
+    hist_match = HistogramMatching((1, 2), check_input=True,
+                                   channel_ranges=channel_ranges, bins=255)
+    result = hist_match(source, reference)
+
+    assert result.dtype == np.float32
+    assert result.shape == source.shape
+    np.testing.assert_array_equal(result[:, :, 0], source[:, :, 0])
+    assert np.all(result[:, :, 1:] >= TEST_REF_IMAGE.min())
+    assert np.all(result[:, :, 1:] <= TEST_REF_IMAGE.max() + 1)
+
+
+@pytest.mark.parametrize('quantiles, error_type',
+                         [(1, ValueError), (-3, ValueError),
+                          (2.5, TypeError), ('4096', TypeError)])
+def test_hm_quantiles_error(quantiles: int, error_type: type) -> None:
+    with pytest.raises(error_type):
+        HistogramMatching(CHANNELS_DEFAULT, quantiles=quantiles)
+
+
+@pytest.mark.parametrize('data_type', [float, np.uint8])
+@pytest.mark.parametrize('match_prop', [0.5, MATCH_FULL])
+def test_match_channel_quantiles(data_type: np.dtype,
+                                 match_prop: float) -> None:
+    # pylint: disable=protected-access (W0212)
+    rng = np.random.default_rng(1337)
+    source = rng.integers(0, 255, (60, 70), endpoint=True).astype(data_type)
+    reference = (rng.beta(2., 5., (50, 50)) * 255).astype(data_type)
+
+    exact_match = HistogramMatching(CHANNELS_DEFAULT, match_prop=match_prop)
+    table_match = HistogramMatching(CHANNELS_DEFAULT, match_prop=match_prop,
+                                    quantiles=4096)
+
+    expected_result = exact_match._match_channel(source, reference)
+    result = table_match._match_channel(source, reference)
+
+    assert result.shape == source.shape
+    np.testing.assert_allclose(result, expected_result, atol=1.)
+
+
+def test_lookup_inverse_cdf() -> None:
+    # pylint: disable=protected-access (W0212)
+    r_quantiles = np.array([0.2, 0.5, 1.])
+    r_values = np.array([10., 20., 50.])
+    table = HistogramMatching._inverse_cdf_table(r_quantiles, r_values, 11)
+    quantiles = np.array([0., 0.2, 0.35, 0.5, 0.75, 1.])
+
+    # the table is exact at its samples and linear in between
+    result = HistogramMatching._lookup_inverse_cdf(table, quantiles)
+    expected_result = np.interp(quantiles, r_quantiles, r_values)
+    np.testing.assert_array_almost_equal(result, expected_result)
+
+
+@pytest.mark.parametrize('data_type, bins', [(np.uint8, None),
+                                             (np.float32, None),
+                                             (np.float32, 64)])
+def test_fit_quantiles(data_type: np.dtype, bins: int) -> None:
+    rng = np.random.default_rng(1337)
+    sources = (rng.random((3, 40, 30, DIM_3)) * 255).astype(data_type)
+    reference = (rng.beta(2., 5., (25, 20, DIM_3)) * 255).astype(data_type)
+    channel_ranges = tuple([ChannelRange(0., 255.)] * DIM_3)
+    hist_match = HistogramMatching((0, 2), match_prop=0.8,
+                                   channel_ranges=channel_ranges, bins=bins,
+                                   quantiles=256)
+
+    # the inverse CDFs of the reference are compiled once by fit and reused
+    # by every transform
+    statistics = hist_match.fit(reference)
+    assert isinstance(statistics, InverseCdfs)
+    assert statistics.tables.shape == (DIM_3, 256)
+    with patch.object(HistogramMatching, '_inverse_cdf_table') as compile_:
+        results = hist_match.transform(sources, statistics)
+    assert compile_.call_count == 0
+
+    for source, result in zip(sources, results):
+        np.testing.assert_allclose(result, hist_match(source, reference),
+                                   atol=1e-3)
+
+
+@pytest.mark.parametrize('data_type', [np.uint8, np.float32])
+def test_fit_quantiles_error_bound(data_type: np.dtype) -> None:
+    rng = np.random.default_rng(1337)
+    source = (rng.random((40, 30, DIM_3)) * 255).astype(data_type)
+    reference = (rng.beta(2., 5., (25, 20, DIM_3)) * 255).astype(data_type)
+    hist_match = HistogramMatching(CHANNELS_DEFAULT, quantiles=64)
+    statistics = hist_match.fit(reference)
+    assert isinstance(statistics, InverseCdfs)
+
+    # a matched value deviates from the exact one by at most the largest
+    # difference of neighboring samples of its table
+    errors = np.abs(hist_match.transform(source, statistics) -
+                    HistogramMatching(CHANNELS_DEFAULT)(source, reference))
+    bounds = np.diff(statistics.tables, axis=-1).max(axis=-1)
+    assert np.all(errors.reshape(-1, DIM_3).max(axis=0) <= bounds + 1e-4)
+
+
+def test_fit_quantiles_error() -> None:
+    hist_match = HistogramMatching(CHANNELS_DEFAULT)
+    with pytest.raises(ValueError):
+        hist_match.inverse_cdfs(Histograms(np.ones((DIM_3, 256)), False))
+
+    # exact matching of float images has no source statistics
+    hist_match.quantiles = 16
+    statistics = hist_match.fit(ONES_IMAGE_FLOAT)
+    with pytest.raises(ValueError):
+        hist_match.transform(ONES_IMAGE_FLOAT, statistics,
+                             source_statistics=statistics)
+
+
+@pytest.mark.parametrize('channels', [CHANNELS_DEFAULT, (0, 2), (-1,)])
+@pytest.mark.parametrize('bins', [None, 512])
+def test_apply_single_pass(channels: ChannelsType, bins: int) -> None:
+    # pylint: disable=protected-access (W0212)
+    rng = np.random.default_rng(1337)
+    source: np.ndarray = rng.integers(0, 255, (30, 40, DIM_3),
+                                      endpoint=True, dtype=np.uint8)
+    reference: np.ndarray = \
+        (rng.beta(2., 5., (20, 30, DIM_3)) * 255).astype(np.uint8)
+    if bins is not None:
+        source = source.astype(np.float32) / 255
+        reference = reference.astype(np.float32) / 255
+    channel_ranges = tuple([ChannelRange(0., 1.)] * DIM_3)
+
+    hist_match = HistogramMatching(channels, match_prop=0.7,
+                                   channel_ranges=channel_ranges, bins=bins)
+    result = hist_match(source, reference)
+
+    # all channels at once give the same result as channel by channel
+    expected_result = source.astype(np.float32)
+    for channel in channels:
+        expected_result[:, :, channel] = hist_match._match_channel(
+            source[:, :, channel], reference[:, :, channel],
+            channel_ranges[channel])
+
+    assert result.dtype == np.float32
+    np.testing.assert_allclose(result, expected_result, rtol=1e-6)
+
+
+@pytest.mark.parametrize('data_type, bins',
+                         [(np.uint8, None), (np.float32, None),
+                          (np.float32, 256)])
+@pytest.mark.parametrize('n_references', [0, 1, 4])
+def test_apply_stack(data_type: np.dtype, bins: int,
+                     n_references: int) -> None:
+    rng = np.random.default_rng(1337)
+    sources = rng.integers(0, 255, (4, 20, 30, DIM_3), endpoint=True,
+                           dtype=np.uint8).astype(data_type)
+    references = (rng.beta(2., 5., (4, 25, 20, DIM_3)) * 255).astype(
+        data_type)
+    # 0 references stands for a single reference image without stack axis
+    reference = references[0] if n_references == 0 \
+        else references[:n_references]
+    channel_ranges = tuple([ChannelRange(0., 255.)] * DIM_3)
+
+    hist_match = HistogramMatching((0, 2), check_input=True, match_prop=0.8,
+                                   channel_ranges=channel_ranges, bins=bins)
+    result = hist_match(sources, reference)
+
+    assert result.shape == sources.shape
+    assert result.dtype == np.float32
+    for idx, source in enumerate(sources):
+        expected_result = hist_match(
+            source, references[idx if n_references > 1 else 0])
+        np.testing.assert_allclose(result[idx], expected_result, rtol=1e-6)
+
+
+@pytest.mark.parametrize('reference_shape',
+                         [(3, 25, 20, DIM_3), (1, 2, 25, 20, DIM_3),
+                          (25, 20)])
+def test_verify_input_stack(reference_shape: Tuple[int, ...],
+                            hist_match: HistogramMatching) -> None:
+    sources = np.ones((4, 20, 30, DIM_3))
+    with pytest.raises(ValueError):
+        hist_match(sources, np.ones(reference_shape))
+
+
+@pytest.mark.parametrize('data_type', [np.uint8, float])
+def test_sweep(data_type: np.dtype) -> None:
+    source = np.dstack([TEST_SRC_IMAGE] * DIM_3).astype(data_type)
+    reference = np.dstack([TEST_REF_IMAGE] * DIM_3).astype(data_type)
+    match_props = (MATCH_ZERO, 0.2, 0.5, 0.8, MATCH_FULL)
+
+    hist_match = HistogramMatching((0, 1), check_input=True, match_prop=0.3)
+    results = hist_match.sweep(source, reference, match_props)
+
+    # the matching proportion of the operation is not changed
+    assert hist_match.match_prop == 0.3
+
+    assert len(results) == len(match_props)
+    for match_prop, result in zip(match_props, results):
+        hist_match.match_prop = match_prop
+        expected_result = hist_match(source, reference)
+
+        assert result.dtype == np.float32
+        np.testing.assert_allclose(result, expected_result, rtol=1e-6)
+
+
+@pytest.mark.parametrize('quantiles', [None, 256])
+def test_sweep_statistics(quantiles: int) -> None:
+    source = np.dstack([TEST_SRC_IMAGE] * DIM_3).astype(np.uint8)
+    reference = np.dstack([TEST_REF_IMAGE] * DIM_3).astype(np.uint8)
+    match_props = (MATCH_ZERO, 0.5, MATCH_FULL)
+
+    hist_match = HistogramMatching((0, 1), match_prop=0.3,
+                                   quantiles=quantiles)
+    statistics = hist_match.fit(reference)
+    with patch.object(HistogramMatching, 'tile_mapping', autospec=True,
+                      side_effect=HistogramMatching.tile_mapping) as \
+            tile_mapping:
+        results = hist_match.sweep_statistics(source, statistics,
+                                              match_props)
+
+    # the source is matched once and the proportion is not changed
+    assert tile_mapping.call_count == 1
+    assert hist_match.match_prop == 0.3
+    for match_prop, result in zip(match_props, results):
+        hist_match.match_prop = match_prop
+        np.testing.assert_allclose(
+            result, hist_match.transform(source, statistics), atol=1e-4)
+
+
+@pytest.mark.parametrize('match_props', [(0.5, 1.1), (-0.2,)])
+def test_sweep_invalid_value(match_props: Tuple[float, ...],
+                             hist_match: HistogramMatching) -> None:
+    source = np.dstack([TEST_SRC_IMAGE] * DIM_3)
+    with pytest.raises(ValueError):
+        hist_match.sweep(source, source, match_props)
+
+
+@pytest.mark.parametrize('data_type, bins',
+                         [(np.uint8, None), (np.float32, None),
+                          (np.float32, 256)])
+def test_apply_out(data_type: np.dtype, bins: int) -> None:
+    rng = np.random.default_rng(1337)
+    source = rng.integers(0, 255, (40, 30, DIM_3), endpoint=True,
+                          dtype=np.uint8).astype(data_type)
+    reference = (rng.beta(2., 5., (25, 20, DIM_3)) * 255).astype(data_type)
+    channel_ranges = tuple([ChannelRange(0., 255.)] * DIM_3)
+
+    hist_match = HistogramMatching((0, 2), check_input=True, match_prop=0.8,
+                                   channel_ranges=channel_ranges, bins=bins)
+    expected_result = hist_match(source, reference)
+
+    out = np.empty(source.shape, dtype=np.float32)
+    result = hist_match(source, reference, out=out)
+    assert result is out
+    np.testing.assert_array_equal(out, expected_result)
+
+    # in-place matching
+    if source.dtype == np.float32:
+        result = hist_match(source, reference, out=source)
+        assert result is source
+        np.testing.assert_array_equal(source, expected_result)
+
+
+@pytest.mark.parametrize('data_type, bins',
+                         [(np.uint8, None), (np.float32, 1024)])
+def test_apply_out_memory(data_type: np.dtype, bins: int) -> None:
+    rng = np.random.default_rng(1337)
+    source = (rng.random((1500, 1200, DIM_3)) * 255).astype(data_type)
+    reference = (rng.random((200, 300, DIM_3)) * 255).astype(data_type)
+    out = np.empty(source.shape, dtype=np.float32)
+    channel_ranges = tuple([ChannelRange(0., 255.)] * DIM_3)
+
+    hist_match = HistogramMatching(CHANNELS_DEFAULT,
+                                   channel_ranges=channel_ranges, bins=bins)
+
+    # the temporary memory does not grow with the image size
+    tracemalloc.start()
+    hist_match(source, reference, out=out)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert peak < out.nbytes / 2
+
+
+@pytest.mark.parametrize('data_type, bins',
+                         [(np.uint8, None), (np.float32, 256)])
+def test_tile_statistics(data_type: np.dtype, bins: int) -> None:
+    rng = np.random.default_rng(1337)
+    source = rng.integers(0, 255, (40, 30, DIM_3), endpoint=True,
+                          dtype=np.uint8).astype(data_type)
+    reference = (rng.beta(2., 5., (25, 20, DIM_3)) * 255).astype(data_type)
+    channel_ranges = tuple([ChannelRange(0., 255.)] * DIM_3)
+
+    hist_match = HistogramMatching((0, 2), match_prop=0.8,
+                                   channel_ranges=channel_ranges, bins=bins)
+
+    # statistics of tiles add up to those of the whole image
+    s_statistics = hist_match.tile_statistics(np.array_split(source, 3))
+    r_statistics = hist_match.tile_statistics([reference])
+    assert s_statistics.binned == (bins is not None)
+    assert s_statistics.counts.sum() == source.size
+    np.testing.assert_array_equal(
+        s_statistics.counts, hist_match.tile_statistics([source]).counts)
+
+    mapping = hist_match.tile_mapping(s_statistics, r_statistics)
+    result = np.concatenate([hist_match.map_tile(tile, mapping)
+                             for tile in np.array_split(source, 4, axis=1)],
+                            axis=1)
+    np.testing.assert_allclose(result, hist_match(source, reference),
+                               atol=1e-4)
+
+
+def test_tile_statistics_error() -> None:
+    hist_match = HistogramMatching(CHANNELS_DEFAULT)
+    with pytest.raises(ValueError):
+        hist_match.tile_statistics([])
+
+    # float tiles are only matched in bins
+    with pytest.raises(ValueError):
+        hist_match.tile_statistics([np.zeros((2, 2, DIM_3))])
+
+
+def test_merge_statistics() -> None:
+    hist_match = HistogramMatching(CHANNELS_DEFAULT)
+    merged = hist_match.merge_statistics(
+        Histograms(np.ones((DIM_3, 256), dtype=np.intp), False),
+        Histograms(np.ones((DIM_3, 65536), dtype=np.intp), False))
+    assert merged.counts.shape == (DIM_3, 65536)
+    assert merged.counts.sum() == DIM_3 * (65536 + 256)
+
+    with pytest.raises(ValueError):
+        hist_match.merge_statistics(
+            Histograms(np.ones((DIM_3, 256)), False),
+            Histograms(np.ones((DIM_3, 256)), True))
+    with pytest.raises(ValueError):
+        hist_match.merge_statistics(
+            Histograms(np.ones((DIM_3, 256)), True),
+            Histograms(np.ones((DIM_3, 128)), True))
+    with pytest.raises(ValueError):
+        hist_match.merge_statistics(
+            Histograms(np.ones((DIM_3, 256)), False),
+            Histograms(np.ones((1, 256)), False))
+
+
+def test_tile_mapping_error() -> None:
+    hist_match = HistogramMatching(CHANNELS_DEFAULT,
+                                   channel_ranges=LAB_RANGES, bins=16)
+    with pytest.raises(ValueError):
+        hist_match.tile_mapping(Histograms(np.ones((DIM_3, 16)), True),
+                                Histograms(np.ones((DIM_3, 256)), False))
+    with pytest.raises(ValueError):
+        hist_match.tile_mapping(Histograms(np.ones((DIM_3, 16)), True),
+                                Histograms(np.ones((1, 16)), True))
+    with pytest.raises(ValueError):
+        hist_match.tile_mapping(Histograms(np.ones((DIM_3, 8)), True),
+                                Histograms(np.ones((DIM_3, 8)), True))
+    with pytest.raises(ValueError):
+        hist_match.tile_mapping(Histograms(np.ones((DIM_3, 16)), True),
+                                Histograms(np.ones((DIM_3, 8)), True))
+
+    # integer mappings are applied to integer tiles only
+    mapping = hist_match.tile_mapping(
+        Histograms(np.ones((DIM_3, 256)), False),
+        Histograms(np.ones((DIM_3, 256)), False))
+    with pytest.raises(TypeError):
+        hist_match.map_tile(np.zeros((2, 2, DIM_3)), mapping)
+
+    # values beyond the lookup tables of 8 bit statistics are rejected
+    tile = np.zeros((2, 2, DIM_3), dtype=np.uint16)
+    assert hist_match.map_tile(tile + 255, mapping).shape == tile.shape
+    with pytest.raises(ValueError):
+        hist_match.map_tile(tile + 1000, mapping)
@@ -0,0 +1,138 @@
+# pylint: disable=missing-module-docstring (C0114)
+# pylint: disable=missing-function-docstring (C0116)
+# pylint: disable=protected-access (W0212)
+import inspect
+
+import numpy as np
+import pytest
+
+from matching import ChannelsType
+from matching.operations import FeatureDistributionMatching, MeanStdMatching
+from tests import (CHANNEL_RANGES_DEFAULT, CHANNELS_DEFAULT, MUNICH_1_PATH,
+                   MUNICH_2_PATH)
+from utils.cs_conversion import ChannelRange
+from utils.image_io import read_image
+
+UNCLIPPED_RANGES = (ChannelRange(-1e6, 1e6),) * 3
+
+
+@pytest.fixture(name='mean_std_matching')
+def fixture_mean_std_matching() -> MeanStdMatching:
+    return MeanStdMatching(CHANNELS_DEFAULT, CHANNEL_RANGES_DEFAULT,
+                           check_input=True)
+
+
+def test_design() -> None:
+    assert inspect.isabstract(MeanStdMatching) is False
+    assert issubclass(MeanStdMatching, FeatureDistributionMatching)
+
+
+@pytest.mark.parametrize('channels', [(0,), (0, 2), (0, 1, 2)])
+def test_apply(channels: ChannelsType) -> None:
+    rng = np.random.default_rng(1337)
+    source = rng.random((40, 30, 3), dtype=np.float32)
+    reference = (rng.beta(2., 5., (25, 20, 3)) * 255).astype(np.float32)
+    mean_std_matching = MeanStdMatching(channels, UNCLIPPED_RANGES,
+                                        check_input=True)
+    result = mean_std_matching(source, reference)
+
+    # each matched channel obtains the mean and the deviation of the
+    # reference channel, the other channels are untouched
+    assert result.dtype == np.float32
+    result_pixels = result.reshape(-1, 3).astype(float)
+    reference_pixels = reference.reshape(-1, 3).astype(float)
+    for channel in channels:
+        np.testing.assert_allclose(np.mean(result_pixels[:, channel]),
+                                   np.mean(reference_pixels[:, channel]),
+                                   rtol=1e-5)
+        np.testing.assert_allclose(np.std(result_pixels[:, channel]),
+                                   np.std(reference_pixels[:, channel]),
+                                   rtol=1e-5)
+    for channel in {0, 1, 2} - set(channels):
+        np.testing.assert_array_equal(result[:, :, channel],
+                                      source[:, :, channel])
+
+
+def test_apply_single_channel() -> None:
+    source = read_image(MUNICH_1_PATH)
+    reference = read_image(MUNICH_2_PATH)
+
+    # a single channel has no correlations, so both operations agree
+    mean_std_matching = MeanStdMatching((1,), CHANNEL_RANGES_DEFAULT)
+    feature_dist_matching = FeatureDistributionMatching(
+        (1,), CHANNEL_RANGES_DEFAULT)
+    np.testing.assert_allclose(mean_std_matching(source, reference),
+                               feature_dist_matching(source, reference),
+                               atol=1e-6)
+
+
+def test_apply_images(mean_std_matching: MeanStdMatching) -> None:
+    source = read_image(MUNICH_1_PATH)
+    reference = read_image(MUNICH_2_PATH)
+    result = mean_std_matching(source, reference)
+
+    assert result.shape == source.shape
+    assert result.dtype == np.float32
+    assert np.min(result) >= 0.
+    assert np.max(result) <= 1.
+
+    # the result of the tiles and of the stacks is the same
+    out = np.empty(source.shape, dtype=np.float32)
+    np.testing.assert_array_equal(mean_std_matching(source, reference, out),
+                                  result)
+    np.testing.assert_array_equal(
+        mean_std_matching(source[np.newaxis], reference)[0], result)
+    mapping = mean_std_matching.tile_mapping(
+        mean_std_matching.tile_statistics(np.array_split(source, 3)),
+        mean_std_matching.tile_statistics([reference]))
+    np.testing.assert_allclose(mean_std_matching.map_tile(source, mapping),
+                               result, atol=1e-6)
+
+
+def test_apply_constant_channel(mean_std_matching: MeanStdMatching) -> None:
+    rng = np.random.default_rng(1337)
+    source = rng.random((40, 30, 3), dtype=np.float32)
+    source[:, :, 1] = 0.5
+    reference = rng.random((25, 20, 3), dtype=np.float32)
+    result = mean_std_matching(source, reference)
+
+    # a channel without deviation is mapped to the reference mean
+    np.testing.assert_allclose(result[:, :, 1],
+                               np.mean(reference[:, :, 1], dtype=float),
+                               rtol=1e-6)
+
+
+def test_affine_mapping() -> None:
+    rng = np.random.default_rng(1337)
+    source_moments = FeatureDistributionMatching._moments(
+        rng.random((40, 30, 3)))
+    reference_moments = FeatureDistributionMatching._moments(
+        rng.random((25, 20, 3)) * 2.)
+    matrix, bias = MeanStdMatching._affine_mapping(
+        source_moments, reference_moments, [0, 2])
+
+    # the matrix is diagonal
+    assert matrix.shape == (2, 2)
+    assert bias.shape == (2,)
+    np.testing.assert_array_equal(matrix, np.diag(np.diagonal(matrix)))
+
+
+def test_pixel_moments() -> None:
+    rng = np.random.default_rng(1337)
+    pixels = rng.random((2, 300, 3), dtype=np.float32)
+    moments = MeanStdMatching._pixel_moments(pixels)
+    expected = FeatureDistributionMatching._pixel_moments(pixels)
+
+    # only the diagonals of the scatter matrices are accumulated
+    assert moments.count == expected.count
+    np.testing.assert_allclose(moments.mean, expected.mean)
+    np.testing.assert_allclose(
+        moments.scatter,
+        np.diagonal(expected.scatter, axis1=-2, axis2=-1)[..., np.newaxis] *
+        np.identity(3))
+
+
+def test_converted_mapping_error(mean_std_matching: MeanStdMatching) -> None:
+    moments = FeatureDistributionMatching._moments(np.ones((4, 5, 3)))
+    with pytest.raises(NotImplementedError):
+        mean_std_matching.converted_mapping(moments, moments, np.identity(3))
@@ -0,0 +1,179 @@
+# pylint: disable=missing-module-docstring (C0114)
+# pylint: disable=missing-function-docstring (C0116)
+# pylint: disable=protected-access (W0212)
+from typing import Any
+
+import numpy as np
+import pytest
+
+from matching.operation_context import OperationContext
+from matching.operations import (FeatureDistributionMatching,
+                                 OnlineFeatureDistributionMatching)
+from tests import CHANNEL_RANGES_DEFAULT, CHANNELS_DEFAULT
+from utils.cs_conversion import ColorSpaceConverter
+from utils.cs_conversion.cs_rgb_to_lab import RgbToLabConverter
+from utils.cs_conversion.cs_rgb_to_ycbcr import RgbToYCbCrConverter
+
+
+def video(n_frames: int, brightness_step: float = 0.) -> np.ndarray:
+    rng = np.random.default_rng(1337)
+    frames = rng.beta(2., 5., (n_frames, 40, 30, 3)).astype(np.float32)
+    frames += np.arange(n_frames, dtype=np.float32)[
+        :, np.newaxis, np.newaxis, np.newaxis] * brightness_step
+    return frames
+
+
+@pytest.fixture(name='reference')
+def fixture_reference() -> np.ndarray:
+    rng = np.random.default_rng(42)
+    return rng.random((25, 20, 3), dtype=np.float32)
+
+
+@pytest.mark.parametrize('name, value, error',
+                         [('smoothing', 1., ValueError),
+                          ('smoothing', -0.1, ValueError),
+                          ('subsampling', 0, ValueError),
+                          ('subsampling', 1.5, TypeError),
+                          ('drift_threshold', -1., ValueError)])
+def test_parameters_error(name: str, value: Any, error: type) -> None:
+    with pytest.raises(error):
+        OnlineFeatureDistributionMatching(
+            CHANNELS_DEFAULT, CHANNEL_RANGES_DEFAULT, **{name: value})
+
+
+def test_first_frame(reference: np.ndarray) -> None:
+    frame = video(1)[0]
+
+    # without a history the first frame is matched like by FDM
+    online_matching = OnlineFeatureDistributionMatching(
+        CHANNELS_DEFAULT, CHANNEL_RANGES_DEFAULT, check_input=True)
+    feature_dist_matching = FeatureDistributionMatching(
+        CHANNELS_DEFAULT, CHANNEL_RANGES_DEFAULT)
+    np.testing.assert_allclose(online_matching(frame, reference),
+                               feature_dist_matching(frame, reference),
+                               atol=1e-6)
+
+
+def test_no_smoothing(reference: np.ndarray) -> None:
+    frames = video(4, brightness_step=0.05)
+
+    # without smoothing and threshold each frame is matched like by FDM
+    online_matching = OnlineFeatureDistributionMatching(
+        CHANNELS_DEFAULT, CHANNEL_RANGES_DEFAULT, smoothing=0.,
+        drift_threshold=0.)
+    feature_dist_matching = FeatureDistributionMatching(
+        CHANNELS_DEFAULT, CHANNEL_RANGES_DEFAULT)
+    for frame in frames:
+        np.testing.assert_allclose(online_matching(frame, reference),
+                                   feature_dist_matching(frame, reference),
+                                   atol=1e-6)
+    assert online_matching.recomputations == len(frames)
+
+
+def test_moving_average(reference: np.ndarray) -> None:
+    frames = video(3)
+    online_matching = OnlineFeatureDistributionMatching(
+        CHANNELS_DEFAULT, CHANNEL_RANGES_DEFAULT, smoothing=0.5)
+    for frame in frames:
+        online_matching(frame, reference)
+
+    # the moving average is the mixture of the frames weighted 1/4, 1/4
+    # and 1/2
+    pixels = [frame.reshape(-1, 3).astype(float) for frame in frames]
+    weights = [0.25, 0.25, 0.5]
+    mean = sum(weight * np.mean(frame_pixels, axis=0)
+               for weight, frame_pixels in zip(weights, pixels))
+    second_moment = sum(weight * frame_pixels.T @ frame_pixels /
+                        len(frame_pixels)
+                        for weight, frame_pixels in zip(weights, pixels))
+    statistics = online_matching._statistics
+    assert statistics is not None
+    np.testing.assert_allclose(statistics.mean, mean)
+    np.testing.assert_allclose(statistics.scatter,
+                               second_moment - np.outer(mean, mean),
+                               atol=1e-12)
+
+
+def test_drift_threshold(reference: np.ndarray) -> None:
+    frames = video(10)
+    online_matching = OnlineFeatureDistributionMatching(
+        CHANNELS_DEFAULT, CHANNEL_RANGES_DEFAULT, drift_threshold=1.)
+    results = online_matching(frames, reference)
+
+    # stable statistics keep the first mapping
+    assert online_matching.recomputations == 1
+    mapping = online_matching._mapping
+    assert mapping is not None
+    np.testing.assert_allclose(results[-1],
+                               online_matching.map_tile(frames[-1], mapping),
+                               atol=1e-6)
+
+    # drifting statistics recompute it
+    online_matching.reset()
+    online_matching.drift_threshold = 0.1
+    online_matching(video(10, brightness_step=0.05), reference)
+    assert 1 < online_matching.recomputations < 10
+
+
+def test_stack(reference: np.ndarray) -> None:
+    frames = video(5, brightness_step=0.02)
+    online_matching = OnlineFeatureDistributionMatching(
+        CHANNELS_DEFAULT, CHANNEL_RANGES_DEFAULT, check_input=True)
+    results = online_matching(frames, reference)
+
+    # a stack is matched like its frames in order
+    online_matching.reset()
+    for frame, result in zip(frames, results):
+        np.testing.assert_array_equal(online_matching(frame, reference),
+                                      result)
+
+
+def test_reference_statistics(reference: np.ndarray) -> None:
+    online_matching = OnlineFeatureDistributionMatching(
+        CHANNELS_DEFAULT, CHANNEL_RANGES_DEFAULT)
+    statistics = online_matching._reference_statistics(reference)
+
+    # the statistics are kept for the same reference array
+    assert online_matching._reference_statistics(reference) is statistics
+    assert online_matching._reference_statistics(
+        reference.copy()) is not statistics
+    assert online_matching.fit(reference) is online_matching.fit(reference)
+
+
+def test_subsampling(reference: np.ndarray) -> None:
+    frame = video(1)[0]
+    online_matching = OnlineFeatureDistributionMatching(
+        CHANNELS_DEFAULT, CHANNEL_RANGES_DEFAULT, subsampling=2)
+    moments = online_matching.tile_statistics([frame])
+
+    assert moments.count == frame[::2, ::2].size // 3
+    np.testing.assert_allclose(
+        moments.mean, np.mean(frame[::2, ::2].reshape(-1, 3), axis=0),
+        rtol=1e-6)
+    assert online_matching(frame, reference).shape == frame.shape
+
+
+@pytest.mark.parametrize('converter', [RgbToYCbCrConverter(),
+                                       RgbToLabConverter()])
+@pytest.mark.parametrize('bind', [False, True])
+def test_context(converter: ColorSpaceConverter, bind: bool,
+                 reference: np.ndarray) -> None:
+    online_matching = OnlineFeatureDistributionMatching(
+        CHANNELS_DEFAULT, converter.target_channel_ranges(),
+        drift_threshold=1.)
+    context = OperationContext(converter, online_matching)
+    if bind:
+        context.bind(reference)
+
+    # the reference moments are converted again for each frame, e.g. folded
+    # into the mapping of a linear color space, but stable statistics still
+    # keep the first mapping
+    for frame in video(10):
+        context(frame, None if bind else reference)
+    assert online_matching.recomputations == 1
+
+    online_matching.reset()
+    online_matching.drift_threshold = 0.1
+    for frame in video(10, brightness_step=0.05):
+        context(frame, None if bind else reference)
+    assert 1 < online_matching.recomputations < 10
@@ -176,3 +176,27 @@ def test_call(verify_input: MagicMock,
     calls = [call[0] for call in mock.mock_calls]
 
     assert calls == expected_calls
+
+
+def test_call_out(stub_operation: StubOperationMul) -> None:
+    source = 0.1 * ONES_IMAGE.astype(np.float32)
+    reference = 0.2 * ONES_IMAGE.astype(np.float32)
+    out = np.empty(source.shape, dtype=np.float32)
+
+    result = stub_operation(source, reference, out=out)
+
+    assert result is out
+    np.testing.assert_array_equal(out, source * reference)
+
+
+@pytest.mark.parametrize('out, error_type',
+                         [(list(), TypeError),
+                          (np.empty((2, 3, 4), dtype=np.float32), ValueError),
+                          (np.empty((2, 3, 3), dtype=np.float64), TypeError),
+                          (np.empty((2, 3, 6), dtype=np.float32)[..., ::2],
+                           ValueError)])
+def test_call_out_invalid(out: np.ndarray, error_type: type,
+                          stub_operation: StubOperationMul) -> None:
+    source = reference = np.ones((2, 3, 3), dtype=np.float32)
+    with pytest.raises(error_type):
+        stub_operation(source, reference, out=out)
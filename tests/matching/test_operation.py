@@ -3,11 +3,74 @@
 # pylint: disable=protected-access (W0212)
 import abc
 import inspect
+import pickle
+
+import numpy as np
+import pytest
 
 from matching import Operation
+from matching.operations import FeatureDistributionMatching, HistogramMatching
+from tests import (CHANNEL_RANGES_DEFAULT, CHANNELS_DEFAULT, ONES_IMAGE,
+                   ONES_IMAGE_FLOAT)
+
+from .operations.stub_operation import StubOperationMul
 
 
 def test_design() -> None:
     assert issubclass(Operation, abc.ABC) is True
     assert inspect.isabstract(Operation) is True
     assert len(Operation.__mro__) == 3
+
+
+@pytest.mark.parametrize('operation', [
+    FeatureDistributionMatching(CHANNELS_DEFAULT, CHANNEL_RANGES_DEFAULT,
+                                check_input=True),
+    HistogramMatching(CHANNELS_DEFAULT, check_input=True,
+                      channel_ranges=CHANNEL_RANGES_DEFAULT, bins=256),
+    HistogramMatching(CHANNELS_DEFAULT, check_input=True,
+                      channel_ranges=CHANNEL_RANGES_DEFAULT, bins=256,
+                      quantiles=4096),
+    HistogramMatching(CHANNELS_DEFAULT, check_input=True, quantiles=4096)])
+def test_fit_transform(operation: Operation) -> None:
+    rng = np.random.default_rng(1337)
+    sources = rng.random((3, 40, 30, 3), dtype=np.float32)
+    reference = rng.beta(2., 5., (25, 20, 3)).astype(np.float32)
+
+    # the statistics survive pickling, e.g. to worker processes
+    statistics = pickle.loads(pickle.dumps(operation.fit(reference)))
+    results = operation.transform(sources, statistics)
+    assert results.dtype == np.float32
+    for source, result in zip(sources, results):
+        np.testing.assert_allclose(result, operation(source, reference),
+                                   atol=1e-5)
+
+    # the result is written to out, which may be the source itself
+    source = sources[0]
+    expected = operation.transform(source, statistics)
+    assert operation.transform(source, statistics, out=source) is source
+    np.testing.assert_array_equal(source, expected)
+
+
+def test_fit_stack() -> None:
+    rng = np.random.default_rng(1337)
+    references = rng.random((2, 25, 20, 3), dtype=np.float32)
+    operation = FeatureDistributionMatching(CHANNELS_DEFAULT,
+                                            CHANNEL_RANGES_DEFAULT)
+
+    # the images of a stack are fitted together
+    statistics = operation.fit(references)
+    expected = operation.fit(np.concatenate(references))
+    assert statistics.count == expected.count
+    np.testing.assert_allclose(statistics.mean, expected.mean)
+    np.testing.assert_allclose(statistics.scatter, expected.scatter)
+
+    with pytest.raises(ValueError):
+        operation.fit(references[0, 0])
+
+
+def test_fit_not_supported() -> None:
+    # exact float Histogram Matching needs the reference image itself
+    with pytest.raises(ValueError):
+        HistogramMatching(CHANNELS_DEFAULT).fit(ONES_IMAGE_FLOAT)
+    with pytest.raises(NotImplementedError):
+        StubOperationMul(CHANNELS_DEFAULT).fit(ONES_IMAGE)
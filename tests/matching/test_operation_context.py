@@ -1,16 +1,32 @@
 # pylint: disable=missing-module-docstring (C0114)
 # pylint: disable=missing-function-docstring (C0116)
+# pylint: disable=protected-access (W0212)
+import tracemalloc
+from pathlib import Path
+from typing import Optional, Tuple, Type
 from unittest.mock import MagicMock, Mock, patch
 
+import numpy as np
 import pytest
 
-from matching.operation_context import OperationContext
+from matching import Operation
+from matching.operation_context import OperationContext, has_statistics
+from matching.operations import (FeatureDistributionMatching,
+                                 HistogramMatching, MeanStdMatching)
+from matching.tiling import BYTES_PER_VALUE
 from tests import CHANNELS_DEFAULT, ONES_IMAGE
 from tests.utils.cs_conversion import StubConverter
+from utils.cs_conversion import ChannelRange, ColorSpaceConverter
+from utils.cs_conversion.cs_linear import LinearConverter
 from utils.cs_conversion.cs_rgb_to_lab import RgbToLabConverter
+from utils.cs_conversion.cs_rgb_to_opponent import RgbToOpponentConverter
+from utils.cs_conversion.cs_rgb_to_xyz import RgbToXyzConverter
+from utils.cs_conversion.cs_rgb_to_ycbcr import RgbToYCbCrConverter
 
 from .operations.stub_operation import StubOperationMul, StubOperationSum
 
+CHANNEL_RANGES_LAB = RgbToLabConverter().target_channel_ranges()
+
 
 @pytest.fixture(name='context')
 def fixture_context() -> OperationContext:
@@ -81,3 +97,235 @@ def test_call_order(convert_back: MagicMock,
 
     calls = [call[0] for call in mock.mock_calls]
     assert calls == expected_calls
+
+
+def tiled_context(operation_type: Type[Operation]) -> OperationContext:
+    converter = RgbToLabConverter()
+    channel_ranges = converter.target_channel_ranges()
+    if operation_type is HistogramMatching:
+        return OperationContext(converter, HistogramMatching(
+            CHANNELS_DEFAULT, channel_ranges=channel_ranges, bins=256))
+    return OperationContext(converter, FeatureDistributionMatching(
+        CHANNELS_DEFAULT, channel_ranges=channel_ranges))
+
+
+@pytest.mark.parametrize('operation_type',
+                         [HistogramMatching, FeatureDistributionMatching])
+@pytest.mark.parametrize('tile_shape', [None, (7, 13)])
+def test_match_tiled(operation_type: Type[Operation],
+                     tile_shape: Optional[Tuple[int, int]],
+                     tmp_path: Path) -> None:
+    rng = np.random.default_rng(1337)
+    source = rng.random((60, 40, 3), dtype=np.float32)
+    reference = rng.beta(2., 5., (30, 50, 3)).astype(np.float32)
+    context = tiled_context(operation_type)
+
+    # the result is streamed to a memory-mapped output
+    out = np.memmap(tmp_path / 'result.raw', dtype=np.float32, mode='w+',
+                    shape=source.shape)
+    memory_budget = 10 * source.shape[1] * 3 * BYTES_PER_VALUE
+    result = context.match_tiled(source, reference, out,
+                                 memory_budget=memory_budget,
+                                 tile_shape=tile_shape)
+    assert result is out
+    np.testing.assert_allclose(out, context(source, reference), atol=1e-4)
+
+
+@pytest.mark.parametrize('converter', [RgbToYCbCrConverter(),
+                                       RgbToXyzConverter(),
+                                       RgbToOpponentConverter()])
+def test_match_tiled_linear(converter: LinearConverter,
+                            tmp_path: Path) -> None:
+    rng = np.random.default_rng(1337)
+    source = rng.random((60, 40, 3), dtype=np.float32)
+    reference = rng.beta(5., 2., (30, 50, 3)).astype(np.float32)
+    context = OperationContext(converter, FeatureDistributionMatching(
+        CHANNELS_DEFAULT, converter.target_channel_ranges()))
+
+    # the tiles are mapped with the folded conversions like the image
+    out = np.memmap(tmp_path / 'result.raw', dtype=np.float32, mode='w+',
+                    shape=source.shape)
+    with patch.object(FeatureDistributionMatching, 'map_converted',
+                      autospec=True,
+                      side_effect=FeatureDistributionMatching.map_converted
+                      ) as map_converted:
+        context.match_tiled(source, reference, out, tile_shape=(7, 13))
+    assert map_converted.call_count == 9 * 4
+    np.testing.assert_allclose(out, context(source, reference), atol=1e-5)
+
+
+@pytest.mark.parametrize('memory_budget', [1 << 20, 1 << 22])
+def test_match_tiled_memory(memory_budget: int, tmp_path: Path) -> None:
+    rng = np.random.default_rng(1337)
+    shape = (1500, 1200, 3)
+    source = np.memmap(tmp_path / 'source.raw', dtype=np.float32,
+                       mode='w+', shape=shape)
+    source[:] = rng.random(shape, dtype=np.float32)
+    reference = np.memmap(tmp_path / 'reference.raw', dtype=np.float32,
+                          mode='w+', shape=shape)
+    reference[:] = rng.beta(2., 5., shape)
+    out = np.memmap(tmp_path / 'result.raw', dtype=np.float32, mode='w+',
+                    shape=shape)
+    context = tiled_context(FeatureDistributionMatching)
+
+    # neither the statistics nor the mapping hold more than a few tiles
+    tracemalloc.start()
+    context.match_tiled(source, reference, out, memory_budget=memory_budget)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert peak < memory_budget
+
+
+def test_match_tiled_error(context: OperationContext) -> None:
+    with pytest.raises(ValueError):
+        context.match_tiled(ONES_IMAGE, ONES_IMAGE, ONES_IMAGE[1:])
+
+    # the stub operation does not support tiled matching
+    with pytest.raises(NotImplementedError):
+        context.match_tiled(ONES_IMAGE, ONES_IMAGE,
+                            np.empty(ONES_IMAGE.shape, dtype=np.float32))
+
+
+def test_match_statistics() -> None:
+    rng = np.random.default_rng(1337)
+    source = rng.random((60, 40, 3), dtype=np.float32)
+    reference = rng.beta(2., 5., (30, 50, 3)).astype(np.float32)
+    converter = RgbToLabConverter()
+    context = OperationContext(converter, HistogramMatching(
+        CHANNELS_DEFAULT, channel_ranges=converter.target_channel_ranges(),
+        bins=256))
+
+    statistics = context.fit(reference)
+    result = context.match_statistics(source, statistics)
+    np.testing.assert_allclose(result, context(source, reference),
+                               atol=1e-4)
+
+    # the source statistics may come from another decode of the source
+    np.testing.assert_allclose(
+        context.match_statistics(source, statistics,
+                                 statistics_source=source), result)
+    assert not np.allclose(
+        context.match_statistics(source, statistics,
+                                 statistics_source=reference), result)
+
+
+@pytest.mark.parametrize('operation_type',
+                         [FeatureDistributionMatching, MeanStdMatching])
+@pytest.mark.parametrize('channels', [(0,), (1, 2), (0, 1, 2)])
+def test_call_linear(operation_type: Type[FeatureDistributionMatching],
+                     channels: Tuple[int, ...]) -> None:
+    rng = np.random.default_rng(1337)
+    source = rng.random((60, 40, 3), dtype=np.float32)
+    reference = rng.beta(2., 5., (30, 50, 3)).astype(np.float32)
+    operation = operation_type(channels, (ChannelRange(-1e6, 1e6),) * 3,
+                               check_input=True)
+
+    # the folded conversions match like the converted images, but the
+    # result is clipped to the rgb cube
+    for converter in (RgbToYCbCrConverter(), RgbToOpponentConverter()):
+        expected = np.clip(converter.convert_back(operation(
+            converter.convert(source), converter.convert(reference))), 0., 1.)
+        result = OperationContext(converter, operation)(source, reference)
+        assert result.dtype == np.float32
+        np.testing.assert_allclose(result, expected, atol=1e-5)
+
+
+@pytest.mark.parametrize('operation_type',
+                         [FeatureDistributionMatching, MeanStdMatching])
+@pytest.mark.parametrize('converter', [RgbToYCbCrConverter(),
+                                       RgbToXyzConverter(),
+                                       RgbToOpponentConverter()])
+def test_linear_paths(operation_type: Type[FeatureDistributionMatching],
+                      converter: LinearConverter, tmp_path: Path) -> None:
+    rng = np.random.default_rng(1337)
+    source = rng.random((60, 40, 3), dtype=np.float32)
+    reference = rng.beta(5., 2., (30, 50, 3)).astype(np.float32)
+    context = OperationContext(converter, operation_type(
+        CHANNELS_DEFAULT, converter.target_channel_ranges()))
+    expected = context(source, reference)
+
+    # the statistics of fit are matched like the reference image
+    np.testing.assert_allclose(
+        context.match_statistics(source, context.fit(reference)), expected,
+        atol=1e-5)
+
+    # all paths back from the linear color space stay in the rgb cube
+    out = np.memmap(tmp_path / 'result.raw', dtype=np.float32, mode='w+',
+                    shape=source.shape)
+    results = [context.match_tiled(source, reference, out),
+               context(source[np.newaxis], reference[np.newaxis])]
+    for result in results:
+        assert 0. <= np.min(result) and np.max(result) <= 1.
+
+
+@pytest.mark.parametrize('operation', [
+    FeatureDistributionMatching(CHANNELS_DEFAULT, CHANNEL_RANGES_LAB),
+    HistogramMatching(CHANNELS_DEFAULT, channel_ranges=CHANNEL_RANGES_LAB,
+                      bins=64),
+    HistogramMatching(CHANNELS_DEFAULT, quantiles=4096),
+    HistogramMatching(CHANNELS_DEFAULT)])
+def test_bind(operation: Operation) -> None:
+    rng = np.random.default_rng(1337)
+    sources = rng.random((3, 40, 30, 3), dtype=np.float32)
+    reference = rng.beta(2., 5., (25, 20, 3)).astype(np.float32)
+    converter = RgbToLabConverter()
+    context = OperationContext(converter, operation)
+    assert context.bound is False
+
+    # the reference is converted once, FDM and binned or compiled HM keep
+    # its statistics only and exact HM the converted reference
+    with patch.object(converter, 'convert', wraps=converter.convert) as \
+            convert:
+        context.bind(reference)
+        results = [context(source) for source in sources]
+    assert context.bound is True
+    assert convert.call_count == 1 + len(sources)
+    assert (context._bound_reference is None) == has_statistics(operation)
+
+    for source, result in zip(sources, results):
+        np.testing.assert_allclose(result, context(source, reference),
+                                   atol=1e-5)
+
+
+def test_bind_error() -> None:
+    operation = HistogramMatching(CHANNELS_DEFAULT,
+                                  channel_ranges=CHANNEL_RANGES_LAB, bins=64)
+    context = OperationContext(RgbToLabConverter(), operation)
+
+    # errors of fitting the reference are not mistaken for a missing
+    # statistics support
+    with patch.object(operation, 'fit', side_effect=ValueError('fit')):
+        with pytest.raises(ValueError, match='fit'):
+            context.bind(np.ones((5, 4, 3), dtype=np.float32))
+    assert context.bound is False
+
+
+def test_unbind() -> None:
+    converter = RgbToLabConverter()
+    context = OperationContext(converter, FeatureDistributionMatching(
+        CHANNELS_DEFAULT, CHANNEL_RANGES_LAB))
+    context.bind(np.ones((5, 4, 3), dtype=np.float32))
+
+    # a new operation or converter unbinds the reference
+    context.operation = HistogramMatching(CHANNELS_DEFAULT)
+    assert context.bound is False
+    with pytest.raises(ValueError):
+        context(np.ones((5, 4, 3), dtype=np.float32))
+
+
+@pytest.mark.parametrize('converter', [RgbToLabConverter(),
+                                       RgbToYCbCrConverter()])
+def test_call_stack(converter: ColorSpaceConverter) -> None:
+    rng = np.random.default_rng(1337)
+    sources = rng.random((3, 40, 30, 3), dtype=np.float32)
+    reference = rng.beta(2., 5., (25, 20, 3)).astype(np.float32)
+    context = OperationContext(converter, FeatureDistributionMatching(
+        CHANNELS_DEFAULT, converter.target_channel_ranges()))
+
+    # a stack is converted in one call and matched like its images
+    results = context(sources, reference)
+    for source, result in zip(sources, results):
+        np.testing.assert_array_equal(result, context(source, reference))
+    context.bind(reference)
+    np.testing.assert_allclose(context(sources), results, atol=1e-5)
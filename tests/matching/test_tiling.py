@@ -0,0 +1,50 @@
+# pylint: disable=missing-module-docstring (C0114)
+# pylint: disable=missing-function-docstring (C0116)
+from typing import Tuple
+
+import numpy as np
+import pytest
+
+from matching.tiling import BYTES_PER_VALUE, tile_shape_for_budget, tiles
+
+IMAGE_SHAPE = (100, 80, 3)
+PIXEL_BYTES = IMAGE_SHAPE[-1] * BYTES_PER_VALUE
+
+
+@pytest.mark.parametrize('memory_budget, expected_shape',
+                         [(PIXEL_BYTES, (1, 1)),
+                          (PIXEL_BYTES * 40, (1, 40)),
+                          (PIXEL_BYTES * 80 * 10 + 1, (10, 80)),
+                          (1 << 30, (100, 80))])
+def test_tile_shape_for_budget(memory_budget: int,
+                               expected_shape: Tuple[int, int]) -> None:
+    assert tile_shape_for_budget(IMAGE_SHAPE,
+                                 memory_budget) == expected_shape
+
+
+def test_tile_shape_for_budget_given() -> None:
+    assert tile_shape_for_budget(IMAGE_SHAPE, 1 << 30, (16, 500)) == (16, 80)
+
+    with pytest.raises(ValueError):
+        tile_shape_for_budget(IMAGE_SHAPE, PIXEL_BYTES * 15, (4, 4))
+
+
+@pytest.mark.parametrize('memory_budget, tile_shape, error_type',
+                         [(PIXEL_BYTES - 1, None, ValueError),
+                          (1.5, None, TypeError),
+                          (1 << 30, (0, 4), ValueError),
+                          (1 << 30, (4,), TypeError),
+                          (1 << 30, (4, 4.), TypeError)])
+def test_tile_shape_for_budget_error(memory_budget: int,
+                                     tile_shape: Tuple[int, int],
+                                     error_type: type) -> None:
+    with pytest.raises(error_type):
+        tile_shape_for_budget(IMAGE_SHAPE, memory_budget, tile_shape)
+
+
+def test_tiles() -> None:
+    covered = np.zeros(IMAGE_SHAPE[:2], dtype=int)
+    for rows, cols in tiles(IMAGE_SHAPE, (30, 50)):
+        covered[rows, cols] += 1
+    np.testing.assert_array_equal(covered, 1)
+    assert len(list(tiles(IMAGE_SHAPE, (30, 50)))) == 8
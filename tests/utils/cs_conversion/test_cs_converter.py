@@ -0,0 +1,63 @@
+# pylint: disable=missing-module-docstring (C0114)
+# pylint: disable=missing-function-docstring (C0116)
+from typing import Any
+
+import numpy as np
+import pytest
+
+from core import HSV, LAB, RGB, YCBCR
+from utils.cs_conversion.cs_converter_builder import build_cs_converter
+
+from .stub_converter import StubConverter
+
+IMAGES = np.random.default_rng(1337).random((4, 10, 8, 3), dtype=np.float32)
+
+
+@pytest.mark.parametrize('color_space', [HSV, LAB, RGB, YCBCR])
+def test_convert_batch(color_space: str) -> None:
+    converter = build_cs_converter(color_space)
+    expected = np.stack([converter.convert(image) for image in IMAGES])
+    result = converter.convert_batch(IMAGES)
+    np.testing.assert_array_equal(result, expected)
+
+    # the result is written to dst, also if dst is not contiguous
+    dst = np.empty(IMAGES.shape, dtype=np.float32)
+    assert converter.convert_batch(IMAGES, dst) is dst
+    np.testing.assert_array_equal(dst, expected)
+    dst = np.empty((4, 10, 16, 3), dtype=np.float32)[:, :, ::2]
+    assert converter.convert_batch(IMAGES, dst) is dst
+    np.testing.assert_array_equal(dst, expected)
+
+
+@pytest.mark.parametrize('color_space', [HSV, LAB, RGB, YCBCR])
+def test_convert_back_batch(color_space: str) -> None:
+    converter = build_cs_converter(color_space)
+    converted = converter.convert_batch(IMAGES)
+    expected = np.stack([converter.convert_back(image)
+                         for image in converted])
+
+    # a non-contiguous stack is converted as well
+    np.testing.assert_array_equal(
+        converter.convert_back_batch(converted[::2]), expected[::2])
+
+    # the result may be written to the stack itself
+    assert converter.convert_back_batch(converted, converted) is converted
+    np.testing.assert_array_equal(converted, expected)
+
+
+def test_convert_batch_default() -> None:
+    # converters that cannot write to dst directly copy their result
+    converter = StubConverter()
+    dst = np.empty(IMAGES.shape, dtype=np.float32)
+    converter.convert_batch(IMAGES, dst)
+    np.testing.assert_allclose(dst, IMAGES * 0.21, rtol=1e-6)
+
+
+@pytest.mark.parametrize('images, dst, error', [
+    (IMAGES[0], None, ValueError),
+    (IMAGES, np.empty((4, 10, 8, 1), dtype=np.float32), ValueError),
+    (IMAGES, [], TypeError)])
+def test_convert_batch_error(images: np.ndarray, dst: Any,
+                             error: type) -> None:
+    with pytest.raises(error):
+        build_cs_converter(LAB).convert_batch(images, dst)
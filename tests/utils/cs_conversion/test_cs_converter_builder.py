@@ -2,11 +2,14 @@
 # pylint: disable=missing-function-docstring (C0116)
 import pytest
 
-from core import GRAY, HSV, LAB, RGB
+from core import GRAY, HSV, LAB, OPPONENT, RGB, XYZ, YCBCR
 from utils.cs_conversion.cs_converter_builder import build_cs_converter
 from utils.cs_conversion.cs_identity import IdentityConverter
 from utils.cs_conversion.cs_rgb_to_hsv import RgbToHsvConverter
 from utils.cs_conversion.cs_rgb_to_lab import RgbToLabConverter
+from utils.cs_conversion.cs_rgb_to_opponent import RgbToOpponentConverter
+from utils.cs_conversion.cs_rgb_to_xyz import RgbToXyzConverter
+from utils.cs_conversion.cs_rgb_to_ycbcr import RgbToYCbCrConverter
 
 
 def test_build_cs_converter() -> None:
@@ -23,5 +26,14 @@ def test_build_cs_converter() -> None:
     conv_rgb = build_cs_converter(RGB)
     assert isinstance(conv_rgb, IdentityConverter)
 
+    conv_opponent = build_cs_converter(OPPONENT)
+    assert isinstance(conv_opponent, RgbToOpponentConverter)
+
+    conv_xyz = build_cs_converter(XYZ)
+    assert isinstance(conv_xyz, RgbToXyzConverter)
+
+    conv_ycbcr = build_cs_converter(YCBCR)
+    assert isinstance(conv_ycbcr, RgbToYCbCrConverter)
+
     with pytest.raises(ValueError):
-        build_cs_converter('xyz')
+        build_cs_converter('yiq')
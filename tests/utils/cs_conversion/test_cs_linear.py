@@ -0,0 +1,52 @@
+# pylint: disable=missing-module-docstring (C0114)
+# pylint: disable=missing-function-docstring (C0116)
+import numpy as np
+import pytest
+
+from utils.cs_conversion import ChannelRange
+from utils.cs_conversion.cs_linear import LinearConverter
+
+MATRIX = np.array([[1., 0.5, 0.],
+                   [0., -1., 0.],
+                   [0., 0.5, 2.]])
+
+
+def test_convert_back() -> None:
+    rng = np.random.default_rng(1337)
+    image = rng.random((20, 10, 3), dtype=np.float32)
+    converter = LinearConverter(MATRIX)
+
+    image_linear = converter.convert(image)
+    assert image_linear.dtype == np.float32
+    np.testing.assert_allclose(image_linear, image @ MATRIX, rtol=1e-6)
+    np.testing.assert_allclose(converter.convert_back(image_linear), image,
+                               atol=1e-6)
+
+
+def test_convert_back_clip() -> None:
+    converter = LinearConverter(MATRIX)
+    image = np.array([[[-0.5, 0.5, 1.5], [0.25, 0.5, 0.75]]],
+                     dtype=np.float32)
+
+    # colors outside the rgb cube are clipped to it
+    expected = np.clip(image, 0., 1.)
+    image_linear = converter.convert(image)
+    np.testing.assert_allclose(converter.convert_back(image_linear),
+                               expected, atol=1e-6)
+    np.testing.assert_allclose(
+        converter.convert_back_batch(image_linear[np.newaxis]),
+        expected[np.newaxis], atol=1e-6)
+
+
+def test_channel_ranges() -> None:
+    converter = LinearConverter(MATRIX)
+    assert converter.target_channel_ranges() == (ChannelRange(0., 1.),
+                                                 ChannelRange(-1., 1.),
+                                                 ChannelRange(0., 2.))
+
+
+@pytest.mark.parametrize('matrix', [np.ones((3, 2)), np.ones(3),
+                                    np.ones((3, 3))])
+def test_matrix_error(matrix: np.ndarray) -> None:
+    with pytest.raises(ValueError):
+        LinearConverter(matrix)
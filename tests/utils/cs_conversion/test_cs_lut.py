@@ -0,0 +1,94 @@
+# pylint: disable=missing-module-docstring (C0114)
+# pylint: disable=missing-function-docstring (C0116)
+# pylint: disable=protected-access (W0212)
+from typing import Any
+
+import numpy as np
+import pytest
+
+from utils.cs_conversion.cs_lut import LutConverter
+from utils.cs_conversion.cs_rgb_to_hsv import RgbToHsvConverter
+from utils.cs_conversion.cs_rgb_to_lab import RgbToLabConverter
+
+from .fixture_image import \
+    fixture_input_image  # noqa pylint: disable=unused-import (W0611)
+
+
+def test_convert(fxt_input_image: np.ndarray) -> None:
+    converter = RgbToLabConverter()
+    lut_converter = LutConverter(converter, grid_size=65)
+    image = fxt_input_image.astype(np.float32) / 255.
+
+    # 8-bit images are converted alike as integers or as floats
+    expected = converter.convert(image)
+    result = lut_converter.convert(fxt_input_image)
+    assert result.dtype == np.float32
+    assert result.shape == expected.shape
+    np.testing.assert_allclose(result, expected, atol=0.5)
+    np.testing.assert_allclose(lut_converter.convert(image), result,
+                               atol=1e-4)
+
+    # the conversion back is the one of the converter
+    np.testing.assert_array_equal(lut_converter.convert_back(expected),
+                                  converter.convert_back(expected))
+
+
+@pytest.mark.parametrize('converter, max_error, max_error_back',
+                         [(RgbToLabConverter(), 0.5, 0.2),
+                          (RgbToHsvConverter(), 180., 0.1)])
+def test_accuracy(fxt_input_image: np.ndarray, converter: Any,
+                  max_error: float, max_error_back: float) -> None:
+    lut_converter = LutConverter(converter, grid_size=33, inverse=True)
+    accuracy = lut_converter.accuracy(fxt_input_image)
+
+    # interpolated tables deviate, hsv most near gray, where the hue is
+    # undefined
+    assert 0. < accuracy.mean_error <= accuracy.max_error <= max_error
+    assert 0. < accuracy.mean_error_back <= accuracy.max_error_back <= \
+        max_error_back
+
+
+def test_interpolate_hue() -> None:
+    converter = RgbToHsvConverter()
+    lut_converter = LutConverter(converter, grid_size=5)
+
+    # reds on both sides of the wrap of the hue keep their hue
+    image = np.array([[[255, 0, 10], [255, 10, 0], [250, 0, 0]]],
+                     dtype=np.uint8)
+    expected = converter.convert(image.astype(np.float32) / 255.)[..., 0]
+    error = np.abs(lut_converter.convert(image)[..., 0] - expected)
+    assert np.all(np.minimum(error, 360. - error) < 1.)
+
+
+def test_table_cache() -> None:
+    converter = RgbToLabConverter()
+    first = LutConverter(converter, grid_size=5)
+    second = LutConverter(converter, grid_size=5, inverse=True)
+    assert first._table(False) is second._table(False)
+    assert first._table(True) is not first._table(False)
+    assert first._table(False).shape == (5 ** 3, 3)
+
+    # converters of the same type may differ, they do not share tables
+    other = LutConverter(RgbToLabConverter(), grid_size=5)
+    assert other._table(False) is not first._table(False)
+
+
+def test_interpolate_grid_points() -> None:
+    converter = RgbToLabConverter()
+    lut_converter = LutConverter(converter, grid_size=5)
+
+    # the table is exact at the points of its grid
+    grid = lut_converter._grid(lut_converter._rgb_ranges(), 5)
+    np.testing.assert_allclose(lut_converter.convert(grid),
+                               converter.convert(grid), atol=1e-4)
+
+
+@pytest.mark.parametrize('grid_size, error', [(1, ValueError),
+                                              (257, ValueError),
+                                              (16.5, TypeError),
+                                              (None, TypeError)])
+def test_grid_size_error(grid_size: Any, error: type) -> None:
+    with pytest.raises(error):
+        LutConverter(RgbToLabConverter(), grid_size)
+    with pytest.raises(TypeError):
+        LutConverter(dict())  # type: ignore
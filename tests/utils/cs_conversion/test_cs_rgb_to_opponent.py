@@ -0,0 +1,20 @@
+# pylint: disable=missing-module-docstring (C0114)
+# pylint: disable=missing-function-docstring (C0116)
+import numpy as np
+
+from utils.cs_conversion.cs_rgb_to_opponent import (RGB_2_OPPONENT,
+                                                    RgbToOpponentConverter)
+
+
+def test_orthonormal() -> None:
+    np.testing.assert_allclose(RGB_2_OPPONENT @ RGB_2_OPPONENT.T,
+                               np.identity(3), atol=1e-12)
+
+
+def test_convert() -> None:
+    gray = np.full((1, 1, 3), 0.5, dtype=np.float32)
+    image_opponent = RgbToOpponentConverter().convert(gray)
+
+    # gray has no chroma and its intensity is the scaled rgb sum
+    np.testing.assert_allclose(image_opponent[0, 0],
+                               (0., 0., 1.5 / np.sqrt(3.)), atol=1e-6)
@@ -0,0 +1,24 @@
+# pylint: disable=missing-module-docstring (C0114)
+# pylint: disable=missing-function-docstring (C0116)
+import cv2
+import numpy as np
+
+from utils.cs_conversion.cs_rgb_to_xyz import RgbToXyzConverter
+
+from .fixture_image import \
+    fixture_input_image  # noqa pylint: disable=unused-import (W0611)
+
+
+def test_convert(fxt_input_image: np.ndarray) -> None:
+    image = fxt_input_image.astype(np.float32) / 255.
+    image_xyz = RgbToXyzConverter().convert(image)
+
+    # opencv converts rgb values as they are, without linearization
+    expected = cv2.cvtColor(image, cv2.COLOR_RGB2XYZ)
+    np.testing.assert_allclose(image_xyz, expected, atol=1e-3)
+
+
+def test_white_point() -> None:
+    white = np.ones((1, 1, 3), dtype=np.float32)
+    np.testing.assert_allclose(RgbToXyzConverter().convert(white)[0, 0],
+                               (0.95047, 1., 1.08883), atol=1e-5)
@@ -0,0 +1,27 @@
+# pylint: disable=missing-module-docstring (C0114)
+# pylint: disable=missing-function-docstring (C0116)
+import cv2
+import numpy as np
+
+from utils.cs_conversion.cs_rgb_to_ycbcr import RgbToYCbCrConverter
+
+from .fixture_image import \
+    fixture_input_image  # noqa pylint: disable=unused-import (W0611)
+
+
+def test_convert(fxt_input_image: np.ndarray) -> None:
+    image = fxt_input_image.astype(np.float32) / 255.
+    image_ycbcr = RgbToYCbCrConverter().convert(image)
+
+    # opencv orders the channels y, cr, cb, centers the chroma at 0.5 and
+    # rounds the chroma coefficients
+    expected = cv2.cvtColor(image, cv2.COLOR_RGB2YCrCb)[:, :, [0, 2, 1]]
+    expected[:, :, 1:] -= 0.5
+    np.testing.assert_allclose(image_ycbcr, expected, atol=1e-3)
+
+
+def test_convert_back(fxt_input_image: np.ndarray) -> None:
+    image = fxt_input_image.astype(np.float32) / 255.
+    converter = RgbToYCbCrConverter()
+    np.testing.assert_allclose(
+        converter.convert_back(converter.convert(image)), image, atol=1e-5)
@@ -2,15 +2,23 @@
 # pylint: disable=missing-function-docstring (C0116)
 import io
 import os
+import shutil
 import sys
+from pathlib import Path
+from unittest.mock import patch
 
+import numpy as np
 import pytest
 
-from core import FDM, GRAY, HSV, MATCH_FULL, RGB, Params
+from core import (CACHE_SIZE_MB, FDM, GRAY, HM, HSV, LAB, MATCH_FULL, MSM,
+                  OPPONENT, RGB, XYZ, YCBCR, Params)
+from matching.operation_context_builder import build_operation_context
+from matching.operations import HistogramMatching
 from tests import (MUNICH_1_GRAY_PATH, MUNICH_1_PATH, MUNICH_2_GRAY_PATH,
-                   MUNICH_2_PATH)
+                   MUNICH_2_PATH, MUNICH_3_PATH)
 from utils import application as app
-from utils.image_io import read_image
+from utils.image_io import max_value, read_image, write_image
+from utils.statistics_io import read_statistics
 
 
 @pytest.fixture(name='params')
@@ -19,9 +27,15 @@ def fixture_params() -> Params:
         {
             'color_space': GRAY,
             'channels': '0,1,2',
-            'match_proportion': MATCH_FULL,
+            'match_proportion': (MATCH_FULL,),
+            'bins': None,
+            'quantiles': None,
             'verify_input': True,
             'plot': False,
+            'cache_dir': None,
+            'cache_size': CACHE_SIZE_MB,
+            'reduction': 1,
+            'reduce_source': False,
             'source_path': MUNICH_1_PATH,
             'reference_path': MUNICH_2_PATH,
             'result_path': 'application_run_test.png'
@@ -58,3 +72,282 @@ def test_color_check_fail(color_space: str, source: str,
     reference_image = read_image(reference)
     with pytest.raises(ValueError):
         app.color_check(color_space, source_image, reference_image)
+
+
+def test_sweep_result_paths() -> None:
+    result = app.sweep_result_paths(os.path.join('out', 'result.png'),
+                                    (0.25, 1.0))
+    expected = [os.path.join('out', 'result_0.25.png'),
+                os.path.join('out', 'result_1.0.png')]
+    assert result == expected
+
+
+def test_run_sweep(params: Params) -> None:
+    params.color_space = RGB  # type: ignore
+    params.match_proportion = (0.25, 0.5, MATCH_FULL)  # type: ignore
+    app.run(HM, params)
+
+    result_paths = app.sweep_result_paths(params.result_path,
+                                          params.match_proportion)
+    for result_path in result_paths:
+        assert os.path.exists(result_path)
+        os.remove(result_path)
+    assert not os.path.exists(params.result_path)
+
+
+def test_sweep_fdm(params: Params) -> None:
+    params.color_space = RGB  # type: ignore
+    op_ctx = build_operation_context(FDM, params)
+    source = read_image(params.source_path)
+    with pytest.raises(TypeError):
+        app.sweep(op_ctx, source, source, (0.5, MATCH_FULL))
+
+
+@pytest.fixture(name='statistics_path')
+def fixture_statistics_path(tmp_path: Path) -> str:
+    reference_dir = tmp_path / 'references'
+    reference_dir.mkdir()
+    shutil.copy(MUNICH_2_PATH, reference_dir)
+    shutil.copy(MUNICH_3_PATH, reference_dir)
+
+    statistics_path = str(tmp_path / 'references.npz')
+    app.write_reference_histograms(Params({'color_space': LAB,
+                                           'bins': 256,
+                                           'workers': 1,
+                                           'reduction': 1,
+                                           'reference_dir': str(reference_dir),
+                                           'result_path': statistics_path}))
+    return statistics_path
+
+
+def test_run_statistics(params: Params, statistics_path: str,
+                        tmp_path: Path) -> None:
+    params.color_space = LAB  # type: ignore
+    params.reference_path = statistics_path  # type: ignore
+    params.result_path = str(tmp_path / 'result.png')  # type: ignore
+    params.match_proportion = (0.5, MATCH_FULL)  # type: ignore
+    app.run(HM, params)
+
+    for result_path in app.sweep_result_paths(params.result_path,
+                                              params.match_proportion):
+        assert os.path.exists(result_path)
+
+
+def test_match_statistics_sweep(params: Params, statistics_path: str
+                                ) -> None:
+    params.color_space = LAB  # type: ignore
+    params.bins = 256  # type: ignore
+    op_ctx = build_operation_context(HM, params)
+    operation = op_ctx.operation
+    assert isinstance(operation, HistogramMatching)
+    source = read_image(params.source_path)
+    statistics, _ = read_statistics(statistics_path)
+    match_props = (0.5, MATCH_FULL)
+
+    # the histograms are matched once for all proportions and the
+    # proportion of the operation is not changed
+    with patch.object(HistogramMatching, 'tile_mapping', autospec=True,
+                      side_effect=HistogramMatching.tile_mapping) as \
+            tile_mapping:
+        results = app.match_statistics(op_ctx, source, statistics,
+                                       match_props)
+    assert tile_mapping.call_count == 1
+    assert operation.match_prop == MATCH_FULL
+
+    for match_prop, result in zip(match_props, results):
+        operation.match_prop = match_prop
+        np.testing.assert_allclose(
+            result, op_ctx.match_statistics(source, statistics), atol=1e-4)
+
+
+@pytest.mark.parametrize('operation_type, color_space',
+                         [(FDM, LAB), (HM, RGB)])
+def test_run_statistics_error(params: Params, statistics_path: str,
+                              operation_type: str, color_space: str) -> None:
+    params.color_space = color_space  # type: ignore
+    params.reference_path = statistics_path  # type: ignore
+    with pytest.raises(ValueError):
+        app.run(operation_type, params)
+    assert not os.path.exists(params.result_path)
+
+
+@pytest.mark.parametrize('operation_type', [FDM, MSM])
+def test_run_moments(params: Params, operation_type: str,
+                     tmp_path: Path) -> None:
+    reference_dir = tmp_path / 'references'
+    reference_dir.mkdir()
+    shutil.copy(MUNICH_2_PATH, reference_dir)
+
+    params.color_space = LAB  # type: ignore
+    params.result_path = str(tmp_path / 'expected.png')  # type: ignore
+    app.run(operation_type, params)
+    expected = read_image(params.result_path)
+
+    # the moments of a dataset of one image target that image
+    params.reference_path = str(tmp_path / 'references.npz')  # type: ignore
+    app.write_reference_moments(Params({'color_space': LAB,
+                                        'workers': 2,
+                                        'reduction': 1,
+                                        'reference_dir': str(reference_dir),
+                                        'result_path':
+                                            params.reference_path}))
+    params.result_path = str(tmp_path / 'result.png')  # type: ignore
+    app.run(operation_type, params)
+    np.testing.assert_allclose(read_image(params.result_path), expected,
+                               atol=2. / 255)
+
+
+@pytest.mark.parametrize('operation_type, bins', [(HM, 256), (FDM, None)])
+def test_run_cache(params: Params, operation_type: str, bins: int,
+                   tmp_path: Path) -> None:
+    params.color_space = LAB  # type: ignore
+    params.bins = bins  # type: ignore
+    params.result_path = str(tmp_path / 'expected.png')  # type: ignore
+    app.run(operation_type, params)
+    expected = read_image(params.result_path)
+
+    # the first run fills the cache, the second one reads from it
+    params.cache_dir = str(tmp_path / 'cache')  # type: ignore
+    for _ in range(2):
+        params.result_path = str(tmp_path / 'result.png')  # type: ignore
+        app.run(operation_type, params)
+        assert len(os.listdir(params.cache_dir)) == 1
+        np.testing.assert_allclose(read_image(params.result_path), expected,
+                                   atol=2. / 255)
+
+    statistics_path = os.path.join(params.cache_dir,
+                                   os.listdir(params.cache_dir)[0])
+    _, color_space = read_statistics(statistics_path)
+    assert color_space == LAB
+
+
+def test_run_cache_exact(params: Params, tmp_path: Path) -> None:
+    # exact histogram matching needs the reference image itself
+    params.color_space = RGB  # type: ignore
+    params.cache_dir = str(tmp_path / 'cache')  # type: ignore
+    params.result_path = str(tmp_path / 'result.png')  # type: ignore
+    app.run(HM, params)
+    assert os.path.exists(params.result_path)
+    assert not os.path.exists(params.cache_dir)
+
+
+@pytest.mark.parametrize('operation_type, reduce_source',
+                         [(FDM, False), (FDM, True), (HM, False)])
+def test_run_reduction(params: Params, operation_type: str,
+                       reduce_source: bool, tmp_path: Path) -> None:
+    params.color_space = LAB  # type: ignore
+    params.result_path = str(tmp_path / 'expected.png')  # type: ignore
+    app.run(operation_type, params)
+    expected = read_image(params.result_path)
+
+    # the statistics of a reduced decode are close to those in full, the
+    # result keeps the full resolution of the source
+    params.reduction = 4  # type: ignore
+    params.reduce_source = reduce_source  # type: ignore
+    params.result_path = str(tmp_path / 'result.png')  # type: ignore
+    app.run(operation_type, params)
+    result = read_image(params.result_path)
+    assert result.shape == expected.shape
+    assert np.mean(np.abs(result - expected)) < 2. / 255
+
+
+def test_run_reduction_exact(params: Params, tmp_path: Path) -> None:
+    # exact histogram matching maps the source values themselves
+    params.color_space = RGB  # type: ignore
+    params.reduction = 2  # type: ignore
+    params.reduce_source = True  # type: ignore
+    params.result_path = str(tmp_path / 'result.png')  # type: ignore
+    with pytest.raises(ValueError):
+        app.run(HM, params)
+    assert not os.path.exists(params.result_path)
+
+
+@pytest.mark.parametrize('color_space, dtype',
+                         [(RGB, np.dtype(np.uint8)),
+                          (GRAY, np.dtype(np.uint8)),
+                          (RGB, np.dtype(np.uint16))])
+def test_run_native(params: Params, color_space: str, dtype: np.dtype,
+                    tmp_path: Path) -> None:
+    params.color_space = color_space  # type: ignore
+    if color_space == GRAY:
+        params.channels = '0'  # type: ignore
+        params.source_path = MUNICH_1_GRAY_PATH  # type: ignore
+        params.reference_path = MUNICH_2_GRAY_PATH  # type: ignore
+    source = read_image(params.source_path)
+    reference = read_image(params.reference_path)
+    if dtype == np.uint16:
+        params.source_path = str(tmp_path / 'source.png')  # type: ignore
+        params.reference_path = str(tmp_path / 'reference.png')  # type: ignore
+        write_image(to_dtype(source, dtype), params.source_path)
+        write_image(to_dtype(reference, dtype), params.reference_path)
+
+    # histogram matching in rgb or gray matches the images in their native
+    # type and writes the result in it, rounded instead of truncated
+    params.result_path = str(tmp_path / 'result.png')  # type: ignore
+    with patch.object(app, 'to_float', wraps=app.to_float) as to_float:
+        app.run(HM, params)
+    to_float.assert_not_called()
+    result = read_image(params.result_path, native=True)
+    assert result.dtype == dtype
+
+    expected = build_operation_context(HM, params)(
+        read_image(params.source_path), read_image(params.reference_path))
+    np.testing.assert_array_equal(result, to_dtype(expected, dtype))
+
+
+def to_dtype(image: np.ndarray, dtype: np.dtype) -> np.ndarray:
+    scaled: np.ndarray = np.rint(image * max_value(dtype)).astype(dtype)
+    return scaled
+
+
+def test_run_native_types(params: Params, tmp_path: Path) -> None:
+    # a 16-bit reference is matched with an 8-bit source as float images
+    params.color_space = RGB  # type: ignore
+    params.reference_path = str(tmp_path / 'reference.png')  # type: ignore
+    params.result_path = str(tmp_path / 'result.png')  # type: ignore
+    write_image(to_dtype(read_image(MUNICH_2_PATH), np.dtype(np.uint16)),
+                params.reference_path)
+    app.run(HM, params)
+    result = read_image(params.result_path, native=True)
+    assert result.dtype == np.uint8
+
+
+def test_run_reduction_cache(params: Params, tmp_path: Path) -> None:
+    # statistics of each reduction are cached separately
+    params.color_space = LAB  # type: ignore
+    params.cache_dir = str(tmp_path / 'cache')  # type: ignore
+    params.result_path = str(tmp_path / 'result.png')  # type: ignore
+    for reduction in (1, 2):
+        params.reduction = reduction  # type: ignore
+        app.run(FDM, params)
+    assert len(os.listdir(params.cache_dir)) == 2
+
+
+@pytest.mark.parametrize('operation_type', [FDM, MSM])
+@pytest.mark.parametrize('color_space', [OPPONENT, XYZ, YCBCR])
+def test_run_linear_statistics(params: Params, operation_type: str,
+                               color_space: str, tmp_path: Path) -> None:
+    params.color_space = color_space  # type: ignore
+    params.result_path = str(tmp_path / 'expected.png')  # type: ignore
+    app.run(operation_type, params)
+    expected = read_image(params.result_path)
+
+    # cached statistics and those of a statistics file give the result of
+    # the reference image, up to rounding to 8 bit
+    reference_dir = tmp_path / 'references'
+    reference_dir.mkdir()
+    shutil.copy(MUNICH_2_PATH, reference_dir)
+    statistics_path = str(tmp_path / 'references.npz')
+    app.write_reference_moments(Params({'color_space': color_space,
+                                        'workers': 1,
+                                        'reduction': 1,
+                                        'reference_dir': str(reference_dir),
+                                        'result_path': statistics_path}))
+
+    params.cache_dir = str(tmp_path / 'cache')  # type: ignore
+    for reference_path in (MUNICH_2_PATH, MUNICH_2_PATH, statistics_path):
+        params.reference_path = reference_path  # type: ignore
+        params.result_path = str(tmp_path / 'result.png')  # type: ignore
+        app.run(operation_type, params)
+        np.testing.assert_allclose(read_image(params.result_path), expected,
+                                   atol=1.01 / 255)
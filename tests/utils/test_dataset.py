@@ -0,0 +1,89 @@
+# pylint: disable=missing-module-docstring (C0114)
+# pylint: disable=missing-function-docstring (C0116)
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from matching.operation_context import OperationContext
+from matching.operations import FeatureDistributionMatching, HistogramMatching
+from tests import CHANNELS_DEFAULT, MUNICH_2_PATH, MUNICH_3_PATH
+from utils.cs_conversion.cs_rgb_to_lab import RgbToLabConverter
+from utils.dataset import dataset_statistics, image_paths
+from utils.image_io import read_image
+
+
+@pytest.fixture(name='context')
+def fixture_context() -> OperationContext:
+    converter = RgbToLabConverter()
+    return OperationContext(converter, HistogramMatching(
+        CHANNELS_DEFAULT, channel_ranges=converter.target_channel_ranges(),
+        bins=128))
+
+
+def test_image_paths(tmp_path: Path) -> None:
+    shutil.copy(MUNICH_2_PATH, tmp_path / 'b.png')
+    shutil.copy(MUNICH_3_PATH, tmp_path / 'a.PNG')
+    (tmp_path / 'notes.txt').write_text('no image')
+
+    assert image_paths(str(tmp_path)) == [str(tmp_path / 'a.PNG'),
+                                          str(tmp_path / 'b.png')]
+
+    with pytest.raises(ValueError):
+        image_paths(str(tmp_path / 'no_dir'))
+
+
+def test_dataset_statistics(context: OperationContext) -> None:
+    paths = [MUNICH_2_PATH, MUNICH_3_PATH, MUNICH_2_PATH]
+    histograms = dataset_statistics(context, paths)
+
+    n_values = sum(read_image(path).size for path in paths)
+    assert histograms.binned
+    assert histograms.counts.sum() == n_values
+
+    # the histograms of parallel chunks add up to the same result
+    parallel_histograms = dataset_statistics(context, paths, workers=2)
+    np.testing.assert_array_equal(parallel_histograms.counts,
+                                  histograms.counts)
+
+
+def test_dataset_moments() -> None:
+    converter = RgbToLabConverter()
+    context = OperationContext(converter, FeatureDistributionMatching(
+        CHANNELS_DEFAULT, converter.target_channel_ranges()))
+    paths = [MUNICH_2_PATH, MUNICH_3_PATH, MUNICH_2_PATH]
+    moments = dataset_statistics(context, paths)
+
+    pixels = np.concatenate([converter.convert(read_image(path)).reshape(
+        -1, len(CHANNELS_DEFAULT)) for path in paths]).astype(float)
+    assert moments.count == len(pixels)
+    np.testing.assert_allclose(moments.mean, np.mean(pixels, axis=0))
+    np.testing.assert_allclose(moments.scatter / moments.count,
+                               np.cov(pixels, rowvar=False, bias=True))
+
+    # the moments of parallel chunks merge to the same result
+    parallel_moments = dataset_statistics(context, paths, workers=2)
+    assert parallel_moments.count == moments.count
+    np.testing.assert_allclose(parallel_moments.mean, moments.mean)
+    np.testing.assert_allclose(parallel_moments.scatter, moments.scatter)
+
+
+def test_dataset_statistics_error(context: OperationContext) -> None:
+    with pytest.raises(ValueError):
+        dataset_statistics(context, [])
+    with pytest.raises(ValueError):
+        dataset_statistics(context, [MUNICH_2_PATH], workers=0)
+
+
+def test_dataset_statistics_reduced(context: OperationContext) -> None:
+    paths = [MUNICH_2_PATH, MUNICH_3_PATH]
+    histograms = dataset_statistics(context, paths, reduction=2)
+
+    # the images are decoded at half their width and height
+    n_values = sum(read_image(path, reduction=2).size for path in paths)
+    assert histograms.counts.sum() == n_values
+    parallel_histograms = dataset_statistics(context, paths, workers=2,
+                                             reduction=2)
+    np.testing.assert_array_equal(parallel_histograms.counts,
+                                  histograms.counts)
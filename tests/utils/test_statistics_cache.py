@@ -0,0 +1,70 @@
+# pylint: disable=missing-module-docstring (C0114)
+# pylint: disable=missing-function-docstring (C0116)
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from core import HM, LAB, RGB
+from matching.operations.histogram_matching import Histograms
+from tests import MUNICH_2_PATH, MUNICH_3_PATH
+from utils.statistics_cache import StatisticsCache
+
+HISTOGRAMS = Histograms(np.arange(3 * 256).reshape(3, 256), True)
+
+
+def test_key(tmp_path: Path) -> None:
+    key = StatisticsCache.key(MUNICH_2_PATH, HM, LAB, 256)
+    assert len(key) == 64
+
+    # the key depends on the content, not on the path of a reference
+    copy_path = str(tmp_path / 'copy.png')
+    shutil.copy(MUNICH_2_PATH, copy_path)
+    assert StatisticsCache.key(copy_path, HM, LAB, 256) == key
+
+    assert StatisticsCache.key(MUNICH_3_PATH, HM, LAB, 256) != key
+    assert StatisticsCache.key(MUNICH_2_PATH, HM, RGB, 256) != key
+    assert StatisticsCache.key(MUNICH_2_PATH, HM, LAB, 512) != key
+
+
+def test_get_put(tmp_path: Path) -> None:
+    cache = StatisticsCache(str(tmp_path / 'cache'))
+    key = cache.key(MUNICH_2_PATH, HM, LAB, 256)
+    assert cache.get(key) is None
+
+    cache.put(key, HISTOGRAMS, LAB)
+    result = cache.get(key)
+    assert isinstance(result, Histograms)
+    np.testing.assert_array_equal(result.counts, HISTOGRAMS.counts)
+
+    # no temporary files are left behind
+    assert os.listdir(cache.directory) == [key + '.npz']
+
+
+def test_eviction(tmp_path: Path) -> None:
+    cache = StatisticsCache(str(tmp_path / 'cache'))
+    keys = [cache.key(MUNICH_2_PATH, HM, LAB, bins) for bins in (1, 2, 3)]
+    for idx, key in enumerate(keys):
+        cache.put(key, HISTOGRAMS, LAB)
+        os.utime(os.path.join(cache.directory, key + '.npz'), (idx, idx))
+    entry_size = os.path.getsize(os.path.join(cache.directory,
+                                              keys[0] + '.npz'))
+
+    # a hit makes the oldest entry the most recently used one
+    assert cache.get(keys[0]) is not None
+
+    cache.max_size = 2 * entry_size
+    cache.put(keys[2], HISTOGRAMS, LAB)
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[2]) is not None
+
+
+@pytest.mark.parametrize('max_size, error_type',
+                         [(-1, ValueError), (1.5, TypeError)])
+def test_max_size_error(max_size: int, error_type: type,
+                        tmp_path: Path) -> None:
+    with pytest.raises(error_type):
+        StatisticsCache(str(tmp_path), max_size)
@@ -0,0 +1,75 @@
+# pylint: disable=missing-module-docstring (C0114)
+# pylint: disable=missing-function-docstring (C0116)
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from core import FDM, HM, LAB, MSM
+from matching.operations.feature_distribution_matching import Moments
+from matching.operations.histogram_matching import Histograms
+from utils.statistics_io import (is_statistics_file, read_statistics,
+                                 statistics_operation, statistics_type,
+                                 write_statistics)
+
+
+def test_is_statistics_file() -> None:
+    assert is_statistics_file('reference.npz')
+    assert is_statistics_file('reference.NPZ')
+    assert not is_statistics_file('reference.png')
+
+
+def test_statistics_operation() -> None:
+    assert statistics_operation(Histograms(np.ones((3, 4)), True)) == HM
+    assert statistics_operation(
+        Moments(4, np.zeros(3), np.eye(3))) == FDM
+
+    with pytest.raises(TypeError):
+        statistics_operation((1, 2))  # type: ignore
+
+
+def test_statistics_type() -> None:
+    assert statistics_type(HM) is Histograms
+    assert statistics_type(FDM) is Moments
+    assert statistics_type(MSM) is Moments
+
+    with pytest.raises(ValueError):
+        statistics_type('1337')
+
+
+def test_write_read_histograms(tmp_path: Path) -> None:
+    path = str(tmp_path / 'reference.npz')
+    histograms = Histograms(np.arange(12).reshape(3, 4), True)
+    write_statistics(histograms, LAB, path)
+
+    result, color_space = read_statistics(path)
+    assert isinstance(result, Histograms)
+    np.testing.assert_array_equal(result.counts, histograms.counts)
+    assert result.binned is True
+    assert color_space == LAB
+
+
+def test_write_read_moments(tmp_path: Path) -> None:
+    path = str(tmp_path / 'reference.npz')
+    moments = Moments(12, np.arange(3.), np.eye(3))
+    write_statistics(moments, LAB, path)
+
+    result, _ = read_statistics(path)
+    assert isinstance(result, Moments)
+    assert result.count == 12
+    np.testing.assert_array_equal(result.mean, moments.mean)
+    np.testing.assert_array_equal(result.scatter, moments.scatter)
+
+
+def test_write_read_statistics_error(tmp_path: Path) -> None:
+    histograms = Histograms(np.ones((3, 4)), True)
+    with pytest.raises(ValueError):
+        write_statistics(histograms, LAB, str(tmp_path / 'reference.png'))
+
+    with pytest.raises(ValueError):
+        read_statistics(str(tmp_path / 'no_statistics.npz'))
+
+    path = str(tmp_path / 'other.npz')
+    np.savez_compressed(path, operation='other')
+    with pytest.raises(ValueError):
+        read_statistics(path)
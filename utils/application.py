@@ -1,12 +1,26 @@
 """This module provides a function to perform the matching operation"""
+import os
+from typing import List, Optional, Sequence, Tuple
 
 import numpy as np
 
 from core import DIM_1, GRAY, HM, HM_PLOT_FILE, Params
+from matching import Operation
+from matching.operation_context import OperationContext, has_statistics
 from matching.operation_context_builder import build_operation_context
+from matching.operations import FeatureDistributionMatching, HistogramMatching
+from matching.operations.histogram_matching import Histograms
+from utils.cs_conversion.cs_converter_builder import build_cs_converter
+from utils.cs_conversion.cs_identity import IdentityConverter
 from utils.visu import histogram_matching_plot as hm_plot
 
-from .image_io import read_image, write_image
+from .dataset import dataset_statistics, image_paths
+from .image_io import read_image, to_float, write_image
+from .statistics_cache import StatisticsCache
+from .statistics_io import (Statistics, is_statistics_file, read_statistics,
+                            statistics_type, write_statistics)
+
+BYTES_PER_MB = 1 << 20
 
 
 def run(operation_type: str, params: Params) -> None:
@@ -19,24 +33,261 @@ def run(operation_type: str, params: Params) -> None:
         raise ValueError(f'{params.channels} is no valid channel selection '
                          f'for color space {GRAY}.')
 
-    source = read_image(params.source_path)
-    reference = read_image(params.reference_path)
-    color_check(params.color_space, source, reference)
-
     op_ctx = build_operation_context(operation_type, params)
-    result = op_ctx(source, reference)
+    native = matches_native(op_ctx, params.reference_path)
+    source = read_image(params.source_path, native=native)
+    match_props = params.match_proportion if operation_type == HM else ()
+    reduction = int(params.reduction)
 
-    write_image(result, params.result_path)
+    # the statistics of a reduced decode of the source stand in for those
+    # of the source, the mapping is applied to the source in full
+    statistics_source = None
+    if params.reduce_source:
+        if not accumulates_statistics(op_ctx.operation):
+            raise ValueError(f'Operation {operation_type} does not match '
+                             f'by means of statistics, the source cannot '
+                             f'be reduced')
+        statistics_source = read_image(params.source_path,
+                                       reduction=reduction)
 
-    if params.plot:
-        if operation_type == HM:
-            result = read_image(params.result_path)
-            images = hm_plot.Images(source, reference, result)
-            hm_plot.make_plot(HM_PLOT_FILE, images, op_ctx.converter,
-                              params.color_space, params.channels)
+    statistics: Optional[Statistics]
+    if is_statistics_file(params.reference_path):
+        statistics = read_reference_statistics(op_ctx, operation_type,
+                                               params)
+    elif params.cache_dir is not None and \
+            accumulates_statistics(op_ctx.operation):
+        statistics = cached_reference_statistics(op_ctx, operation_type,
+                                                 params)
+    elif statistics_source is not None:
+        reference = read_image(params.reference_path, reduction=reduction)
+        color_check(params.color_space, source, reference)
+        statistics = op_ctx.fit(reference)
+    else:
+        statistics = None
+
+    if statistics is None:
+        reference = read_image(params.reference_path, native=native,
+                               reduction=reduction)
+        color_check(params.color_space, source, reference)
+        if source.dtype != reference.dtype:
+            # e.g. an 8-bit source and a 16-bit reference
+            source, reference = to_float(source), to_float(reference)
+        if len(match_props) > 1:
+            results = sweep(op_ctx, source, reference, match_props)
         else:
+            results = [op_ctx(source, reference)]
+        results = [to_native(result, source.dtype) for result in results]
+    else:
+        color_check(params.color_space, source, source)
+        results = match_statistics(op_ctx, source, statistics, match_props,
+                                   statistics_source)
+
+    result_paths = [params.result_path]
+    if len(match_props) > 1:
+        result_paths = sweep_result_paths(params.result_path, match_props)
+
+    for result, result_path in zip(results, result_paths):
+        write_image(result, result_path)
+
+    if params.plot:
+        if operation_type != HM:
             print(
                 f'Plotting is not implemented for operation {operation_type}!')
+        elif is_statistics_file(params.reference_path):
+            print('Plotting requires a reference image!')
+        else:
+            reference = read_image(params.reference_path)
+            result = read_image(result_paths[0])
+            images = hm_plot.Images(to_float(source), reference, result)
+            hm_plot.make_plot(HM_PLOT_FILE, images, op_ctx.converter,
+                              params.color_space, params.channels)
+
+
+def matches_native(op_ctx: OperationContext, reference_path: str) -> bool:
+    """
+    This function checks whether the images are matched in their native
+    type, e.g. uint8 or uint16, which Histogram Matching without bins does
+    with lookup tables when no color conversion is needed
+    """
+    operation = op_ctx.operation
+    return isinstance(op_ctx.converter, IdentityConverter) and \
+        isinstance(operation, HistogramMatching) and \
+        operation.bins is None and not is_statistics_file(reference_path)
+
+
+def to_native(result: np.ndarray, dtype: np.dtype) -> np.ndarray:
+    """
+    This function rounds the float32 result of matching integer images,
+    which holds values of their integer scale, to their type, float32
+    results are returned as they are
+    """
+    if dtype == np.float32:
+        return result
+    native: np.ndarray = np.rint(result, out=result).astype(dtype)
+    return native
+
+
+def accumulates_statistics(operation: Operation) -> bool:
+    """
+    This function checks whether an operation accumulates statistics of
+    float images, which can be cached, read from a statistics file and taken
+    in place of those of the source, exact Histogram Matching has none
+    """
+    if isinstance(operation, HistogramMatching):
+        return operation.bins is not None
+    return has_statistics(operation)
+
+
+def read_reference_statistics(op_ctx: OperationContext, operation_type: str,
+                              params: Params) -> Statistics:
+    """
+    This function reads the statistics of a reference from a statistics
+    file, e.g. those of a dataset, and checks that they fit the operation
+    """
+    statistics, color_space = read_statistics(params.reference_path)
+    if not isinstance(statistics, statistics_type(operation_type)):
+        raise ValueError(f'Statistics file {params.reference_path} does not '
+                         f'contain statistics of operation {operation_type}')
+    if color_space != params.color_space.lower():
+        raise ValueError(f'Statistics file {params.reference_path} was '
+                         f'computed in color space {color_space}, but the '
+                         f'selected color space is {params.color_space}')
+
+    # the bins of the reference histograms are used if none are given
+    operation = op_ctx.operation
+    if isinstance(statistics, Histograms) and statistics.binned and \
+            isinstance(operation, HistogramMatching) and \
+            operation.bins is None:
+        operation.bins = statistics.counts.shape[-1]
+    return statistics
+
+
+def cached_reference_statistics(op_ctx: OperationContext,
+                                operation_type: str,
+                                params: Params) -> Statistics:
+    """
+    This function returns the statistics of the reference image from the
+    cache, on a miss the reference is read, converted and its statistics are
+    cached. The statistics cover all channels, so they are shared by all
+    channel selections.
+    """
+    color_space = params.color_space.lower()
+    reduction = int(params.reduction)
+    parameters: Tuple[object, ...] = (operation_type, color_space)
+    if isinstance(op_ctx.operation, HistogramMatching):
+        parameters += (op_ctx.operation.bins,)
+    if reduction != 1:
+        # statistics of a reduced decode differ from those in full
+        parameters += (reduction,)
+
+    cache = StatisticsCache(params.cache_dir,
+                            params.cache_size * BYTES_PER_MB)
+    key = cache.key(params.reference_path, *parameters)
+    statistics = cache.get(key)
+    if statistics is None:
+        reference = read_image(params.reference_path, reduction=reduction)
+        statistics = op_ctx.statistics(reference)
+        cache.put(key, statistics, color_space)
+    return statistics
+
+
+def match_statistics(op_ctx: OperationContext, source: np.ndarray,
+                     statistics: Statistics,
+                     match_props: Sequence[float],
+                     statistics_source: Optional[np.ndarray] = None
+                     ) -> List[np.ndarray]:
+    """
+    This function matches the source to the statistics of a reference, if
+    several matching proportions are given it matches the histograms once
+    and returns one result per proportion. The source statistics are
+    computed from the statistics source if it is given, e.g. a reduced
+    decode of the source
+    """
+    if len(match_props) <= 1:
+        return [op_ctx.match_statistics(source, statistics,
+                                        statistics_source)]
+
+    operation = op_ctx.operation
+    if not isinstance(operation, HistogramMatching) or \
+            not isinstance(statistics, Histograms):
+        raise TypeError(
+            f'operation has to be of {repr(HistogramMatching)} type')
+
+    source_statistics = None
+    if statistics_source is not None:
+        source_statistics = op_ctx.statistics(statistics_source)
+    results = operation.sweep_statistics(op_ctx.converter.convert(source),
+                                         statistics, match_props,
+                                         source_statistics)
+    return [op_ctx.converter.convert_back(result) for result in results]
+
+
+def write_reference_histograms(params: Params) -> None:
+    """
+    This function accumulates the histograms of all images in the reference
+    directory and writes them to a statistics file, which can be given in
+    place of a reference image
+    """
+    converter = build_cs_converter(params.color_space)
+    channel_ranges = converter.target_channel_ranges()
+    operation = HistogramMatching(tuple(range(len(channel_ranges))),
+                                  channel_ranges=channel_ranges,
+                                  bins=params.bins)
+    write_dataset_statistics(OperationContext(converter, operation), params)
+
+
+def write_reference_moments(params: Params) -> None:
+    """
+    This function accumulates the moments of all images in the reference
+    directory, i.e. the mean and the covariance of the domain, and writes
+    them to a statistics file, which can be given to Feature Distribution
+    Matching in place of a reference image
+    """
+    converter = build_cs_converter(params.color_space)
+    channel_ranges = converter.target_channel_ranges()
+    operation = FeatureDistributionMatching(
+        tuple(range(len(channel_ranges))), channel_ranges)
+    write_dataset_statistics(OperationContext(converter, operation), params)
+
+
+def write_dataset_statistics(op_ctx: OperationContext,
+                             params: Params) -> None:
+    """
+    This function accumulates the statistics of all images in the reference
+    directory in parallel and writes them to a statistics file, each worker
+    holds one image at a time
+    """
+    statistics = dataset_statistics(op_ctx, image_paths(params.reference_dir),
+                                    params.workers, int(params.reduction))
+    write_statistics(statistics, params.color_space.lower(),
+                     params.result_path)
+
+
+def sweep(op_ctx: OperationContext, source: np.ndarray,
+          reference: np.ndarray,
+          match_props: Sequence[float]) -> List[np.ndarray]:
+    """
+    This function matches the histograms once and returns one result per
+    matching proportion
+    """
+    operation = op_ctx.operation
+    if not isinstance(operation, HistogramMatching):
+        raise TypeError(
+            f'operation has to be of {repr(HistogramMatching)} type')
+
+    results = operation.sweep(op_ctx.converter.convert(source),
+                              op_ctx.converter.convert(reference),
+                              match_props)
+    return [op_ctx.converter.convert_back(result) for result in results]
+
+
+def sweep_result_paths(result_path: str,
+                       match_props: Sequence[float]) -> List[str]:
+    """
+    This function appends each matching proportion to the result path
+    """
+    root, ext = os.path.splitext(result_path)
+    return [f'{root}_{match_prop}{ext}' for match_prop in match_props]
 
 
 def color_check(color_space: str, source: np.ndarray,
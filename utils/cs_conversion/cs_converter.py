@@ -1,9 +1,11 @@
 """This module defines the ColorSpaceConverter interface"""
 import abc
-from typing import NamedTuple, Tuple
+from typing import Callable, NamedTuple, Optional, Tuple
 
 import numpy as np
 
+from core.constants import DIM_4
+
 ChannelRange = NamedTuple('ChannelRange', [('min', float), ('max', float)])
 
 
@@ -23,3 +25,69 @@ class ColorSpaceConverter(abc.ABC):
     @abc.abstractmethod
     def target_channel_ranges(self) -> Tuple[ChannelRange, ...]:
         """ returns the ranges of the color space """
+
+    def convert_batch(self, images: np.ndarray,
+                      dst: Optional[np.ndarray] = None) -> np.ndarray:
+        """ converts a stack of images (N, H, W, C) from source to target
+        color space, the result is written to dst if it is given """
+        return self._batch(self._convert_to, images, dst)
+
+    def convert_back_batch(self, images: np.ndarray,
+                           dst: Optional[np.ndarray] = None) -> np.ndarray:
+        """ converts a stack of images (N, H, W, C) from target color space
+        back to source color space, the result is written to dst if it is
+        given """
+        return self._batch(self._convert_back_to, images, dst)
+
+    def _convert_to(self, image: np.ndarray,
+                    dst: Optional[np.ndarray]) -> np.ndarray:
+        """ converts an image to target color space, converters that can
+        write to dst directly override it """
+        return self._copy_to(self.convert(image), dst)
+
+    def _convert_back_to(self, image: np.ndarray,
+                         dst: Optional[np.ndarray]) -> np.ndarray:
+        """ converts an image back to source color space, converters that
+        can write to dst directly override it """
+        return self._copy_to(self.convert_back(image), dst)
+
+    @staticmethod
+    def _copy_to(result: np.ndarray, dst: Optional[np.ndarray]) -> np.ndarray:
+        """ Returns a result, copied to dst if it is given and not the
+        result itself """
+        if dst is None or result is dst:
+            return result
+        np.copyto(dst, result)
+        return dst
+
+    @staticmethod
+    def _batch(convert: Callable[[np.ndarray, Optional[np.ndarray]],
+                                 np.ndarray],
+               images: np.ndarray, dst: Optional[np.ndarray]) -> np.ndarray:
+        """ Converts a stack as a single image (N * H, W, C), which is a view
+        of the stack if its rows are contiguous, and writes it to dst
+        directly if dst is contiguous """
+        if images.ndim != DIM_4:
+            raise ValueError(f'Images have to be 4 dimensional, but they are '
+                             f'{images.ndim} dimensional')
+        if dst is not None:
+            if not isinstance(dst, np.ndarray):
+                raise TypeError(
+                    f'dst has to be of type {repr(np.ndarray)}')
+            if dst.shape != images.shape:
+                raise ValueError(
+                    f'dst has to be of the images shape {images.shape}, '
+                    f'but it is of shape {dst.shape}')
+
+        n_images, height = images.shape[:2]
+        shape = (n_images * height,) + images.shape[2:]
+        if dst is None:
+            result = convert(images.reshape(shape), None)
+            return result.reshape((n_images, height) + result.shape[1:])
+
+        # a dst that is not contiguous is filled by a copy
+        flat_dst = dst.reshape(shape) if dst.flags.c_contiguous else None
+        result = convert(images.reshape(shape), flat_dst)
+        if result is not flat_dst:
+            np.copyto(dst, result.reshape(dst.shape))
+        return dst
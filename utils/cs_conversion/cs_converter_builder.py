@@ -1,11 +1,14 @@
 """This module contains a function that creates a specified color space
 converter"""
-from core import DIM_1, GRAY, HSV, LAB, RGB
+from core import DIM_1, GRAY, HSV, LAB, OPPONENT, RGB, XYZ, YCBCR
 
 from . import ColorSpaceConverter
 from .cs_identity import IdentityConverter
 from .cs_rgb_to_hsv import RgbToHsvConverter
 from .cs_rgb_to_lab import RgbToLabConverter
+from .cs_rgb_to_opponent import RgbToOpponentConverter
+from .cs_rgb_to_xyz import RgbToXyzConverter
+from .cs_rgb_to_ycbcr import RgbToYCbCrConverter
 
 
 def build_cs_converter(color_space: str) -> ColorSpaceConverter:
@@ -18,7 +21,13 @@ def build_cs_converter(color_space: str) -> ColorSpaceConverter:
         return RgbToHsvConverter()
     if target_color_space == LAB:
         return RgbToLabConverter()
+    if target_color_space == OPPONENT:
+        return RgbToOpponentConverter()
     if target_color_space == RGB:
         return IdentityConverter()
+    if target_color_space == XYZ:
+        return RgbToXyzConverter()
+    if target_color_space == YCBCR:
+        return RgbToYCbCrConverter()
 
     raise ValueError(f'there is no color space converter for {color_space}')
@@ -0,0 +1,79 @@
+"""This module provides a color space converter for color spaces that are a
+linear transformation of rgb"""
+from typing import Optional, Tuple
+
+import numpy as np
+
+from . import ChannelRange, ColorSpaceConverter
+from .cs_identity import RGB_MAX, RGB_MIN
+
+
+class LinearConverter(ColorSpaceConverter):
+    """ this ColorSpaceConverter converts images from rgb to a linear color
+    space and vice versa. The conversion of pixels x (..., C) is x @ matrix,
+    so it can be folded into other linear transformations of the pixels.
+    The box of channel ranges of the linear color space holds colors
+    outside the rgb cube, so images are clipped to the rgb cube when they
+    are converted back """
+
+    def __init__(self, matrix: np.ndarray):
+        matrix = np.asarray(matrix, dtype=float)
+        if matrix.ndim != 2 or matrix.shape[0] != matrix.shape[1]:
+            raise ValueError(f'conversion matrix has to be square, but it is '
+                             f'of shape {matrix.shape}')
+        try:
+            self._inverse = np.linalg.inv(matrix)
+        except np.linalg.LinAlgError as error:
+            raise ValueError('conversion matrix has to be invertible') \
+                from error
+        self._matrix = matrix
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """ Returns the matrix (C, C) that converts pixels to the target
+        color space """
+        return self._matrix
+
+    @property
+    def inverse(self) -> np.ndarray:
+        """ Returns the matrix (C, C) that converts pixels back to the source
+        color space """
+        return self._inverse
+
+    def convert(self, image: np.ndarray) -> np.ndarray:
+        return self._transform(image, self.matrix, None)
+
+    def convert_back(self, image: np.ndarray) -> np.ndarray:
+        return self._clipped(self._transform(image, self.inverse, None))
+
+    def _convert_to(self, image: np.ndarray,
+                    dst: Optional[np.ndarray]) -> np.ndarray:
+        return self._transform(image, self.matrix, dst)
+
+    def _convert_back_to(self, image: np.ndarray,
+                         dst: Optional[np.ndarray]) -> np.ndarray:
+        return self._clipped(self._transform(image, self.inverse, dst))
+
+    def target_channel_ranges(self) -> Tuple[ChannelRange, ...]:
+        # the extremes of a linear function of the rgb cube are at corners
+        minima = RGB_MIN * np.maximum(self.matrix, 0.).sum(axis=0) + \
+            RGB_MAX * np.minimum(self.matrix, 0.).sum(axis=0)
+        maxima = RGB_MAX * np.maximum(self.matrix, 0.).sum(axis=0) + \
+            RGB_MIN * np.minimum(self.matrix, 0.).sum(axis=0)
+        return tuple(ChannelRange(float(minimum), float(maximum))
+                     for minimum, maximum in zip(minima, maxima))
+
+    @staticmethod
+    def _clipped(image: np.ndarray) -> np.ndarray:
+        """ Clips an rgb image to the rgb cube in place """
+        clipped: np.ndarray = np.clip(image, RGB_MIN, RGB_MAX, out=image)
+        return clipped
+
+    @staticmethod
+    def _transform(image: np.ndarray, matrix: np.ndarray,
+                   dst: Optional[np.ndarray]) -> np.ndarray:
+        """ Transforms the pixels of an image (..., C) to a new float32
+        image, or to dst if it is given """
+        transformed: np.ndarray = np.matmul(image, matrix.astype(np.float32),
+                                            out=dst, dtype=np.float32)
+        return transformed
@@ -0,0 +1,211 @@
+"""This module provides a color space converter that converts 8-bit rgb
+images by means of precomputed 3D lookup tables"""
+import weakref
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from . import ChannelRange, ColorSpaceConverter
+from .cs_identity import RGB_MAX, RGB_MIN
+from .cs_rgb_to_hsv import RgbToHsvConverter
+
+# smallest and largest number of samples per axis of a table, a table of
+# the largest size holds all 256^3 8-bit colors
+LUT_MIN_SIZE = 2
+LUT_MAX_SIZE = 256
+
+# largest value of an 8-bit channel
+_UINT8_MAX = 255
+
+# number of pixels interpolated at once, it bounds the temporary memory
+_CHUNK_SIZE = 1 << 16
+
+# largest and smallest deviation of the converted and of the converted back
+# pixels of a LutConverter from those of the converter it wraps
+LutAccuracy = NamedTuple('LutAccuracy', [('max_error', float),
+                                         ('mean_error', float),
+                                         ('max_error_back', float),
+                                         ('mean_error_back', float)])
+
+# tables of a converter built so far, by size and direction
+_Tables = Dict[Tuple[int, bool], np.ndarray]
+
+# tables built so far by converter, they are released with the converter
+_TABLES: 'weakref.WeakKeyDictionary[ColorSpaceConverter, _Tables]' = \
+    weakref.WeakKeyDictionary()
+
+
+class LutConverter(ColorSpaceConverter):
+    """ this ColorSpaceConverter converts 8-bit rgb images by means of a 3D
+    lookup table of another converter, the table is built on first use and
+    shared by all converters of the same converter instance and size.
+
+    The table samples the rgb cube on a grid of the given size per axis and
+    pixels are interpolated trilinearly, so it deviates where the
+    conversion is not smooth. The hue of hsv is interpolated along the
+    shorter arc of its circle, so its wrap from 360 to 0 is no
+    discontinuity.
+
+    The conversion back is done by the converter itself unless an inverse
+    table is requested, which samples the channel ranges of the color space
+    on a grid of the same size. accuracy reports the deviations of both
+    directions from the converter. OpenCV converts faster than the
+    interpolation, the tables serve converters without such an
+    implementation and the study of their accuracy.
+    """
+
+    def __init__(self, converter: ColorSpaceConverter, grid_size: int,
+                 inverse: bool = False):
+        if not isinstance(converter, ColorSpaceConverter):
+            raise TypeError(
+                f'converter has to be of {repr(ColorSpaceConverter)} type')
+        if not isinstance(grid_size, int) or isinstance(grid_size, bool):
+            raise TypeError(f'grid size has to be of type {repr(int)}')
+        if not LUT_MIN_SIZE <= grid_size <= LUT_MAX_SIZE:
+            raise ValueError(f'grid size has to be in range '
+                             f'[{LUT_MIN_SIZE}, {LUT_MAX_SIZE}], '
+                             f'the given value is {grid_size}')
+        self._converter = converter
+        self._grid_size = grid_size
+        self._inverse = bool(inverse)
+
+    @property
+    def converter(self) -> ColorSpaceConverter:
+        """ Returns the converter whose conversion is tabulated """
+        return self._converter
+
+    @property
+    def grid_size(self) -> int:
+        """ Returns the number of samples per axis of the tables """
+        return self._grid_size
+
+    @property
+    def inverse(self) -> bool:
+        """ Returns whether the conversion back uses a table """
+        return self._inverse
+
+    def convert(self, image: np.ndarray) -> np.ndarray:
+        return self._interpolate(image, self._table(False),
+                                 self._rgb_ranges(), self.grid_size,
+                                 self._hue_period())
+
+    def convert_back(self, image: np.ndarray) -> np.ndarray:
+        if not self.inverse:
+            return self.converter.convert_back(image)
+        # the conversion back is continuous in the hue
+        return self._interpolate(image, self._table(True),
+                                 self.target_channel_ranges(),
+                                 self.grid_size)
+
+    def target_channel_ranges(self) -> Tuple[ChannelRange, ...]:
+        return self.converter.target_channel_ranges()
+
+    def accuracy(self, image: np.ndarray) -> LutAccuracy:
+        """ Converts an 8-bit rgb image (H, W, 3) of type uint8 to the color
+        space and back, and reports the absolute deviations of the results
+        from those of the converter, the conversion back starts from the
+        exact conversion. Hues deviate by their shorter arc """
+        rgb = image.astype(np.float32) / np.float32(_UINT8_MAX)
+        expected = self.converter.convert(rgb)
+        expected_back = self.converter.convert_back(expected)
+        error = np.abs(self.convert(image) - expected)
+        period = self._hue_period()
+        if period is not None:
+            error[..., 0] = np.minimum(error[..., 0], period - error[..., 0])
+        error_back = np.abs(self.convert_back(expected) - expected_back)
+        return LutAccuracy(float(np.max(error)), float(np.mean(error)),
+                           float(np.max(error_back)),
+                           float(np.mean(error_back)))
+
+    def _hue_period(self) -> Optional[float]:
+        """ Returns the period of the first converted channel if it is the
+        hue of hsv, otherwise None """
+        if not isinstance(self.converter, RgbToHsvConverter):
+            return None
+        hue_range = self.target_channel_ranges()[0]
+        return hue_range.max - hue_range.min
+
+    def _table(self, inverse: bool) -> np.ndarray:
+        """ Returns the flat table (size^3, C) of a direction, it is built
+        on first use """
+        tables = _TABLES.setdefault(self.converter, {})
+        key = (self.grid_size, inverse)
+        if key not in tables:
+            ranges = self.target_channel_ranges() if inverse \
+                else self._rgb_ranges()
+            grid = self._grid(ranges, self.grid_size)
+            if inverse:
+                table = self.converter.convert_back(grid)
+            else:
+                table = self.converter.convert(grid)
+            tables[key] = np.ascontiguousarray(
+                table.reshape(-1, table.shape[-1]), dtype=np.float32)
+        return tables[key]
+
+    @staticmethod
+    def _rgb_ranges() -> Tuple[ChannelRange, ...]:
+        """ Returns the ranges of the rgb channels """
+        return (ChannelRange(RGB_MIN, RGB_MAX),) * 3
+
+    @staticmethod
+    def _grid(ranges: Tuple[ChannelRange, ...], size: int) -> np.ndarray:
+        """ Returns an image (size^2, size, C) of the colors of a grid of the
+        given size per axis over the channel ranges, the last channel
+        varies fastest """
+        axes = [np.linspace(channel_range.min, channel_range.max, size,
+                            dtype=np.float32) for channel_range in ranges]
+        grid: np.ndarray = np.stack(np.meshgrid(*axes, indexing='ij'),
+                                    axis=-1)
+        return grid.reshape(size * size, size, len(ranges))
+
+    @staticmethod
+    def _interpolate(image: np.ndarray, table: np.ndarray,
+                     ranges: Tuple[ChannelRange, ...], size: int,
+                     period: Optional[float] = None) -> np.ndarray:
+        """ Converts an image (..., 3) by trilinear interpolation of a table
+        that samples the channel ranges on a grid of the given size. The
+        first channel of the table is interpolated circularly if its period
+        is given """
+        minima = np.array([channel_range.min for channel_range in ranges],
+                          dtype=np.float32)
+        scales = np.array([(size - 1) / (channel_range.max -
+                                         channel_range.min)
+                           for channel_range in ranges], dtype=np.float32)
+        if image.dtype == np.uint8:
+            image = image.astype(np.float32) / np.float32(_UINT8_MAX)
+
+        strides = np.array([size * size, size, 1], dtype=np.int32)
+        pixels = image.reshape(-1, image.shape[-1])
+        result = np.empty((len(pixels), table.shape[-1]), dtype=np.float32)
+        for start in range(0, len(pixels), _CHUNK_SIZE):
+            rows = slice(start, start + _CHUNK_SIZE)
+            positions = (pixels[rows] - minima) * scales
+            np.clip(positions, 0., size - 1, out=positions)
+            lower = np.minimum(positions.astype(np.int32), size - 2)
+            fractions = (positions - lower).astype(np.float32)
+            base = lower @ strides
+
+            # interpolate along the last axis, then along the others
+            values = [np.take(table, base + offset, axis=0)
+                      for offset in (0, 1, size, size + 1, size * size,
+                                     size * size + 1, size * size + size,
+                                     size * size + size + 1)]
+            for axis in (2, 1, 0):
+                weight = fractions[:, axis:axis + 1]
+                values = [LutConverter._lerp(low, high, weight, period)
+                          for low, high in zip(values[::2], values[1::2])]
+            result[rows] = values[0]
+        if period is not None:
+            np.mod(result[:, 0], period, out=result[:, 0])
+        return result.reshape(image.shape[:-1] + (table.shape[-1],))
+
+    @staticmethod
+    def _lerp(low: np.ndarray, high: np.ndarray, weight: np.ndarray,
+              period: Optional[float]) -> np.ndarray:
+        """ Interpolates linearly between two samples (P, C), the first
+        channel along the shorter arc of its period if it is given """
+        difference = high - low
+        if period is not None:
+            difference[:, 0] -= period * np.rint(difference[:, 0] / period)
+        interpolated: np.ndarray = low + difference * weight
+        return interpolated
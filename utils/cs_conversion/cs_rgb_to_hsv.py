@@ -1,5 +1,5 @@
 """This module provides a color space converter from rgb to hsv"""
-from typing import Tuple
+from typing import Optional, Tuple
 
 import cv2
 import numpy as np
@@ -22,6 +22,16 @@ class RgbToHsvConverter(ColorSpaceConverter):
     def convert_back(self, image: np.ndarray) -> np.ndarray:
         return cv2.cvtColor(image, cv2.COLOR_HSV2RGB)
 
+    def _convert_to(self, image: np.ndarray,
+                    dst: Optional[np.ndarray]) -> np.ndarray:
+        converted: np.ndarray = cv2.cvtColor(image, cv2.COLOR_RGB2HSV, dst=dst)
+        return converted
+
+    def _convert_back_to(self, image: np.ndarray,
+                         dst: Optional[np.ndarray]) -> np.ndarray:
+        converted: np.ndarray = cv2.cvtColor(image, cv2.COLOR_HSV2RGB, dst=dst)
+        return converted
+
     def target_channel_ranges(self) -> Tuple[ChannelRange, ...]:
         return (ChannelRange(H_MIN, H_MAX),
                 ChannelRange(SV_MIN, SV_MAX),
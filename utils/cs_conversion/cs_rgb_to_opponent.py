@@ -0,0 +1,21 @@
+"""This module provides a color space converter from rgb to the opponent
+color space"""
+import numpy as np
+
+from .cs_linear import LinearConverter
+
+# orthonormal conversion of rgb pixels to the red-green, yellow-blue and
+# intensity channels of the opponent color space, o = rgb @ RGB_2_OPPONENT
+RGB_2_OPPONENT = np.array([[1. / np.sqrt(2.), 1. / np.sqrt(6.),
+                            1. / np.sqrt(3.)],
+                           [-1. / np.sqrt(2.), 1. / np.sqrt(6.),
+                            1. / np.sqrt(3.)],
+                           [0., -2. / np.sqrt(6.), 1. / np.sqrt(3.)]])
+
+
+class RgbToOpponentConverter(LinearConverter):
+    """ this ColorSpaceConverter converts images from rgb to the opponent
+    color space and vice versa """
+
+    def __init__(self) -> None:
+        super().__init__(RGB_2_OPPONENT)
@@ -0,0 +1,18 @@
+"""This module provides a color space converter from linear rgb to xyz"""
+import numpy as np
+
+from .cs_linear import LinearConverter
+
+# conversion of linear srgb pixels to cie xyz with the d65 white point,
+# xyz = rgb @ RGB_2_XYZ
+RGB_2_XYZ = np.array([[0.4124564, 0.2126729, 0.0193339],
+                      [0.3575761, 0.7151522, 0.1191920],
+                      [0.1804375, 0.0721750, 0.9503041]])
+
+
+class RgbToXyzConverter(LinearConverter):
+    """ this ColorSpaceConverter converts images from linear rgb to xyz
+    and vice versa, gamma-encoded rgb values are taken as they are """
+
+    def __init__(self) -> None:
+        super().__init__(RGB_2_XYZ)
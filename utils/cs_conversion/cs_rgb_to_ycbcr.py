@@ -0,0 +1,18 @@
+"""This module provides a color space converter from rgb to ycbcr"""
+import numpy as np
+
+from .cs_linear import LinearConverter
+
+# full-range ITU-R BT.601 conversion of rgb pixels to ycbcr with chroma
+# channels centered at zero, ycbcr = rgb @ RGB_2_YCBCR
+RGB_2_YCBCR = np.array([[0.299, -0.168735892, 0.5],
+                        [0.587, -0.331264108, -0.418687589],
+                        [0.114, 0.5, -0.081312411]])
+
+
+class RgbToYCbCrConverter(LinearConverter):
+    """ this ColorSpaceConverter converts images from rgb to ycbcr
+    and vice versa """
+
+    def __init__(self) -> None:
+        super().__init__(RGB_2_YCBCR)
@@ -0,0 +1,54 @@
+"""This module provides functions to accumulate the statistics of a dataset
+of reference images"""
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, List, Sequence
+
+from matching.operation_context import OperationContext
+
+from .image_io import IMAGE_EXTENSIONS, read_image
+
+
+def image_paths(directory: str) -> List[str]:
+    """ This function lists the image files of a directory in sorted
+    order """
+    if not os.path.isdir(directory):
+        raise ValueError(f'Invalid directory {directory}')
+    return [os.path.join(directory, name)
+            for name in sorted(os.listdir(directory))
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS]
+
+
+def dataset_statistics(op_ctx: OperationContext, paths: Sequence[str],
+                       workers: int = 1, reduction: int = 1) -> Any:
+    """
+    This function accumulates the statistics of the converted images of a
+    dataset. The images are split into one chunk per worker process, the
+    chunks are accumulated in parallel and their statistics are merged.
+    The images are decoded at 1/reduction of their resolution.
+    """
+    if not paths:
+        raise ValueError('there are no images in the dataset')
+    if workers < 1:
+        raise ValueError(f'the number of workers has to be at least 1, '
+                         f'the given value is {workers}')
+
+    if workers == 1:
+        return _chunk_statistics(op_ctx, paths, reduction)
+
+    chunks = [paths[idx::workers] for idx in range(min(workers, len(paths)))]
+    with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+        statistics = list(executor.map(_chunk_statistics,
+                                       [op_ctx] * len(chunks), chunks,
+                                       [reduction] * len(chunks)))
+    return functools.reduce(op_ctx.operation.merge_statistics, statistics)
+
+
+def _chunk_statistics(op_ctx: OperationContext, paths: Sequence[str],
+                      reduction: int = 1) -> Any:
+    """ This function accumulates the statistics of a chunk of images, only
+    one image is held in memory at a time """
+    return op_ctx.operation.tile_statistics(
+        op_ctx.converter.convert(read_image(path, reduction=reduction))
+        for path in paths)
@@ -4,29 +4,98 @@ import os
 import cv2
 import numpy as np
 
-from core.constants import DIM_1, DIM_2
+from core.constants import DIM_1, DIM_2, REDUCTIONS
 
 MAX_VALUE_8_BIT = 255
+MAX_VALUE_16_BIT = 65535
 
+# extensions of the image files of a dataset
+IMAGE_EXTENSIONS = ('.bmp', '.jpeg', '.jpg', '.png', '.tif', '.tiff')
 
-def read_image(path: str) -> np.ndarray:
-    """ This function reads an image and transforms it to RGB color space """
+# extensions of the images that OpenCV decodes at reduced resolution
+# directly, others are decoded in full and downscaled
+_REDUCED_DECODE_EXTENSIONS = ('.jpeg', '.jpg')
+
+# reduced decoding flags of OpenCV by reduction, gray images stay gray
+_REDUCED_DECODE_FLAGS = {
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2 | cv2.IMREAD_ANYCOLOR,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4 | cv2.IMREAD_ANYCOLOR,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8 | cv2.IMREAD_ANYCOLOR}
+
+# value of full intensity of the integer types of images
+_MAX_VALUES = {np.dtype(np.uint8): MAX_VALUE_8_BIT,
+               np.dtype(np.uint16): MAX_VALUE_16_BIT}
+
+
+def max_value(dtype: np.dtype) -> int:
+    """ This function returns the value of full intensity of an integer
+    image type, by which it is scaled to float """
+    if np.dtype(dtype) not in _MAX_VALUES:
+        raise TypeError(f'Images of type {dtype} have no integer scaling, '
+                        f'supported types are {tuple(_MAX_VALUES)}')
+    return _MAX_VALUES[np.dtype(dtype)]
+
+
+def to_float(image: np.ndarray) -> np.ndarray:
+    """ This function scales an uint8 or uint16 image to a float32 image in
+    range [0, 1] in a single allocation, float32 images are returned as
+    they are """
+    if image.dtype == np.float32:
+        return image
+    scaled: np.ndarray = np.divide(image, np.float32(max_value(image.dtype)),
+                                   dtype=np.float32)
+    return scaled
+
+
+def read_image(path: str, native: bool = False,
+               reduction: int = 1) -> np.ndarray:
+    """ This function reads an image and transforms it to RGB color space,
+    the channels are reordered in place. The image is scaled to float32 in
+    range [0, 1] by the maximum of its type, or returned in its native type,
+    e.g. uint8 or uint16, if native is set. If a reduction is given, the
+    image is decoded at 1/reduction of its width and height, e.g. for
+    images that only contribute statistics """
+    if reduction not in REDUCTIONS:
+        raise ValueError(f'reduction has to be one of {REDUCTIONS}, '
+                         f'the given value is {reduction}')
     if os.path.exists(path):
-        image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
-        image = image.astype(np.float32) / MAX_VALUE_8_BIT
+        image = _decode(path, reduction)
         if image.ndim == DIM_2:
-            return image[:, :, np.newaxis]
-        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            image = image[:, :, np.newaxis]
+        else:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image)
+        return image if native else to_float(image)
 
     raise ValueError(f'Invalid image path {path}')
 
 
+def _decode(path: str, reduction: int) -> np.ndarray:
+    """ This function decodes an image at 1/reduction resolution, JPEG
+    images by the reduced decoding of OpenCV, which decodes 8-bit images
+    only, and all others in full followed by an area downscale """
+    if reduction != 1 and \
+            os.path.splitext(path)[1].lower() in _REDUCED_DECODE_EXTENSIONS:
+        reduced: np.ndarray = cv2.imread(path,
+                                         _REDUCED_DECODE_FLAGS[reduction])
+        return reduced
+
+    image: np.ndarray = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if reduction == 1:
+        return image
+    height, width = image.shape[:2]
+    size = (max(1, width // reduction), max(1, height // reduction))
+    downscaled: np.ndarray = cv2.resize(image, size,
+                                        interpolation=cv2.INTER_AREA)
+    return downscaled
+
+
 def write_image(image: np.ndarray, path: str) -> None:
     """ This function transforms an image to BGR color space
-    and writes it to disk """
+    and writes it to disk, uint8 and uint16 images are written as they are
+    and float32 images in range [0, 1] as 8-bit images """
     if image.dtype == np.float32:
         image = (image * MAX_VALUE_8_BIT).astype(np.uint8)
-    if image.dtype == np.uint8:
+    if image.dtype in _MAX_VALUES:
         if image.shape[-1] == DIM_1:
             output_image = image[:, :, 0]
         else:
@@ -0,0 +1,120 @@
+"""This module provides a persistent cache of the statistics of reference
+images"""
+import hashlib
+import os
+import re
+import tempfile
+from typing import Optional
+
+from .statistics_io import (STATISTICS_EXT, Statistics, read_statistics,
+                            write_statistics)
+
+# default size limit of the cache in bytes
+DEFAULT_CACHE_SIZE = 1 << 28
+
+# version of the format of the cache entries, it is part of the keys
+_CACHE_VERSION = 1
+
+# size of the blocks in which reference files are hashed
+_HASH_BLOCK_SIZE = 1 << 20
+
+# names of the cache entries, temporary files do not match
+_ENTRY_NAME = re.compile(r'[0-9a-f]{64}' + re.escape(STATISTICS_EXT))
+
+
+class StatisticsCache:
+    """ This class stores the statistics of reference images in a directory.
+    The entries are keyed by the content hash of a reference file and the
+    parameters of its statistics, the least recently used entries are
+    evicted once the cache exceeds its size limit. Entries are written to
+    temporary files that are renamed atomically, so the cache can be shared
+    by concurrent processes """
+
+    def __init__(self, directory: str, max_size: int = DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self._directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def directory(self) -> str:
+        """ Returns the directory of the cache """
+        return self._directory
+
+    @property
+    def max_size(self) -> int:
+        """ Returns the size limit of the cache in bytes """
+        return self._max_size
+
+    @max_size.setter
+    def max_size(self, max_size: int) -> None:
+        if not isinstance(max_size, int) or isinstance(max_size, bool):
+            raise TypeError(f'cache size has to be of type {repr(int)}')
+        if max_size < 0:
+            raise ValueError(f'cache size has to be non-negative, '
+                             f'the given value is {max_size}')
+        self._max_size = max_size
+
+    @staticmethod
+    def key(reference_path: str, *parameters: object) -> str:
+        """ Returns the key of the statistics of a reference file computed
+        with the given parameters, the file is hashed without decoding """
+        digest = hashlib.sha256()
+        with open(reference_path, 'rb') as reference_file:
+            for block in iter(lambda: reference_file.read(_HASH_BLOCK_SIZE),
+                              b''):
+                digest.update(block)
+        digest.update(repr((_CACHE_VERSION,) + parameters).encode())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Statistics]:
+        """ Returns the cached statistics or None if there are none, a hit
+        marks the entry as recently used """
+        path = self._path(key)
+        try:
+            statistics, _ = read_statistics(path)
+            os.utime(path)
+        except (OSError, ValueError):
+            # the entry is missing or was evicted by another process
+            return None
+        return statistics
+
+    def put(self, key: str, statistics: Statistics, color_space: str) -> None:
+        """ Stores statistics and evicts the least recently used entries if
+        the cache exceeds its size limit """
+        handle, temp_path = tempfile.mkstemp(suffix=STATISTICS_EXT,
+                                             dir=self.directory)
+        os.close(handle)
+        try:
+            write_statistics(statistics, color_space, temp_path)
+            os.replace(temp_path, self._path(key))
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self._evict()
+
+    def _path(self, key: str) -> str:
+        """ Returns the path of an entry """
+        return os.path.join(self.directory, key + STATISTICS_EXT)
+
+    def _evict(self) -> None:
+        """ Removes the least recently used entries until the cache fits
+        into its size limit, entries removed concurrently are skipped """
+        entries = []
+        for name in os.listdir(self.directory):
+            if _ENTRY_NAME.fullmatch(name):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
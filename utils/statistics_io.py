@@ -0,0 +1,71 @@
+"""This module provides functions to read and write the statistics of
+reference images, e.g. those of a dataset"""
+import os
+from typing import Dict, Tuple, Type, Union
+
+import numpy as np
+
+from core.constants import FDM, HM, MSM
+from matching.operations.feature_distribution_matching import Moments
+from matching.operations.histogram_matching import Histograms
+
+STATISTICS_EXT = '.npz'
+
+Statistics = Union[Histograms, Moments]
+
+# statistics types of the matching operations, statistics shared by several
+# operations belong to the first of them
+_STATISTICS_TYPES: Dict[str, Type[Statistics]] = {HM: Histograms,
+                                                  FDM: Moments,
+                                                  MSM: Moments}
+
+
+def is_statistics_file(path: str) -> bool:
+    """ This function checks whether a path names a statistics file """
+    return os.path.splitext(path)[1].lower() == STATISTICS_EXT
+
+
+def statistics_type(operation: str) -> Type[Statistics]:
+    """ This function returns the statistics type of a matching operation """
+    if operation not in _STATISTICS_TYPES:
+        raise ValueError(f'there are no statistics of operation {operation}')
+    return _STATISTICS_TYPES[operation]
+
+
+def statistics_operation(statistics: Statistics) -> str:
+    """ This function returns the matching operation of statistics """
+    for operation, statistics_type in _STATISTICS_TYPES.items():
+        if isinstance(statistics, statistics_type):
+            return operation
+    raise TypeError(f'there is no matching operation for statistics of '
+                    f'type {type(statistics)}')
+
+
+def write_statistics(statistics: Statistics, color_space: str,
+                     path: str) -> None:
+    """ This function writes the statistics of a reference in a color space
+    to a compressed file """
+    if not is_statistics_file(path):
+        raise ValueError(f'Statistics file {path} has to have the '
+                         f'extension {STATISTICS_EXT}')
+    np.savez_compressed(path, operation=statistics_operation(statistics),
+                        color_space=color_space, **statistics._asdict())
+
+
+def read_statistics(path: str) -> Tuple[Statistics, str]:
+    """ This function reads the statistics of a reference and their color
+    space """
+    if not os.path.exists(path):
+        raise ValueError(f'Invalid statistics path {path}')
+
+    with np.load(path) as data:
+        operation = str(data['operation'])
+        if operation not in _STATISTICS_TYPES:
+            raise ValueError(f'Statistics file {path} contains statistics '
+                             f'of an unknown operation {operation}')
+
+        statistics_type = _STATISTICS_TYPES[operation]
+        # scalars are stored as 0-dimensional arrays
+        fields = [data[field].item() if data[field].ndim == 0
+                  else data[field] for field in statistics_type._fields]
+        return statistics_type(*fields), str(data['color_space'])